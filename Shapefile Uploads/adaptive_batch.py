@@ -0,0 +1,125 @@
+"""
+Adaptive write batch sizing
+Splits each page of records into write batches whose size follows the
+database: batches grow while they finish under a latency target, shrink in
+proportion when they run slow, and are halved and retried when a batch hits
+a statement timeout or the request payload limit (and never grow back to a
+size that failed). A failing batch is only given up on once it is down to the
+minimum size, so no batch is dropped just because a fixed size was too large.
+"""
+
+import threading
+import time
+
+DEFAULT_TARGET_SECONDS = 2.0
+DEFAULT_MIN_BATCH_SIZE = 25
+GROWTH = 1.25
+
+# Fragments of errors that mean "this batch is too big", from PostgREST/Postgres/httpx
+SIZE_ERROR_MARKERS = (
+    '57014',  # query_canceled (statement timeout)
+    'statement timeout',
+    'canceling statement',
+    'payload too large',
+    'request entity too large',
+    'timed out',
+    'timeout',
+)
+
+
+def is_batch_size_error(error):
+    """True for timeouts and payload-limit errors, which a smaller batch can avoid"""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in (413, 504):
+        return True
+    if str(getattr(error, 'code', '')) in ('57014', '413', '504'):
+        return True
+    if 'Timeout' in type(error).__name__:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in SIZE_ERROR_MARKERS)
+
+
+class AdaptiveBatcher:
+    """
+    Batch size controller shared by every upload worker of a run
+
+    Args:
+        initial: Starting batch size
+        maximum: Largest batch size (batches never span pages, so the page size is the natural cap)
+        minimum: Smallest batch size; a batch failing at this size raises
+        target_seconds: Latency a batch should stay under
+    """
+
+    def __init__(self, initial, maximum=None, minimum=DEFAULT_MIN_BATCH_SIZE,
+                 target_seconds=DEFAULT_TARGET_SECONDS):
+        self.maximum = maximum or initial
+        self.minimum = min(minimum, self.maximum)
+        self.size = max(self.minimum, min(initial, self.maximum))
+        self.target_seconds = target_seconds
+        self.ceiling = self.maximum  # Kept a quarter below the smallest batch that failed
+        self.smallest = self.size
+        self.largest = self.size
+        self.splits = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def _set_size(self, size):
+        self.size = max(self.minimum, min(self.ceiling, int(size)))
+        self.smallest = min(self.smallest, self.size)
+        self.largest = max(self.largest, self.size)
+
+    def _observe(self, batch_size, elapsed):
+        """Grow after a fast full-size batch, scale down after a slow one"""
+        with self._lock:
+            self.batches += 1
+            if elapsed > self.target_seconds:
+                self._set_size(min(self.size, batch_size * self.target_seconds / elapsed))
+            elif elapsed < self.target_seconds / 2 and batch_size >= self.size:
+                self._set_size(max(self.size + 1, self.size * GROWTH))
+
+    def _split(self, batch_size):
+        with self._lock:
+            self.splits += 1
+            self.ceiling = max(self.minimum, min(self.ceiling, batch_size * 3 // 4))
+            self._set_size(min(self.size, batch_size // 2))
+
+    def write(self, records, write):
+        """
+        Write records in adaptively sized batches
+
+        Args:
+            records: Records to write
+            write: Function batch -> count written; raises on failure
+
+        Returns:
+            Sum of write's return values
+        """
+        total = 0
+        start = 0
+        while start < len(records):
+            batch = records[start:start + self.size]
+            began = time.perf_counter()
+            try:
+                total += write(batch)
+            except Exception as e:
+                if len(batch) <= self.minimum or not is_batch_size_error(e):
+                    raise
+                self._split(len(batch))
+                print(f"\nBatch of {len(batch):,} failed ({str(e)[:80]}), retrying in batches of {self.size:,}")
+                continue
+            self._observe(len(batch), time.perf_counter() - began)
+            start += len(batch)
+        return total
+
+    def summary(self):
+        return (f"Batch size settled at {self.size:,} (range {self.smallest:,}-{self.largest:,}, "
+                f"{self.batches:,} batches, {self.splits:,} split after timeout/payload errors)")
+
+
+def add_batch_arguments(parser):
+    """Add the adaptive batching options to a script's argparse parser"""
+    parser.add_argument('--target-batch-seconds', type=float, default=DEFAULT_TARGET_SECONDS,
+                        help=f'Latency each write batch should stay under (default: {DEFAULT_TARGET_SECONDS})')
+    parser.add_argument('--min-batch-size', type=int, default=DEFAULT_MIN_BATCH_SIZE,
+                        help=f'Smallest write batch before an error is reported (default: {DEFAULT_MIN_BATCH_SIZE})')
@@ -0,0 +1,252 @@
+"""
+Batched upsert writer for the Airtable REST API
+Airtable takes at most 10 records per create/update request and allows 5
+requests per second per base. Records are grouped into 10-record PATCH
+requests with performUpsert, merging on a key field (APN), so re-running a
+sync updates the rows it created last time instead of adding duplicates.
+
+A few worker threads send the batches from a bounded queue, so request
+latency overlaps; every request still goes through the shared 'airtable'
+limiter (rate_limit.py), which keeps the total under 5 req/s and backs off
+on 429.
+
+For a diff sync, load_record_index() pages through the table once and
+returns key -> (record ID, fingerprint of the synced fields); only records
+that are new or whose fingerprint differs then need a request, through
+add() (creates) and update(), plus delete() for keys that went away.
+
+Typical use:
+    with AirtableUpsertWriter(url, token, merge_on=['APN']) as writer:
+        for fields in records:
+            writer.add(fields)
+    print(writer.summary())
+"""
+
+import queue
+import threading
+
+import requests
+
+from rate_limit import get_limiter, request_with_retry
+from sync_state import record_fingerprint
+
+AIRTABLE_BATCH_SIZE = 10  # Airtable's per-request record limit
+AIRTABLE_PAGE_SIZE = 100  # Airtable's list page limit
+DEFAULT_AIRTABLE_WORKERS = 4
+
+_DONE = object()
+
+
+def auth_headers(token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+
+def fields_fingerprint(fields, names):
+    """
+    Content hash of the synced fields of a record
+
+    Airtable leaves empty fields out of its responses, so empty strings and
+    None are dropped, and numbers compare as floats (a Property Value of 1500
+    comes back as 1500, not 1500.0).
+    """
+    normalized = {}
+    for name in names:
+        value = fields.get(name)
+        if value is None or value == '':
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        normalized[name] = value
+    return record_fingerprint(normalized)
+
+
+def load_record_index(url, token, key_field, names):
+    """
+    Page through a table once and index its records by key field
+
+    Args:
+        url: Table URL
+        token: Airtable personal access token
+        key_field: Field identifying a record (e.g. 'APN')
+        names: Synced field names; only these are fetched and fingerprinted
+
+    Returns:
+        (dict key -> (record ID, fingerprint), list of record IDs repeating a key
+        already indexed, e.g. duplicates left by create-only runs)
+    """
+    session = requests.Session()
+    limiter = get_limiter('airtable')
+    params = [('pageSize', AIRTABLE_PAGE_SIZE)] + [('fields[]', name) for name in names]
+    index = {}
+    duplicates = []
+    offset = None
+
+    try:
+        while True:
+            page_params = params + ([('offset', offset)] if offset else [])
+            response = request_with_retry(session, 'GET', url, limiter, params=page_params,
+                                          headers=auth_headers(token), timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            for record in data.get('records', []):
+                fields = record.get('fields', {})
+                key = fields.get(key_field)
+                if key is None or key == '':
+                    continue
+                if key in index:
+                    duplicates.append(record['id'])
+                else:
+                    index[key] = (record['id'], fields_fingerprint(fields, names))
+            offset = data.get('offset')
+            if not offset:
+                break
+    finally:
+        session.close()
+
+    return index, duplicates
+
+
+class AirtableUpsertWriter:
+    """
+    Upserts (and updates or deletes by record ID) records in one Airtable table, 10 per request
+
+    Args:
+        url: Table URL ({AIRTABLE_API_URL}/{base}/{table})
+        token: Airtable personal access token
+        merge_on: Field names identifying a record (performUpsert fieldsToMergeOn)
+        workers: Requests in flight at once (all share the 5 req/s limiter)
+        progress: Optional callback(number_of_records) called as batches finish
+    """
+
+    def __init__(self, url, token, merge_on=('APN',), workers=DEFAULT_AIRTABLE_WORKERS, progress=None):
+        self.url = url
+        self.headers = auth_headers(token)
+        self.merge_on = list(merge_on)
+        self.progress = progress
+        self.session = requests.Session()
+        self.limiter = get_limiter('airtable')
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.failed = 0
+        self._pending = {'upsert': [], 'update': [], 'delete': []}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max(1, workers) * 2)
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, fields):
+        """Queue one record's fields for an upsert; blocks while the send queue is full"""
+        self._queue_record('upsert', {"fields": fields})
+
+    def update(self, record_id, fields):
+        """Queue an update of a known record (fields set to None are cleared)"""
+        self._queue_record('update', {"id": record_id, "fields": fields})
+
+    def delete(self, record_id):
+        """Queue a record for deletion"""
+        self._queue_record('delete', record_id)
+
+    def _queue_record(self, kind, record):
+        pending = self._pending[kind]
+        pending.append(record)
+        if len(pending) == AIRTABLE_BATCH_SIZE:
+            self._queue.put((kind, pending))
+            self._pending[kind] = []
+
+    def flush(self):
+        """Send the partly filled batches, if any"""
+        for kind, pending in self._pending.items():
+            if pending:
+                self._queue.put((kind, pending))
+                self._pending[kind] = []
+
+    def close(self):
+        """Send what is left and wait for every request to finish"""
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            kind, batch = item
+            try:
+                self._send(kind, batch)
+            except Exception as e:
+                print(f"\nException sending {len(batch)} records ({kind}): {e}")
+                self._finish(failed=len(batch))
+
+    def _send(self, kind, batch):
+        """Send one batch; a rejected batch is retried record by record to isolate the bad one"""
+        # Paced and retried by the shared Airtable limiter (5 req/s, honors Retry-After on 429)
+        if kind == 'delete':
+            response = request_with_retry(self.session, 'DELETE', self.url, self.limiter,
+                                          params=[('records[]', record_id) for record_id in batch],
+                                          headers=self.headers, timeout=30)
+        else:
+            payload = {"records": batch}
+            if kind == 'upsert':
+                payload["performUpsert"] = {"fieldsToMergeOn": self.merge_on}
+            response = request_with_retry(self.session, 'PATCH', self.url, self.limiter,
+                                          json=payload, headers=self.headers, timeout=30)
+
+        if response.status_code == 200:
+            records = response.json().get('records', [])
+            if kind == 'delete':
+                self._finish(deleted=len(records))
+            elif kind == 'upsert':
+                created = len(response.json().get('createdRecords', []))
+                self._finish(created=created, updated=len(records) - created)
+            else:
+                self._finish(updated=len(records))
+        elif len(batch) > 1 and response.status_code == 422:
+            # Airtable rejects the whole request (422) if any one record is invalid
+            for record in batch:
+                self._send(kind, [record])
+        else:
+            if kind == 'delete':
+                keys = f"records {', '.join(batch)}"
+            else:
+                keys = f"{self.merge_on[0]} {', '.join(str(r['fields'].get(self.merge_on[0])) for r in batch)}"
+            print(f"\nError ({kind}) for {keys}: {response.text}")
+            self._finish(failed=len(batch))
+
+    def _finish(self, created=0, updated=0, deleted=0, failed=0):
+        with self._lock:
+            self.created += created
+            self.updated += updated
+            self.deleted += deleted
+            self.failed += failed
+        if self.progress is not None:
+            self.progress(created + updated + deleted + failed)
+
+    def summary(self):
+        return f"{self.created} created, {self.updated} updated, {self.deleted} deleted, {self.failed} failed"
+
+
+def add_airtable_arguments(parser):
+    """Add the Airtable writer options to a script's argparse parser"""
+    parser.add_argument('--airtable-workers', type=int, default=DEFAULT_AIRTABLE_WORKERS,
+                        help=f'Upsert requests in flight at once, all kept under Airtable\'s 5 req/s '
+                             f'(default: {DEFAULT_AIRTABLE_WORKERS})')
+    parser.add_argument('--diff', action='store_true',
+                        help='Read the table first and only send new and changed records')
+    parser.add_argument('--delete', action='store_true',
+                        help='With --diff, also delete records whose key is no longer in the input '
+                             '(and duplicate records for one key)')
@@ -1,26 +1,52 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+from reproject import Reprojector
+from shapefile_chunks import iter_chunks
 
-# Read the shapefile
-gdf = gpd.read_file('C:/Dev/Parcel-Data/Parcels_Davis.shp')
+SHAPEFILE_PATH = 'C:/Dev/Parcel-Data/Parcels_Davis.shp'
 
-# Show first 5 rows with all columns
-print('=== SAMPLE DATA (first 5 rows) ===')
-pd.set_option('display.max_columns', None)
-pd.set_option('display.width', None)
-print(gdf.head(5))
 
-print('\n=== COLUMN INFO ===')
-for col in gdf.columns:
-    if col != 'geometry':
-        non_null = gdf[col].notna().sum()
-        total = len(gdf)
-        sample = gdf[col].dropna().head(3).tolist()
-        print(f'{col}: {non_null}/{total} filled | Sample: {sample}')
+# Guarded: the reprojection pool's worker processes import this module
+if __name__ == '__main__':
+    # Read only the first rows for the sample
+    sample_gdf = gpd.read_file(SHAPEFILE_PATH, rows=5)
 
-# Calculate acreage from geometry
-print('\n=== GEOMETRY INFO ===')
-gdf_wgs84 = gdf.to_crs(epsg=4326)
-gdf_utm = gdf_wgs84.to_crs(epsg=26912)  # UTM Zone 12N for Utah
-gdf_utm['calculated_acres'] = gdf_utm.geometry.area / 4046.86  # Convert sq meters to acres
-print(f'Sample calculated acreages: {gdf_utm["calculated_acres"].head(5).tolist()}')
+    # Show first 5 rows with all columns
+    print('=== SAMPLE DATA (first 5 rows) ===')
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', None)
+    print(sample_gdf)
+
+    # Stream the file in chunks to collect per-column fill counts, samples and acreage
+    # (UTM area only, no WGS84 output; projected across a process pool)
+    non_null = {}
+    samples = {}
+    total = 0
+    acre_totals = []
+    reprojector = Reprojector()
+    for chunk in iter_chunks(SHAPEFILE_PATH):
+        total += len(chunk)
+        acres = reprojector.acreage(chunk)
+        acres = acres[~np.isnan(acres)]
+        if len(acres):
+            acre_totals.append((len(acres), acres.sum(), acres.min(), acres.max()))
+        for col in chunk.columns:
+            if col == 'geometry':
+                continue
+            non_null[col] = non_null.get(col, 0) + int(chunk[col].notna().sum())
+            if len(samples.setdefault(col, [])) < 3:
+                samples[col].extend(chunk[col].dropna().head(3 - len(samples[col])).tolist())
+
+    print('\n=== COLUMN INFO ===')
+    for col in non_null:
+        print(f'{col}: {non_null[col]}/{total} filled | Sample: {samples[col]}')
+
+    # Acreage from geometry (UTM Zone 12N area)
+    print('\n=== GEOMETRY INFO ===')
+    print(f'Sample calculated acreages: {reprojector.acreage(sample_gdf).tolist()}')
+    reprojector.close()
+    if acre_totals:
+        counts, sums, mins, maxes = zip(*acre_totals)
+        print(f'Calculated acreage: {sum(sums):,.1f} acres over {sum(counts):,} parcels '
+              f'(min {min(mins):.3f}, max {max(maxes):,.1f})')
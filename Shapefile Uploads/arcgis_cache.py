@@ -0,0 +1,141 @@
+"""
+On-disk response cache for ArcGIS REST queries
+Responses are stored under a hash of the service URL plus query parameters,
+expire after a configurable TTL and are evicted least-recently-used once the
+cache grows past its size limit. Offline mode replays cached responses only.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.arcgis_cache')
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_MB = 2048
+
+
+class PageCache:
+    """
+    Content-addressed cache of raw response bodies
+
+    Args:
+        directory: Cache directory (created if missing)
+        ttl_hours: Age after which a cached response is refetched
+        max_mb: Size limit; least recently used entries are evicted past it
+        offline: Serve only from the cache, ignoring the TTL, and never hit the network
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl_hours=DEFAULT_TTL_HOURS,
+                 max_mb=DEFAULT_MAX_MB, offline=False):
+        self.directory = directory
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def key(self, url, params):
+        """Hash a URL and its query parameters into a cache key"""
+        canonical = json.dumps([url, sorted((str(k), str(v)) for k, v in params.items())])
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def _entries(self):
+        """List cached files as (path, size, last access time)"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.bin'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, url, params):
+        """
+        Look up a cached response body
+
+        Returns:
+            The body as bytes, or None on a miss or an expired entry
+        """
+        path = self._path(self.key(url, params))
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                if not self.offline and time.time() - header['stored_at'] > self.ttl_seconds:
+                    self.misses += 1
+                    return None
+                content = f.read()
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        # Touch the file so eviction sees it as recently used
+        os.utime(path)
+        self.hits += 1
+        return content
+
+    def put(self, url, params, content):
+        """Store a response body, evicting old entries if the cache is over its limit"""
+        path = self._path(self.key(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        header = json.dumps({'url': url, 'params': params, 'stored_at': time.time()}, default=str)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header.encode('utf-8') + b'\n')
+            f.write(content)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def summary(self):
+        """One-line hit/miss summary for the end of a run"""
+        return f"Cache: {self.hits:,} hits, {self.misses:,} misses ({self._total_bytes / 1024 / 1024:,.1f} MB on disk)"
+
+
+def add_cache_arguments(parser):
+    """Add the response cache options to a script's argparse parser"""
+    parser.add_argument('--cache', action='store_true',
+                        help='Cache ArcGIS responses on disk and reuse them on later runs')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Response cache directory (default: .arcgis_cache next to the scripts)')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS,
+                        help=f'Hours before a cached response is refetched (default: {DEFAULT_TTL_HOURS})')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'Cache size limit in MB, least recently used pages are evicted (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--offline', action='store_true',
+                        help='Replay cached responses only, never call the ArcGIS service')
+
+
+def cache_from_args(args):
+    """Build a PageCache from the options added by add_cache_arguments (None if disabled)"""
+    if not (args.cache or args.offline):
+        return None
+    return PageCache(args.cache_dir, ttl_hours=args.cache_ttl, max_mb=args.cache_max_mb, offline=args.offline)
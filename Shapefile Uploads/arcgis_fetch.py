@@ -0,0 +1,302 @@
+"""
+Shared ArcGIS REST fetch engine for the parcel and LIR sync scripts
+Keeps several page requests in flight over one pooled HTTP session and
+hands pages back in order, so the sync loops consume the same pages as before
+
+Responses can be kept in an on-disk cache (arcgis_cache.py) so re-runs and
+--offline replays cost no network time. Pages can optionally be requested as f=pbf (ArcGIS protobuf with quantized
+geometry) and decoded back into the same feature dicts, a smaller download for more decode CPU, see arcgis_pbf.py
+
+Every request goes through the shared per-host rate limiter (rate_limit.py),
+which backs off on 429/5xx and ramps back up while the service is healthy
+
+Two paging modes are supported:
+  offset - resultOffset/resultRecordCount (slows down at deep offsets)
+  keyset - pull the OBJECTID list once, then query fixed OBJECTID ranges,
+           so every page costs the same and a failed range can be retried alone
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from arcgis_cache import add_cache_arguments, cache_from_args
+from arcgis_pbf import QUANTIZATION_PARAMETERS, decode_features
+from metrics import recorder
+from rate_limit import backoff_delay, get_limiter, request_with_retry
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PAGING = 'keyset'
+PAGING_MODES = ('keyset', 'offset')
+REQUEST_TIMEOUT = 60
+MAX_RETRIES = 3
+
+
+def create_session(pool_size=DEFAULT_CONCURRENCY):
+    """Create a requests session whose connection pool fits pool_size parallel requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ArcGISLayer:
+    """
+    One ArcGIS FeatureServer/MapServer layer queried over a pooled session
+
+    Args:
+        url: Layer URL (without the trailing /query)
+        concurrency: Number of page requests kept in flight by iter_pages
+        paging: 'keyset' (OBJECTID ranges) or 'offset' (resultOffset)
+        pbf: Request feature pages as f=pbf and decode them locally
+        cache: Optional PageCache for raw responses
+    """
+
+    def __init__(self, url, concurrency=DEFAULT_CONCURRENCY, paging=DEFAULT_PAGING, pbf=False, cache=None):
+        if paging not in PAGING_MODES:
+            raise ValueError(f"Unknown paging mode '{paging}' (expected one of {PAGING_MODES})")
+
+        self.url = url
+        self.query_url = f"{url}/query"
+        self.concurrency = max(1, concurrency)
+        self.paging = paging
+        self.pbf = pbf
+        self.cache = cache
+        self.session = create_session(self.concurrency)
+        self.limiter = get_limiter(f"arcgis:{urlparse(url).netloc}")
+        self.failed_pages = []
+        self.page_params = {}
+
+    def get(self, url, params):
+        """
+        GET a URL and return the raw response body
+
+        Served from the page cache when one is configured. Raises on HTTP
+        errors and on ArcGIS error bodies, which are never cached.
+        """
+        if self.cache is not None:
+            content = self.cache.get(url, params)
+            if content is not None:
+                return content
+            if self.cache.offline:
+                raise RuntimeError(f"Offline mode: no cached response for {url} {params}")
+
+        response = request_with_retry(self.session, 'GET', url, self.limiter,
+                                      params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        content = response.content
+
+        # ArcGIS reports query errors as HTTP 200 with an "error" object,
+        # even when a binary format was requested
+        if content.startswith(b'{') and b'"error"' in content[:200]:
+            data = json.loads(content)
+            if 'error' in data:
+                error = data['error']
+                raise RuntimeError(f"ArcGIS error {error.get('code')}: {error.get('message')}")
+
+        if self.cache is not None:
+            self.cache.put(url, params, content)
+        return content
+
+    def get_json(self, url, params):
+        """GET a URL and return the decoded JSON body"""
+        content = self.get(url, params)
+        with recorder.time('decode', nbytes=len(content)):
+            return json.loads(content)
+
+    def layer_info(self):
+        """Get the layer's service metadata (fields, capabilities, editFieldsInfo, ...)"""
+        return self.get_json(self.url, {'f': 'json'})
+
+    def edit_date_field(self):
+        """Name of the layer's last-edit date field, or None if the service does not track edits"""
+        edit_info = self.layer_info().get('editFieldsInfo') or {}
+        return edit_info.get('editDateField')
+
+    def count(self, where='1=1'):
+        """Get total count of features matching a where clause"""
+        params = {
+            'where': where,
+            'returnCountOnly': 'true',
+            'f': 'json'
+        }
+        data = self.get_json(self.query_url, params)
+        return data.get('count', 0)
+
+    def object_ids(self, where='1=1'):
+        """
+        Get the sorted OBJECTID list for a where clause
+
+        Returns:
+            (object ID field name, sorted list of IDs)
+        """
+        params = {
+            'where': where,
+            'returnIdsOnly': 'true',
+            'f': 'json'
+        }
+        data = self.get_json(self.query_url, params)
+        oid_field = data.get('objectIdFieldName') or 'OBJECTID'
+        return oid_field, sorted(data.get('objectIds') or [])
+
+    def plan_pages(self, params, total_count, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Split a query into page requests for the layer's paging mode
+
+        Returns:
+            List of (position, page_params) where position is the index of the
+            page's first record within the full result
+        """
+        pages = []
+
+        if self.paging == 'offset':
+            for offset in range(0, total_count, batch_size):
+                page_params = dict(params)
+                page_params['resultOffset'] = offset
+                page_params['resultRecordCount'] = min(batch_size, total_count - offset)
+                pages.append((offset, page_params))
+            return pages
+
+        # Keyset: consecutive slices of the sorted ID list become closed ID ranges
+        where = params.get('where', '1=1')
+        oid_field, ids = self.object_ids(where)
+        ids = ids[:total_count]
+
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            page_params = dict(params)
+            page_params['where'] = f"({where}) AND {oid_field} >= {chunk[0]} AND {oid_field} <= {chunk[-1]}"
+            pages.append((start, page_params))
+        return pages
+
+    def fetch_page(self, page_params):
+        """
+        Fetch one page of features
+
+        Args:
+            page_params: Full query parameters for the page (see plan_pages)
+
+        Returns:
+            List of features (raises on network, HTTP or ArcGIS errors)
+        """
+        output = page_params.get('f')
+        if self.pbf and output in ('json', 'geojson'):
+            pbf_params = dict(page_params)
+            pbf_params['f'] = 'pbf'
+            pbf_params['quantizationParameters'] = QUANTIZATION_PARAMETERS
+            content = self.get(self.query_url, pbf_params)
+            with recorder.time('decode', nbytes=len(content)):
+                return decode_features(content, output)
+
+        data = self.get_json(self.query_url, page_params)
+        return data.get('features', [])
+
+    def fetch_page_with_retry(self, page_params):
+        """
+        Fetch one page, retrying it on its own with jittered exponential backoff
+
+        Throttling and server errors are already retried per request by the
+        rate limiter; this covers ArcGIS error bodies and undecodable pages.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return self.fetch_page(page_params)
+            except Exception:
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(backoff_delay(attempt))
+
+    def iter_pages(self, params, total_count, batch_size=DEFAULT_BATCH_SIZE, skip=None):
+        """
+        Fetch pages concurrently and yield them in order
+
+        Up to `concurrency` requests are in flight at any time; a new one is
+        submitted as soon as the oldest page is handed to the caller. Each page
+        is retried on its own; a page that still fails is skipped and recorded
+        in `failed_pages` instead of ending the sync early.
+
+        Args:
+            params: Query parameters shared by every page
+            total_count: Number of records to fetch
+            batch_size: Records per page
+            skip: Optional predicate page_params -> bool; matching pages are
+                not fetched (e.g. pages committed before a --resume)
+
+        Yields:
+            (position, features) tuples in position order. The query parameters
+            of each page are available as self.page_params[position].
+        """
+        planned = self.plan_pages(params, total_count, batch_size)
+        self.page_params = dict(planned)
+        if skip is not None:
+            planned = [(position, page_params) for position, page_params in planned if not skip(page_params)]
+        pages = iter(planned)
+        in_flight = deque()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        def submit_next():
+            page = next(pages, None)
+            if page is not None:
+                position, page_params = page
+                in_flight.append((position, page_params, executor.submit(self.fetch_page_with_retry, page_params)))
+
+        try:
+            for _ in range(self.concurrency):
+                submit_next()
+
+            while in_flight:
+                position, page_params, future = in_flight.popleft()
+                submit_next()
+                try:
+                    features = future.result()
+                except Exception as e:
+                    print(f"\nError fetching batch at record {position} after {MAX_RETRIES} retries: {e}")
+                    self.failed_pages.append((position, page_params))
+                    recorder.count('fetch', errors=1)
+                    continue
+                yield position, features
+        finally:
+            # Stop queued pages if the caller breaks out early
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def report(self):
+        """Print cache statistics and a summary of pages that could not be fetched"""
+        if self.cache is not None:
+            print(f"\n{self.cache.summary()}")
+
+        if self.limiter.throttled:
+            print(f"\nThrottled {self.limiter.throttled} time(s); settled at {self.limiter.rate:.1f} req/s")
+
+        if not self.failed_pages:
+            return
+
+        print(f"\n⚠ {len(self.failed_pages)} page(s) failed after {MAX_RETRIES} retries and were skipped:")
+        for position, page_params in self.failed_pages:
+            detail = page_params.get('resultOffset', page_params.get('where'))
+            print(f"   record {position}: {detail}")
+        print("   Re-run the sync to fill these gaps")
+
+
+def add_fetch_arguments(parser):
+    """Add the shared ArcGIS fetch options to a script's argparse parser"""
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Number of ArcGIS page requests in flight (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--paging', choices=PAGING_MODES, default=DEFAULT_PAGING,
+                        help=f'Pagination mode: OBJECTID ranges or resultOffset (default: {DEFAULT_PAGING})')
+    parser.add_argument('--pbf', action='store_true',
+                        help='Download pages as ArcGIS protobuf (f=pbf) instead of JSON: about a third of the '
+                             'bytes, but decoding takes more CPU than parsing JSON')
+    add_cache_arguments(parser)
+
+
+def layer_from_args(url, args):
+    """Build an ArcGISLayer from the options added by add_fetch_arguments"""
+    return ArcGISLayer(url, concurrency=args.concurrency, paging=args.paging, pbf=args.pbf,
+                       cache=cache_from_args(args))
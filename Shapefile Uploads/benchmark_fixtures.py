@@ -0,0 +1,287 @@
+"""
+Recorded fixtures and local HTTP stand-ins for the ingest benchmark
+Fixtures are ArcGIS features recorded once from the live services and
+stored as gzipped JSON lines. The stand-ins replay them over HTTP with the
+subset of the ArcGIS REST and Airtable APIs the sync scripts use, so a
+benchmark run never touches the network and gives the same input every time.
+
+A fixture smaller than the requested benchmark size is repeated with the APN
+suffixed per copy ("-1", "-2", ...), so a 5k-feature recording can drive a
+127k-record run with unique APNs.
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tqdm import tqdm
+
+from arcgis_fetch import ArcGISLayer, DEFAULT_BATCH_SIZE
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmark_fixtures')
+
+# Attribute holding the APN in each feature format
+APN_FIELDS = {'geojson': ('properties', ['ParcelTaxID']),
+              'json': ('attributes', ['PARCEL_ID', 'PARCELID', 'APN'])}
+
+OID_RANGE = re.compile(r'OBJECTID >= (\d+) AND OBJECTID <= (\d+)')
+
+
+def fixture_path(name, directory=DEFAULT_FIXTURE_DIR):
+    return os.path.join(directory, f"{name}.jsonl.gz")
+
+
+def record_fixture(name, url, query, limit, directory=DEFAULT_FIXTURE_DIR):
+    """
+    Record features from a live ArcGIS layer into a fixture file
+
+    Args:
+        name: Fixture name ('parcels', 'lir')
+        url: Layer URL
+        query: Query parameters used by the sync script (its f= is the stored format)
+        limit: Number of features to record
+
+    Returns:
+        Number of features written
+    """
+    layer = ArcGISLayer(url)
+    total = min(layer.count(query.get('where', '1=1')), limit)
+    os.makedirs(directory, exist_ok=True)
+    path = fixture_path(name, directory)
+    written = 0
+
+    with gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'name': name, 'url': url, 'format': query['f'], 'recorded': time.time()}) + '\n')
+        with tqdm(total=total, desc=f"Recording {name}") as pbar:
+            for _, features in layer.iter_pages(query, total, DEFAULT_BATCH_SIZE):
+                for feature in features:
+                    f.write(json.dumps(feature, separators=(',', ':')) + '\n')
+                written += len(features)
+                pbar.update(len(features))
+
+    os.replace(f"{path}.tmp", path)
+    return written
+
+
+def load_fixture(name, directory=DEFAULT_FIXTURE_DIR):
+    """Load a fixture as (header, features)"""
+    path = fixture_path(name, directory)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No '{name}' fixture at {path} - run: python benchmark_ingest.py record")
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        features = [json.loads(line) for line in f]
+    return header, features
+
+
+def scale_features(features, size, output_format):
+    """
+    Repeat features until there are `size` of them, with unique APNs and OBJECTIDs 1..size
+
+    Yields:
+        Feature dicts (copies; the recorded features are not modified)
+    """
+    container, apn_fields = APN_FIELDS[output_format]
+    for index in range(size):
+        copy, position = divmod(index, len(features))
+        feature = features[position]
+        values = dict(feature.get(container) or {})
+        values['OBJECTID'] = index + 1
+        if copy:
+            for field in apn_fields:
+                if values.get(field):
+                    values[field] = f"{values[field]}-{copy}"
+        scaled = dict(feature)
+        scaled[container] = values
+        if output_format == 'geojson':
+            scaled['id'] = index + 1
+        yield scaled
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    """Base handler: JSON replies, no request logging"""
+
+    def reply(self, data):
+        self.reply_bytes(json.dumps(data).encode('utf-8'))
+
+    def reply_bytes(self, content, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ArcGISHandler(_JSONHandler):
+    """Answers layer info, count, ID and page queries from the server's pre-encoded features"""
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if not url.path.endswith('/query'):
+            return self.reply({'objectIdField': 'OBJECTID', 'editFieldsInfo': None,
+                               'fields': [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID'}]})
+
+        lo, hi = 1, len(server.encoded)
+        match = OID_RANGE.search(params.get('where', ''))
+        if match:
+            lo, hi = int(match.group(1)), min(int(match.group(2)), hi)
+
+        if params.get('returnCountOnly') == 'true':
+            return self.reply({'count': max(0, hi - lo + 1)})
+        if params.get('returnIdsOnly') == 'true':
+            return self.reply({'objectIdFieldName': 'OBJECTID', 'objectIds': list(range(lo, hi + 1))})
+        if params.get('f') != server.output_format:
+            return self.reply({'error': {'code': 400, 'message': f"Stand-in only serves f={server.output_format}"}})
+
+        start = lo - 1 + int(params.get('resultOffset', 0))
+        stop = min(hi, start + int(params.get('resultRecordCount', hi)))
+        body = b','.join(server.encoded[start:stop])
+        if server.output_format == 'geojson':
+            content = b'{"type":"FeatureCollection","features":[' + body + b']}'
+        else:
+            content = b'{"objectIdFieldName":"OBJECTID","features":[' + body + b']}'
+        self.reply_bytes(content)
+
+
+class _AirtableHandler(_JSONHandler):
+    """
+    Minimal Airtable table: record creates, performUpsert and by-ID updates,
+    paged listing and deletes, handing out sequential record IDs
+
+    performUpsert only matches records it created itself (kept in a key index).
+    """
+
+    def setup_request(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+        return server
+
+    def read_payload(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def create(self, server, fields):
+        """Store a new record (call with server.lock held)"""
+        record_id = f"rec{server.created:014d}"
+        server.created += 1
+        server.records[record_id] = dict(fields)
+        return record_id
+
+    def do_GET(self):
+        server = self.setup_request()
+        params = parse_qs(urlparse(self.path).query)
+        start = int(params.get('offset', ['0'])[0])
+        size = int(params.get('pageSize', ['100'])[0])
+        names = params.get('fields[]')
+        with server.lock:
+            ids = list(server.records)[start:start + size]
+            records = [{'id': record_id,
+                        'fields': {k: v for k, v in server.records[record_id].items()
+                                   if (names is None or k in names) and v not in (None, '')}}
+                       for record_id in ids]
+            more = start + size < len(server.records)
+        self.reply({'records': records, **({'offset': str(start + size)} if more else {})})
+
+    def do_POST(self):
+        server = self.setup_request()
+        payload = self.read_payload()
+        with server.lock:
+            records = [{'id': self.create(server, r.get('fields', {})), 'fields': r.get('fields', {})}
+                       for r in payload.get('records', [payload])]
+        if 'records' in payload:
+            return self.reply({'records': records})
+        self.reply(records[0])
+
+    def do_PATCH(self):
+        server = self.setup_request()
+        payload = self.read_payload()
+        merge_on = payload.get('performUpsert', {}).get('fieldsToMergeOn')
+        records, created = [], []
+        with server.lock:
+            for r in payload.get('records', []):
+                fields = r.get('fields', {})
+                record_id = r.get('id')
+                if merge_on:
+                    key = tuple(fields.get(name) for name in merge_on)
+                    record_id = server.upsert_keys.get(key)
+                    if record_id not in server.records:
+                        record_id = server.upsert_keys[key] = self.create(server, fields)
+                        created.append(record_id)
+                server.records[record_id].update(fields)
+                records.append({'id': record_id, 'fields': server.records[record_id]})
+        if merge_on:
+            return self.reply({'records': records, 'createdRecords': created,
+                               'updatedRecords': [r['id'] for r in records if r['id'] not in created]})
+        self.reply({'records': records})
+
+    def do_DELETE(self):
+        server = self.setup_request()
+        ids = parse_qs(urlparse(self.path).query).get('records[]', [])
+        with server.lock:
+            for record_id in ids:
+                server.records.pop(record_id, None)
+        self.reply({'records': [{'id': record_id, 'deleted': True} for record_id in ids]})
+
+
+class StandIn:
+    """
+    Local HTTP server running in a background thread
+
+    Use as a context manager; `url` is the base URL to point a script at.
+    """
+
+    def __init__(self, handler, latency_ms=0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.server.latency = latency_ms / 1000
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def arcgis_stand_in(features, output_format, latency_ms=0):
+    """
+    Stand-in ArcGIS layer serving `features` (already scaled) in `output_format`
+
+    The layer URL is `stand_in.url + '/arcgis/FeatureServer/0'`.
+    """
+    stand_in = StandIn(_ArcGISHandler, latency_ms)
+    stand_in.server.output_format = output_format
+    stand_in.server.encoded = [json.dumps(f, separators=(',', ':')).encode('utf-8') for f in features]
+    stand_in.layer_url = f"{stand_in.url}/arcgis/FeatureServer/0"
+    return stand_in
+
+
+def airtable_stand_in(latency_ms=0):
+    """Stand-in Airtable API; point AIRTABLE_API_URL at `stand_in.url + '/v0'`"""
+    stand_in = StandIn(_AirtableHandler, latency_ms)
+    stand_in.server.created = 0
+    stand_in.server.requests = 0
+    stand_in.server.records = {}
+    stand_in.server.upsert_keys = {}
+    return stand_in
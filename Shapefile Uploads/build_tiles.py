@@ -0,0 +1,99 @@
+"""
+Build the parcel vector tiles into one PMTiles archive
+Replaces the tippecanoe + tile-join run in scripts/build-tiles.sh: reads the
+parcels from a local snapshot or the database, encodes an MVT tile pyramid
+across all CPUs and writes a single .pmtiles file, ready to upload as one
+object (see TILES.md). See vector_tiles.py for how tiles are built.
+
+--update patches an existing archive instead: only the tiles touched by the
+parcels the syncs logged since the last update (--tile-changes) are rebuilt,
+see tile_invalidation.py.
+
+Usage:
+    python build_tiles.py parcels.geojson -o parcels.pmtiles
+    python build_tiles.py --database-url postgresql://... --min-zoom 10 --max-zoom 16
+    python build_tiles.py parcels.gpkg --attributes id,apn,city,size_acres --layer parcels
+    python build_tiles.py --update -o parcels.pmtiles
+"""
+
+import os
+import time
+
+from dotenv import load_dotenv
+
+from metrics import add_metrics_arguments, metrics_from_args
+from sync_state import DEFAULT_TILE_CHANGES_FILE
+from tile_invalidation import ChangeBatch, update_tiles
+from vector_tiles import add_tile_arguments, build_tiles, load_database, load_snapshot
+
+load_dotenv()
+
+DEFAULT_OUTPUT = 'parcels.pmtiles'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build parcel vector tiles into a PMTiles archive')
+    parser.add_argument('snapshot', nargs='?',
+                        help='Parcel file to tile (GeoJSON, GeoPackage, shapefile); '
+                             'reads the parcels table when omitted')
+    parser.add_argument('--snapshot-layer', help='Layer to read from a multi-layer snapshot (GeoPackage)')
+    parser.add_argument('--database-url',
+                        help='Postgres connection string for reading the parcels table '
+                             '(default: SUPABASE_DB_URL from .env)')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT,
+                        help=f'PMTiles archive to write (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--update', action='store_true',
+                        help='Patch the existing --output archive with only the tiles touched by logged '
+                             'parcel changes (zooms and tile options come from the archive)')
+    parser.add_argument('--tile-changes-file', default=DEFAULT_TILE_CHANGES_FILE,
+                        help='Tile change log written by the syncs\' --tile-changes, for --update')
+    add_tile_arguments(parser)
+    add_metrics_arguments(parser)
+
+    args = parser.parse_args()
+    metrics_from_args('build_tiles', args)
+
+    if args.min_zoom > args.max_zoom:
+        parser.error('--min-zoom must not be above --max-zoom')
+
+    start = time.time()
+    if args.snapshot and not os.path.exists(args.snapshot):
+        print(f"Error: File not found: {args.snapshot}")
+        exit(1)
+
+    if args.update:
+        if not os.path.exists(args.output):
+            print(f"Error: No archive to update at {args.output}, build it in full first")
+            exit(1)
+        changes = ChangeBatch.take(args.tile_changes_file)
+        if not changes.entries:
+            print(f"No parcel changes logged in {args.tile_changes_file}, {args.output} is up to date")
+            exit(0)
+        print(f"Updating {args.output} from {len(changes.entries)} logged change batch(es), "
+              f"reading parcels from {args.snapshot or 'the database'}")
+        writer = update_tiles(args.output, changes.entries, snapshot=args.snapshot,
+                              snapshot_layer=args.snapshot_layer, database_url=args.database_url,
+                              workers=args.tile_workers)
+        changes.done()
+        if writer is None:
+            print(f"\nNo tiles affected, {args.output} left as is")
+        else:
+            print(f"\nPatched {args.output}: {writer.summary()} in {time.time() - start:.1f}s")
+        exit(0)
+
+    if args.snapshot:
+        print(f"Reading parcels from {args.snapshot}")
+        features = load_snapshot(args.snapshot, args.attributes, args.snapshot_layer)
+    else:
+        print("Reading parcels from the database")
+        features = load_database(args.attributes, args.database_url)
+    print(f"  {len(features)} parcels, attributes: {', '.join(features.properties) or 'none'}")
+
+    print(f"Building zoom {args.min_zoom}-{args.max_zoom} into {args.output} with {args.tile_workers} worker(s)")
+    writer = build_tiles(features, args.output, layer=args.layer, min_zoom=args.min_zoom, max_zoom=args.max_zoom,
+                         workers=args.tile_workers, buffer=args.buffer, simplify=args.simplify,
+                         min_area=args.min_area)
+
+    print(f"\nWrote {args.output}: {writer.summary()} in {time.time() - start:.1f}s")
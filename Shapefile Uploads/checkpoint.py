@@ -0,0 +1,103 @@
+"""
+Durable checkpoints for long-running syncs
+Records which pages (OBJECTID ranges or offsets) have been fetched and
+committed, and the outcome of each batch, in a local JSON file that is
+rewritten after every committed batch. A run started with --resume skips the
+pages already committed by an interrupted run with the same query.
+
+The checkpoint is removed when a run finishes without failed pages, so the
+next run starts fresh.
+"""
+
+import json
+import os
+
+from sync_state import DEFAULT_STATE_DIR
+
+
+def page_key(page_params):
+    """Stable identity of a page: its where clause (keyset range) plus offset, if any"""
+    offset = page_params.get('resultOffset')
+    return page_params.get('where', '') if offset is None else f"{page_params.get('where', '')}@{offset}"
+
+
+class Checkpoint:
+    """
+    Completed pages and batch outcomes for one sync, stored as JSON
+
+    Args:
+        path: Checkpoint file location
+        signature: Dict identifying the run (query, paging, batch size, ...);
+            a checkpoint written for a different signature is never resumed
+    """
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.pages = {}
+        self.resumed = 0
+
+    @classmethod
+    def open(cls, path, signature, resume=False):
+        """Load the checkpoint when resuming a run with the same signature, otherwise start empty"""
+        checkpoint = cls(path, signature)
+        if not resume:
+            return checkpoint
+        if not os.path.exists(path):
+            print("Resume: no checkpoint found, starting from the beginning")
+            return checkpoint
+
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('signature') != signature:
+            print("Resume: checkpoint was written for a different query or batch size, starting from the beginning")
+            return checkpoint
+
+        checkpoint.pages = data.get('pages', {})
+        checkpoint.resumed = sum(1 for page in checkpoint.pages.values() if page.get('done'))
+        records = sum(page.get('records', 0) for page in checkpoint.pages.values() if page.get('done'))
+        print(f"Resume: skipping {checkpoint.resumed:,} committed page(s) ({records:,} records)")
+        return checkpoint
+
+    def is_done(self, page_params):
+        """True if the page was committed by an earlier run"""
+        page = self.pages.get(page_key(page_params))
+        return bool(page and page.get('done'))
+
+    def record(self, page_params, done, **outcome):
+        """
+        Record a batch outcome and write the checkpoint
+
+        Args:
+            page_params: The page's query parameters (see ArcGISLayer.plan_pages)
+            done: True once every record of the page is committed
+            **outcome: Counts to keep for the page (records, written, ...)
+        """
+        self.pages[page_key(page_params)] = dict(outcome, done=done)
+        self.save()
+
+    def save(self):
+        """Write the checkpoint atomically and flush it to disk"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'pages': self.pages}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def finish(self, complete):
+        """Remove the checkpoint after a complete run, keep it for --resume otherwise"""
+        if complete and os.path.exists(self.path):
+            os.remove(self.path)
+        elif not complete:
+            pending = sum(1 for page in self.pages.values() if not page.get('done'))
+            print(f"\nCheckpoint kept at {self.path} ({pending:,} failed batch(es)); re-run with --resume to continue")
+
+
+def add_checkpoint_arguments(parser, default_checkpoint_file):
+    """Add the checkpoint/resume options to a script's argparse parser"""
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip pages committed by an interrupted run with the same options')
+    parser.add_argument('--checkpoint-file', default=os.path.join(DEFAULT_STATE_DIR, default_checkpoint_file),
+                        help='Checkpoint file (completed pages and batch outcomes)')
@@ -0,0 +1,257 @@
+"""
+Columnar record batches for the LIR and parcel syncs
+A ColumnBatch holds one page of records as typed NumPy columns instead of a
+list of dicts: attributes are pulled out of the page one column at a time,
+null/empty/type coercion (the safe_float/safe_int/safe_str rules) is applied
+to whole columns, and the batch is serialized straight to the upload format,
+either the row tuples COPY needs or the record dicts PostgREST needs.
+
+Column kinds match the staging types used by the writers:
+  text   - object array, None for null or empty values
+  float8 - float64 array, NaN for null or unparseable values
+  int4   - float64 array truncated to whole numbers, NaN for null
+  object - values passed through unchanged (e.g. GeoJSON geometry)
+"""
+
+from operator import itemgetter
+
+import numpy as np
+
+KINDS = ('text', 'float8', 'int4', 'object')
+
+
+def _object_array(values):
+    """List -> 1-d object array (np.array would turn nested lists into extra dimensions)"""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _parse_float(value):
+    """Per-value float parsing, only used for columns holding strings numpy cannot parse"""
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def coerce_float(values):
+    """Values -> float64 column (None, '' and unparseable values become NaN)"""
+    try:
+        column = np.array(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        column = np.array([_parse_float(v) for v in values], dtype=np.float64)
+    if column.ndim != 1:
+        column = np.array([_parse_float(v) for v in values], dtype=np.float64)
+    return column
+
+
+def _parse_int(value):
+    """int() of a string, as safe_int does it ('12.5' and '12.0' are not integers)"""
+    try:
+        return float(int(value))
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def coerce_int(values):
+    """
+    Values -> whole-number float64 column, matching safe_int: numbers are
+    truncated, strings that are not integer literals and non-finite values become NaN
+    """
+    column = np.trunc(coerce_float(values))
+    column[~np.isfinite(column)] = np.nan
+    if str in set(map(type, values)):
+        for i, value in enumerate(values):
+            if value.__class__ is str and value != '':
+                column[i] = _parse_int(value)
+    return column
+
+
+def coerce_text(values):
+    """Values -> object column of str, None for null or empty values"""
+    column = _object_array(values)
+    if '' in values:
+        column[column == ''] = None
+    # Non-string values (numbers) are formatted with str(), like safe_str;
+    # most text columns hold only strings and nulls and skip this
+    if not set(map(type, values)) <= {str, type(None)}:
+        for i in np.flatnonzero(~np.equal(column, None)).tolist():
+            if column[i].__class__ is not str:
+                column[i] = str(column[i])
+    return column
+
+
+COERCE = {'text': coerce_text, 'float8': coerce_float, 'int4': coerce_int, 'object': _object_array}
+
+
+class ColumnBatch:
+    """
+    One page of records as named, typed columns
+
+    Behaves like a read-only list of record dicts where the writers need it
+    (len, iteration, batch[i], batch[start:stop]), so writers that do not
+    know about columns keep working.
+
+    Args:
+        columns: Dict column name -> NumPy array (all the same length)
+        kinds: Dict column name -> kind (see KINDS)
+    """
+
+    def __init__(self, columns, kinds):
+        self.columns = columns
+        self.kinds = kinds
+        self.length = len(next(iter(columns.values()))) if columns else 0
+
+    @classmethod
+    def from_rows(cls, rows, fields):
+        """
+        Build a batch from attribute dicts (feature['attributes'] or feature['properties'])
+
+        Args:
+            rows: List of attribute dicts
+            fields: List of (column, source, kind); source is an attribute name or a
+                tuple of names whose first non-empty value is used
+        """
+        sources = [source if isinstance(source, tuple) else (source,) for _, source, _ in fields]
+        values = _gather(rows, [name for names in sources for name in names])
+        columns = {}
+        kinds = {}
+        for (column, _, kind), names in zip(fields, sources):
+            coerced = COERCE[kind](values[names[0]])
+            for fallback in names[1:]:
+                missing = _missing(coerced, kind)
+                if not missing.any():
+                    break
+                coerced = np.where(missing, COERCE[kind](values[fallback]), coerced)
+            columns[column] = coerced
+            kinds[column] = kind
+        return cls(columns, kinds)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(index)
+        return self.record(index)
+
+    def __iter__(self):
+        return iter(self.to_records())
+
+    def add_column(self, name, values, kind='object'):
+        """Add a column from a list of values or a single constant"""
+        if not isinstance(values, (list, np.ndarray)):
+            values = [values] * self.length
+        self.columns[name] = COERCE[kind](values)
+        self.kinds[name] = kind
+
+    def fill(self, name, value):
+        """Replace null values of a column with a constant"""
+        column = self.columns[name]
+        column[_missing(column, self.kinds[name])] = value
+
+    def take(self, selector):
+        """New batch with the rows selected by a slice, boolean mask or index array"""
+        return ColumnBatch({name: column[selector] for name, column in self.columns.items()}, dict(self.kinds))
+
+    def present(self, name):
+        """Boolean mask of rows where a column is not null"""
+        return ~_missing(self.columns[name], self.kinds[name])
+
+    def first_occurrences(self, name):
+        """Boolean mask keeping the first row of every distinct value of a column"""
+        _, first = np.unique(self.columns[name].astype(str), return_index=True)
+        keep = np.zeros(self.length, dtype=bool)
+        keep[first] = True
+        return keep
+
+    def to_list(self, name):
+        """One column as a list of Python values (None for nulls), ready for JSON or COPY"""
+        column = self.columns[name]
+        kind = self.kinds[name]
+        if kind in ('text', 'object'):
+            return column.tolist()
+
+        missing = np.isnan(column)
+        if kind == 'int4':
+            values = np.where(missing, 0, column).astype(np.int64).tolist()
+        else:
+            values = column.tolist()
+        for i in np.flatnonzero(missing).tolist():
+            values[i] = None
+        return values
+
+    def rows(self, names):
+        """Row tuples for the given columns (missing columns are None), e.g. for COPY"""
+        lists = [self.to_list(name) if name in self.columns else [None] * self.length for name in names]
+        return zip(*lists)
+
+    def to_records(self):
+        """Record dicts, e.g. for a PostgREST upsert or RPC payload"""
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in self.rows(names)]
+
+    def record(self, index):
+        """One row as a dict"""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('ColumnBatch index out of range')
+        return self.take(slice(index, index + 1)).to_records()[0]
+
+
+def _gather(rows, attributes):
+    """
+    Transpose the wanted attributes of a list of attribute dicts into columns
+
+    ArcGIS returns the same attribute set for every feature of a query, so the
+    columns are cut in one pass with itemgetter/zip; pages where a later row
+    lacks an attribute fall back to dict.get per column.
+    """
+    attributes = list(dict.fromkeys(attributes))
+    if not rows:
+        return {name: [] for name in attributes}
+    present = [name for name in attributes if name in rows[0]]
+    columns = {name: [None] * len(rows) for name in attributes if name not in present}
+    if len(present) == 1:
+        try:
+            columns[present[0]] = list(map(itemgetter(present[0]), rows))
+            return columns
+        except KeyError:
+            pass
+    elif present:
+        try:
+            for name, values in zip(present, zip(*map(itemgetter(*present), rows))):
+                columns[name] = values
+            return columns
+        except KeyError:
+            pass
+    for name in present:
+        columns[name] = [row.get(name) for row in rows]
+    return columns
+
+
+def _missing(column, kind):
+    """Null mask for a column of the given kind"""
+    if kind in ('float8', 'int4'):
+        return np.isnan(column)
+    return np.equal(column, None)
+
+
+def as_records(records):
+    """Record dicts for a ColumnBatch or a plain list of records"""
+    return records.to_records() if isinstance(records, ColumnBatch) else records
+
+
+def as_rows(records, names):
+    """Row tuples for a ColumnBatch or a plain list of records"""
+    if isinstance(records, ColumnBatch):
+        return records.rows(names)
+    return (tuple(record.get(name) for name in names) for record in records)
+
+
+def add_columnar_arguments(parser):
+    """Add the columnar batch option to a script's argparse parser"""
+    parser.add_argument('--columnar', action='store_true',
+                        help='Transform pages into typed NumPy columns instead of per-record dicts')
@@ -0,0 +1,128 @@
+"""
+Geometry encodings for the parcel upload path
+Parcels are stored as GEOMETRY(MultiPolygon, 4326). PostGIS parses any of
+these text forms when they arrive as a JSON string or object:
+  geojson - nested coordinate arrays (what the ArcGIS sync scripts receive)
+  ewkt    - 'SRID=4326;MULTIPOLYGON(...)'
+  ewkb    - hex-encoded extended WKB: 16 bytes per coordinate pair, decoded by
+            PostGIS without parsing decimal text (see migration 044)
+
+--precision N snaps coordinates to N decimal places before encoding
+(6 places is ~0.1 m at Utah's latitude), which shortens the text formats
+and drops noise digits from all of them.
+"""
+
+import struct
+
+import numpy as np
+import shapely
+
+GEOMETRY_FORMATS = ('geojson', 'ewkt', 'ewkb')
+SRID = 4326
+
+# Little-endian EWKB headers: MultiPolygon with SRID flag, then plain Polygon parts
+_MULTIPOLYGON_HEADER = struct.Struct('<BIII')
+_POLYGON_HEADER = struct.Struct('<BII')
+_COUNT = struct.Struct('<I')
+_EWKB_MULTIPOLYGON = 0x20000006
+_WKB_POLYGON = 3
+
+
+def _snap(coords, precision):
+    """2-D float64 coordinate array, rounded to precision decimal places if set"""
+    coords = np.asarray(coords, dtype='<f8')[:, :2]
+    if precision is not None:
+        coords = np.round(coords, precision)
+    return coords
+
+
+def geojson_to_ewkb(geometry, precision=None):
+    """
+    Encode a GeoJSON Polygon/MultiPolygon as a hex-EWKB MultiPolygon (SRID 4326)
+
+    Builds the WKB directly from the coordinate arrays, so no geometry objects
+    are created per feature. Returns None for missing geometry.
+    """
+    if not geometry:
+        return None
+    polygons = geometry['coordinates']
+    if geometry['type'] == 'Polygon':
+        polygons = [polygons]
+    elif geometry['type'] != 'MultiPolygon':
+        raise ValueError(f"Expected a Polygon or MultiPolygon, got {geometry['type']}")
+
+    parts = [_MULTIPOLYGON_HEADER.pack(1, _EWKB_MULTIPOLYGON, SRID, len(polygons))]
+    for rings in polygons:
+        parts.append(_POLYGON_HEADER.pack(1, _WKB_POLYGON, len(rings)))
+        for ring in rings:
+            coords = _snap(ring, precision)
+            parts.append(_COUNT.pack(len(coords)))
+            parts.append(coords.tobytes())
+    return b''.join(parts).hex()
+
+
+def snap_geojson(geometry, precision):
+    """Copy of a GeoJSON geometry with coordinates rounded to precision decimal places"""
+    if not geometry or precision is None:
+        return geometry
+
+    def snap(value):
+        if value and isinstance(value[0], (int, float)):
+            return [round(c, precision) for c in value[:2]]
+        return [snap(v) for v in value]
+
+    return {'type': geometry['type'], 'coordinates': snap(geometry['coordinates'])}
+
+
+def encode_geojson(geometry, geometry_format='geojson', precision=None):
+    """Encode one GeoJSON geometry (Polygon or MultiPolygon) for upload in the given format"""
+    if geometry_format == 'ewkb':
+        return geojson_to_ewkb(geometry, precision)
+    if geometry_format == 'ewkt':
+        if not geometry:
+            return None
+        geom = shapely.geometry.shape(snap_geojson(geometry, precision))
+        if geom.geom_type == 'Polygon':
+            geom = shapely.geometry.MultiPolygon([geom])
+        return f'SRID={SRID};{shapely.to_wkt(geom, rounding_precision=-1)}'
+    return snap_geojson(geometry, precision)
+
+
+def snap_geometries(geoms, precision):
+    """
+    Snap an array of shapely geometries to a grid of precision decimal places
+
+    Uses GEOS precision reduction, which keeps polygons valid (slivers
+    narrower than the grid can collapse to empty geometries).
+    """
+    if precision is None:
+        return geoms
+    return shapely.set_precision(geoms, 10.0 ** -precision)
+
+
+def encode_geometries(geoms, geometry_format='ewkt'):
+    """
+    Encode an array of shapely MultiPolygons, already in EPSG:4326, in one call
+
+    Args:
+        geoms: NumPy object array of shapely geometries
+        geometry_format: 'ewkt', 'ewkb' (hex string) or 'wkb' (bytes, for COPY)
+
+    Returns:
+        NumPy object array of encoded geometries
+    """
+    if geometry_format == 'wkb':
+        return shapely.to_wkb(geoms)
+    if geometry_format == 'ewkb':
+        return shapely.to_wkb(shapely.set_srid(geoms, SRID), hex=True, include_srid=True)
+    wkt = shapely.to_wkt(geoms, rounding_precision=-1)
+    return np.array([f'SRID={SRID};{w}' for w in wkt], dtype=object)
+
+
+def add_geometry_arguments(parser, default_format, formats=GEOMETRY_FORMATS):
+    """Add the geometry encoding options to a script's argparse parser"""
+    parser.add_argument('--geometry-format', choices=formats, default=default_format,
+                        help=f'How geometry is sent to the database; ewkb is hex-encoded binary, '
+                             f'the smallest and fastest to parse (default: {default_format})')
+    parser.add_argument('--precision', type=int,
+                        help='Snap coordinates to this many decimal places before upload (e.g. 6, ~0.1 m)')
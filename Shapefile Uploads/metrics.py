@@ -0,0 +1,179 @@
+"""
+Per-stage run metrics for the sync scripts
+Stages (fetch, decode, transform, upload, and every HTTP endpoint via
+rate_limit.py) record call counts, items, bytes, seconds, errors and retries
+into one process-wide recorder. With --metrics-file set, the totals are
+written when the script exits, either appended as one JSON line per run or
+as a Prometheus textfile (for node_exporter's textfile collector).
+
+Disabled by default: recorder.time() then hands back a shared no-op context
+manager, so instrumented code pays one attribute check per call.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+FORMATS = ('jsonl', 'prom')
+COUNTERS = ('calls', 'items', 'bytes', 'seconds', 'errors', 'retries')
+
+
+class _NullTimer:
+    """Stand-in timer used while metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, items=0, nbytes=0):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Times one call of a stage; an exception leaving the block counts as an error"""
+
+    def __init__(self, recorder, stage, items, nbytes):
+        self.recorder = recorder
+        self.stage = stage
+        self.items = items
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.count(self.stage, calls=1, items=self.items, bytes=self.nbytes,
+                            seconds=time.perf_counter() - self.start, errors=1 if exc_type else 0)
+        return False
+
+    def add(self, items=0, nbytes=0):
+        """Add items/bytes that are only known once the work is done"""
+        self.items += items
+        self.nbytes += nbytes
+
+
+class Recorder:
+    """Thread-safe per-stage counters for one script run"""
+
+    def __init__(self):
+        self.enabled = False
+        self.script = None
+        self.started = time.time()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def time(self, stage, items=0, nbytes=0):
+        """Context manager timing one call of a stage"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage, items, nbytes)
+
+    def iter_timed(self, stage, iterable):
+        """Iterate, timing each step as one call of a stage (returns iterable unchanged when disabled)"""
+        if not self.enabled:
+            return iterable
+        return self._iter_timed(stage, iter(iterable))
+
+    def _iter_timed(self, stage, iterator):
+        done = object()
+        while True:
+            with self.time(stage):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def count(self, stage, **counters):
+        """Add to a stage's counters, e.g. count('http:airtable', retries=1)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self.stages.setdefault(stage, dict.fromkeys(COUNTERS, 0))
+            for name, value in counters.items():
+                totals[name] += value
+
+    def snapshot(self):
+        """Run summary as a dict"""
+        with self._lock:
+            stages = {name: dict(totals, seconds=round(totals['seconds'], 6))
+                      for name, totals in sorted(self.stages.items())}
+        return {
+            'script': self.script,
+            'started': datetime.fromtimestamp(self.started, tz=timezone.utc).isoformat(timespec='seconds'),
+            'duration': round(time.time() - self.started, 3),
+            'stages': stages,
+        }
+
+    def write_jsonl(self, path):
+        """Append this run as one JSON line"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def write_prometheus(self, path):
+        """Write this run as a Prometheus textfile (replaced atomically)"""
+        run = self.snapshot()
+        script = run['script']
+        lines = [
+            '# HELP ingest_run_duration_seconds Wall time of the last run',
+            '# TYPE ingest_run_duration_seconds gauge',
+            f'ingest_run_duration_seconds{{script="{script}"}} {run["duration"]}',
+            '# HELP ingest_run_timestamp_seconds Start time of the last run',
+            '# TYPE ingest_run_timestamp_seconds gauge',
+            f'ingest_run_timestamp_seconds{{script="{script}"}} {int(self.started)}',
+        ]
+        for counter in COUNTERS:
+            metric = f'ingest_stage_{counter}'
+            lines.append(f'# HELP {metric} Stage {counter} during the last run')
+            lines.append(f'# TYPE {metric} gauge')
+            for stage, totals in run['stages'].items():
+                lines.append(f'{metric}{{script="{script}",stage="{stage}"}} {totals[counter]}')
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def enable(self, script, path, output_format=None):
+        """
+        Start recording and write the metrics file when the process exits
+
+        Args:
+            script: Script name used as the `script` label
+            path: Metrics file path
+            output_format: 'jsonl' or 'prom' (default: 'prom' for *.prom files, else 'jsonl')
+        """
+        output_format = output_format or ('prom' if path.endswith('.prom') else 'jsonl')
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown metrics format '{output_format}' (expected one of {FORMATS})")
+
+        self.enabled = True
+        self.script = script
+        self.started = time.time()
+        writer = self.write_prometheus if output_format == 'prom' else self.write_jsonl
+        atexit.register(writer, path)
+
+
+recorder = Recorder()
+
+
+def add_metrics_arguments(parser):
+    """Add the run metrics options to a script's argparse parser"""
+    parser.add_argument('--metrics-file',
+                        help='Write per-stage timings/counts here when the run ends (*.prom = Prometheus textfile)')
+    parser.add_argument('--metrics-format', choices=FORMATS,
+                        help='Metrics file format (default: from the file extension, else jsonl)')
+
+
+def metrics_from_args(script, args):
+    """Enable the recorder if --metrics-file was given"""
+    if args.metrics_file:
+        recorder.enable(script, args.metrics_file, args.metrics_format)
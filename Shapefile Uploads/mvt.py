@@ -0,0 +1,323 @@
+"""
+Encoder for Mapbox Vector Tiles (MVT 2.1)
+Writes vector_tile.Tile protobuf messages by hand, the way arcgis_pbf.py reads
+ArcGIS ones, so building tiles needs no protobuf or mapbox-vector-tile package.
+
+Polygon geometry comes in as flat ragged arrays in tile coordinates (integer
+units, origin at the top-left, y down): one coordinate array for every ring in
+the tile, plus ring, polygon and feature offsets, as shapely.to_ragged_array()
+returns them. Ring cleanup, winding order and the MoveTo/LineTo/ClosePath
+command streams are computed with NumPy over the whole tile at once; only the
+per-feature message framing and the attribute tags are built in Python.
+"""
+
+import math
+import struct
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_EXTENT = 4096
+
+# vector_tile.Tile.GeomType
+GEOMETRY_POLYGON = 3
+
+# Geometry commands: (id & 0x7) | (count << 3)
+_MOVE_TO = 1 | (1 << 3)
+_LINE_TO = 2
+_CLOSE_PATH = 7 | (1 << 3)
+
+_DOUBLE = struct.Struct('<d')
+_FIELD_KEYS = {number: bytes(((number << 3) | 2,)) for number in (1, 2, 3, 4)}
+
+
+def _varint(value):
+    """Encode one non-negative integer as a base-128 varint"""
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value):
+    """Zigzag-encode a signed 64-bit integer"""
+    return (value << 1) ^ (value >> 63)
+
+
+def _varints(values):
+    """
+    Encode an array of non-negative integers (< 2**35) as concatenated varints
+
+    Returns:
+        (bytes, int64 array of the end byte offset of each value)
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28):
+        sizes += values >= (1 << bits)
+    ends = np.cumsum(sizes)
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    starts = ends - sizes
+    for i in range(int(sizes.max()) if len(sizes) else 0):
+        selected = sizes > i
+        byte = (values[selected] >> np.uint64(7 * i)) & np.uint64(0x7f)
+        more = sizes[selected] > i + 1
+        out[starts[selected] + i] = byte.astype(np.uint8) | (more.astype(np.uint8) << 7)
+    return out.tobytes(), ends
+
+
+def _field(number, payload):
+    """A length-delimited field (wire type 2)"""
+    return _FIELD_KEYS[number] + _varint(len(payload)) + payload
+
+
+def _encode_value(value):
+    """vector_tile.Tile.Value message for one attribute value"""
+    if isinstance(value, bool):
+        return b'\x38' + _varint(int(value))  # bool_value
+    if isinstance(value, int):
+        if value >= 0:
+            return b'\x28' + _varint(value)  # uint_value
+        return b'\x30' + _varint(_zigzag(value))  # sint_value
+    if isinstance(value, float):
+        return b'\x19' + _DOUBLE.pack(value)  # double_value
+    return _field(1, str(value).encode('utf-8'))  # string_value
+
+
+def _attribute_value(value):
+    """Plain Python value for an attribute, or None to leave the tag out"""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    return value
+
+
+def polygon_commands(coords, ring_offsets, polygon_offsets, feature_offsets, min_area=0):
+    """
+    Clean, orient and encode the polygon rings of every feature in a tile
+
+    Consecutive repeated points and the closing point of each ring are
+    dropped; rings left with fewer than 3 points or no area are dropped, and a
+    polygon goes with its exterior ring. Exterior rings are reversed where
+    needed to wind clockwise on screen (positive area in tile coordinates),
+    holes the other way, as the spec requires.
+
+    Args:
+        coords: (n, 2) integer array of tile coordinates, rings closed
+        ring_offsets: Start of each ring in coords (length rings + 1)
+        polygon_offsets: Start of each polygon in rings (length polygons + 1)
+        feature_offsets: Start of each feature in polygons (length features + 1)
+        min_area: Drop polygons whose exterior ring covers fewer square tile units
+
+    Returns:
+        (command stream as a uint64 array, int64 array with the start of each feature's
+        commands in it, length features + 1; features left empty get none)
+    """
+    coords = np.asarray(coords, dtype=np.int64)
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+    feature_offsets = np.asarray(feature_offsets, dtype=np.int64)
+    n_rings = len(ring_offsets) - 1
+    n_features = len(feature_offsets) - 1
+    if n_rings <= 0 or len(coords) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(n_features + 1, dtype=np.int64)
+
+    ring_lengths = np.diff(ring_offsets)
+    ring_of_point = np.repeat(np.arange(n_rings), ring_lengths)
+
+    # Drop each ring's closing point, then points repeating the one before them
+    keep = np.ones(len(coords), dtype=bool)
+    keep[ring_offsets[1:][ring_lengths > 0] - 1] = False
+    repeated = np.zeros(len(coords), dtype=bool)
+    repeated[1:] = (coords[1:] == coords[:-1]).all(axis=1) & (ring_of_point[1:] == ring_of_point[:-1])
+    keep &= ~repeated
+    coords, ring_of_point = coords[keep], ring_of_point[keep]
+    ring_lengths = np.bincount(ring_of_point, minlength=n_rings)
+    ring_starts = np.concatenate(([0], np.cumsum(ring_lengths)[:-1]))
+
+    # A ring that now ends on its first point (e.g. ..., A', A rounded onto A) loses that point
+    nonempty = ring_lengths > 1
+    last = ring_starts + ring_lengths - 1
+    wraps = np.zeros(n_rings, dtype=bool)
+    wraps[nonempty] = (coords[last[nonempty]] == coords[ring_starts[nonempty]]).all(axis=1)
+    if wraps.any():
+        keep = np.ones(len(coords), dtype=bool)
+        keep[last[wraps]] = False
+        coords, ring_of_point = coords[keep], ring_of_point[keep]
+        ring_lengths = np.bincount(ring_of_point, minlength=n_rings)
+        ring_starts = np.concatenate(([0], np.cumsum(ring_lengths)[:-1]))
+
+    # Twice the signed area of each ring (surveyor's formula, wrapping to the ring start)
+    following = np.arange(1, len(coords) + 1)
+    following[ring_starts[ring_lengths > 0] + ring_lengths[ring_lengths > 0] - 1] = ring_starts[ring_lengths > 0]
+    cross = coords[:, 0] * coords[following, 1] - coords[following, 0] * coords[:, 1]
+    area2 = np.bincount(ring_of_point, weights=cross, minlength=n_rings)
+
+    valid_ring = (ring_lengths >= 3) & (area2 != 0)
+    exteriors = polygon_offsets[:-1]
+    polygon_lengths = np.diff(polygon_offsets)
+    valid_polygon = np.zeros(len(exteriors), dtype=bool)
+    has_rings = polygon_lengths > 0
+    valid_polygon[has_rings] = valid_ring[exteriors[has_rings]]
+    if min_area:
+        valid_polygon[has_rings] &= np.abs(area2[exteriors[has_rings]]) >= 2 * min_area
+    polygon_of_ring = np.repeat(np.arange(len(exteriors)), polygon_lengths)
+    valid_ring &= valid_polygon[polygon_of_ring]
+    is_exterior = np.zeros(n_rings, dtype=bool)
+    is_exterior[exteriors[has_rings]] = True
+    reverse = valid_ring & np.where(is_exterior, area2 < 0, area2 > 0)
+
+    # Reverse the point order of wrongly wound rings in place
+    if reverse.any():
+        flip = reverse[ring_of_point]
+        index = np.arange(len(coords))
+        position = index - ring_starts[ring_of_point]
+        index[flip] = (ring_starts + ring_lengths - 1)[ring_of_point[flip]] - position[flip]
+        coords = coords[index]
+
+    # Points of the kept rings, in stream order
+    point_kept = valid_ring[ring_of_point]
+    points = coords[point_kept]
+    point_ring = ring_of_point[point_kept]
+    kept_rings = np.flatnonzero(valid_ring)
+    kept_lengths = ring_lengths[kept_rings]
+    if len(kept_rings) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(n_features + 1, dtype=np.int64)
+
+    feature_of_polygon = np.repeat(np.arange(n_features), np.diff(feature_offsets))
+    feature_of_ring = feature_of_polygon[polygon_of_ring]
+    kept_features = feature_of_ring[kept_rings]
+    point_feature = feature_of_ring[point_ring]
+
+    # Deltas from the previous point of the same feature (the cursor starts at 0, 0 per feature)
+    deltas = points.copy()
+    same_feature = point_feature[1:] == point_feature[:-1]
+    deltas[1:][same_feature] -= points[:-1][same_feature]
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+
+    # Each ring: MoveTo, x, y, LineTo(n - 1), 2 * (n - 1) params, ClosePath = 2n + 3 values
+    stream_lengths = 2 * kept_lengths + 3
+    stream_starts = np.concatenate(([0], np.cumsum(stream_lengths)[:-1]))
+    stream = np.empty(int(stream_lengths.sum()), dtype=np.uint64)
+    stream[stream_starts] = _MOVE_TO
+    stream[stream_starts + 3] = _LINE_TO | ((kept_lengths - 1) << 3)
+    stream[stream_starts + stream_lengths - 1] = _CLOSE_PATH
+
+    ring_slot = np.zeros(n_rings, dtype=np.int64)
+    ring_slot[kept_rings] = np.arange(len(kept_rings))
+    slot = ring_slot[point_ring]
+    position = np.arange(len(points)) - np.repeat(np.cumsum(kept_lengths) - kept_lengths, kept_lengths)
+    at = stream_starts[slot] + 1 + 2 * position + (position > 0)
+    stream[at] = zigzag[:, 0]
+    stream[at + 1] = zigzag[:, 1]
+
+    feature_stream_lengths = np.bincount(kept_features, weights=stream_lengths, minlength=n_features)
+    feature_starts = np.concatenate(([0], np.cumsum(feature_stream_lengths))).astype(np.int64)
+    return stream, feature_starts
+
+
+class LayerEncoder:
+    """
+    Builds one vector_tile.Tile.Layer message
+
+    Keys and values are interned into the layer's tables as features are
+    added, so repeated values (city, county) are stored once per tile.
+    """
+
+    def __init__(self, name, extent=DEFAULT_EXTENT):
+        self.name = name
+        self.extent = extent
+        self.features = []
+        self._keys = {}
+        self._values = {}
+
+    def _key(self, key):
+        index = self._keys.get(key)
+        if index is None:
+            index = self._keys[key] = len(self._keys)
+        return index
+
+    def _value(self, value):
+        # Keyed by type too, so 1 and 1.0 and True stay distinct values
+        index = self._values.get((type(value), value))
+        if index is None:
+            index = self._values[(type(value), value)] = len(self._values)
+        return index
+
+    def _tag_values(self, values):
+        """Value-table index of each value in a column, -1 for missing values"""
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        lookup = np.array([-1 if value is None else self._value(value)
+                           for value in map(_attribute_value, uniques)] + [-1], dtype=np.int64)
+        return lookup[codes]  # code -1 (None/NaN) picks the trailing -1
+
+    def add_polygons(self, coords, ring_offsets, polygon_offsets, feature_offsets, ids=None,
+                     properties=None, min_area=0):
+        """
+        Add the polygon features of a tile (see polygon_commands for the arrays)
+
+        Args:
+            ids: Optional integer array of non-negative feature IDs, one per feature
+            properties: Optional dict attribute name -> sequence of values, one per feature;
+                None and NaN values are left out
+            min_area: Drop polygons smaller than this many square tile units
+
+        Returns:
+            Number of features added (features whose geometry collapsed are skipped)
+        """
+        stream, feature_starts = polygon_commands(coords, ring_offsets, polygon_offsets, feature_offsets,
+                                                  min_area)
+        kept = np.flatnonzero(feature_starts[1:] > feature_starts[:-1])
+        if len(kept) == 0:
+            return 0
+        geometry, ends = _varints(stream)
+        geometry_starts = np.concatenate(([0], ends))[feature_starts]
+
+        # Tags (key index, value index pairs) of every kept feature, varint-encoded in one go
+        properties = properties or {}
+        pairs = np.empty((len(kept), 2 * len(properties)), dtype=np.int64)
+        for column, (name, values) in enumerate(properties.items()):
+            pairs[:, 2 * column] = self._key(name)
+            pairs[:, 2 * column + 1] = self._tag_values(np.asarray(values, dtype=object)[kept])
+        present = np.repeat(pairs[:, 1::2] >= 0, 2, axis=1)
+        tags, ends = _varints(pairs[present])
+        tag_starts = np.concatenate(([0], ends))[np.concatenate(([0], np.cumsum(present.sum(axis=1))))]
+
+        if ids is not None:
+            id_bytes, ends = _varints(np.maximum(np.asarray(ids, dtype=np.int64)[kept], 0))
+            id_starts = np.concatenate(([0], ends))
+
+        tag_starts = tag_starts.tolist()
+        for n, i in enumerate(kept.tolist()):
+            parts = []
+            if ids is not None:
+                parts.append(b'\x08' + id_bytes[id_starts[n]:id_starts[n + 1]])
+            if tag_starts[n + 1] > tag_starts[n]:
+                parts.append(_field(2, tags[tag_starts[n]:tag_starts[n + 1]]))
+            parts.append(b'\x18\x03')  # type = POLYGON
+            parts.append(_field(4, geometry[geometry_starts[i]:geometry_starts[i + 1]]))
+            self.features.append(_field(2, b''.join(parts)))
+        return len(kept)
+
+    def encode(self):
+        """The Layer message, or b'' if no feature was added"""
+        if not self.features:
+            return b''
+        parts = [b'\x78\x02', _field(1, self.name.encode('utf-8'))]  # version = 2, name
+        parts.extend(self.features)
+        parts.extend(_field(3, key.encode('utf-8')) for key in self._keys)
+        parts.extend(_field(4, _encode_value(value)) for _, value in self._values)
+        parts.append(b'\x28' + _varint(self.extent))
+        return b''.join(parts)
+
+
+def encode_tile(layers):
+    """vector_tile.Tile message from LayerEncoders (empty layers are left out)"""
+    return b''.join(_field(3, layer) for layer in (layer.encode() for layer in layers) if layer)
@@ -0,0 +1,93 @@
+"""
+Zero-downtime full refresh of the parcels table (migration 043)
+--refresh loads a full sync into parcels_shadow instead of truncating parcels
+first, then builds the shadow's indexes and swaps it in with one atomic
+rename. The map tiles and search keep serving the complete old table until
+the swap commits, and the load skips secondary index maintenance.
+
+A refresh replaces the whole table, so it cannot be combined with --limit,
+and the swap is refused when the shadow holds fewer than REFRESH_MIN_FRACTION
+of the features the source reported.
+
+Typical flow in a sync script:
+    begin_refresh(supabase)
+    ... upsert into SHADOW_TABLE ...
+    finish_refresh(supabase, refresh_min_rows(available_count))
+"""
+
+import time
+
+from rate_limit import execute
+
+SHADOW_TABLE = 'parcels_shadow'
+SCHEMA_RELOAD_TIMEOUT = 30
+# Share of the source's feature count the shadow must hold to be swapped in
+# (features without an APN and duplicate APNs do not become rows)
+REFRESH_MIN_FRACTION = 0.9
+
+
+def refresh_min_rows(available_count, fraction=REFRESH_MIN_FRACTION):
+    """Fewest rows a shadow loaded from available_count source features may have and still be swapped in"""
+    return max(1, int(available_count * fraction))
+
+
+def begin_refresh(client):
+    """Create an empty parcels_shadow and wait until PostgREST's schema cache has it"""
+    print(f"Refresh: loading into {SHADOW_TABLE}; parcels stays online until the swap")
+    execute(client.rpc('begin_parcels_refresh'))
+
+    deadline = time.monotonic() + SCHEMA_RELOAD_TIMEOUT
+    while True:
+        try:
+            execute(client.table(SHADOW_TABLE).select('id').limit(1))
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+
+def finish_refresh(client, min_rows):
+    """
+    Build the shadow's indexes (one per call, to stay under the API statement
+    timeout) and swap it in
+
+    Args:
+        client: Supabase client (service role)
+        min_rows: Refuse to swap if the shadow has fewer rows (see refresh_min_rows)
+
+    Returns:
+        Number of parcels in the swapped-in table, or None if the swap failed
+        (parcels is left unchanged and the shadow is kept)
+    """
+    try:
+        while True:
+            started = time.perf_counter()
+            index = execute(client.rpc('build_parcels_shadow_index')).data
+            if not index:
+                break
+            print(f"Refresh: built {index} on {SHADOW_TABLE} ({time.perf_counter() - started:.1f}s)")
+
+        rows = execute(client.rpc('swap_parcels_shadow', {'min_rows': min_rows})).data
+    except Exception as e:
+        print(f"\n✗ Refresh swap failed, parcels left unchanged: {e}")
+        print(f"  The loaded {SHADOW_TABLE} is kept; finish in the SQL editor with "
+              f"SELECT swap_parcels_shadow({min_rows});")
+        print("  or discard it with SELECT abort_parcels_refresh();")
+        return None
+
+    print(f"✓ Refresh: swapped in {rows:,} parcels")
+    return rows
+
+
+def add_refresh_arguments(parser):
+    """Add the --refresh option to a sync script's argparse parser"""
+    parser.add_argument('--refresh', action='store_true',
+                        help='Full reload into a shadow table, swapped in atomically at the end '
+                             '(zero-downtime alternative to --clear, needs migration 043; not with --limit)')
+
+
+def check_refresh_arguments(parser, args):
+    """Reject option combinations that would swap a partial table in (call after parse_args)"""
+    if args.refresh and args.limit:
+        parser.error('--refresh replaces the whole parcels table and cannot be combined with --limit')
@@ -0,0 +1,153 @@
+"""
+Staged fetch -> transform -> upload pipeline joined by bounded queues
+Each stage runs in its own worker threads, so ArcGIS downloads, record
+transforms and database writes overlap instead of running one after another.
+Bounded queues give backpressure: a slow upload stage pauses fetching rather
+than letting pages pile up in memory. Each stage's calls and time are recorded
+in metrics.recorder as 'fetch', 'transform' and 'upload'.
+"""
+
+import queue
+import threading
+
+from metrics import recorder
+
+DEFAULT_TRANSFORM_WORKERS = 1
+DEFAULT_UPLOAD_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+def run_pipeline(source, transform, upload, transform_workers=DEFAULT_TRANSFORM_WORKERS,
+                 upload_workers=DEFAULT_UPLOAD_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Run source -> transform -> upload concurrently
+
+    Args:
+        source: Iterable of items (e.g. layer.iter_pages(...)), consumed in a producer thread
+        transform: Function item -> batch, run by transform_workers threads
+        upload: Function batch -> result, run by upload_workers threads
+        transform_workers: Number of transform threads
+        upload_workers: Number of upload threads
+        queue_size: Capacity of each queue between stages
+
+    Yields:
+        (item, batch, result) as each upload finishes (not necessarily in source order).
+        The first exception raised by any stage stops the pipeline and is re-raised here.
+    """
+    transform_queue = queue.Queue(queue_size)
+    upload_queue = queue.Queue(queue_size)
+    done_queue = queue.Queue(queue_size)
+    stop = threading.Event()
+    errors = []
+    lock = threading.Lock()
+    remaining = {'transform': transform_workers, 'upload': upload_workers}
+
+    def put(q, value):
+        """Put that gives up once the pipeline is stopping"""
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        """Get that returns _DONE once the pipeline is stopping"""
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return _DONE
+
+    def fail(error):
+        with lock:
+            errors.append(error)
+        stop.set()
+
+    def finish(stage, next_queue, next_workers):
+        """The last worker of a stage signals every worker of the next stage"""
+        with lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(next_workers):
+                put(next_queue, _DONE)
+
+    def produce():
+        try:
+            items = iter(source)
+            while True:
+                with recorder.time('fetch'):
+                    item = next(items, _DONE)
+                if item is _DONE or not put(transform_queue, item):
+                    break
+        except Exception as e:
+            fail(e)
+        finally:
+            close = getattr(source, 'close', None)
+            if close:
+                close()
+            for _ in range(transform_workers):
+                put(transform_queue, _DONE)
+
+    def transform_worker():
+        try:
+            while True:
+                item = get(transform_queue)
+                if item is _DONE:
+                    break
+                with recorder.time('transform'):
+                    batch = transform(item)
+                if not put(upload_queue, (item, batch)):
+                    break
+        except Exception as e:
+            fail(e)
+        finally:
+            finish('transform', upload_queue, upload_workers)
+
+    def upload_worker():
+        try:
+            while True:
+                entry = get(upload_queue)
+                if entry is _DONE:
+                    break
+                item, batch = entry
+                with recorder.time('upload'):
+                    result = upload(batch)
+                if not put(done_queue, (item, batch, result)):
+                    break
+        except Exception as e:
+            fail(e)
+        finally:
+            finish('upload', done_queue, 1)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=transform_worker, daemon=True) for _ in range(transform_workers)]
+    threads += [threading.Thread(target=upload_worker, daemon=True) for _ in range(upload_workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            entry = get(done_queue)
+            if entry is _DONE:
+                break
+            yield entry
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def add_pipeline_arguments(parser):
+    """Add the pipeline worker options to a script's argparse parser"""
+    parser.add_argument('--transform-workers', type=int, default=DEFAULT_TRANSFORM_WORKERS,
+                        help=f'Threads transforming fetched pages (default: {DEFAULT_TRANSFORM_WORKERS})')
+    parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS,
+                        help=f'Threads writing batches to the database (default: {DEFAULT_UPLOAD_WORKERS})')
@@ -0,0 +1,393 @@
+"""
+Writer for PMTiles v3 archives
+A PMTiles file holds a whole tile pyramid in one file: a 127-byte header, a
+root directory, JSON metadata, optional leaf directories and the tile data.
+Tiles are addressed by a single ID per z/x/y (a Hilbert curve per zoom level),
+so a viewer or CDN worker fetches any tile with HTTP range requests and the
+archive can be hosted as one static object instead of thousands of files.
+
+Tiles must be added in ascending tile ID order; the data goes straight to a
+temporary file next to the output, identical tiles (e.g. fully covered
+interior tiles) are stored once, and the finished archive replaces the output
+path in one rename. patch_archive() rewrites an existing archive that way with
+some tiles replaced, copying every other tile as stored.
+
+Spec: https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+MAGIC = b'PMTiles'
+VERSION = 3
+
+# Compression and tile type codes from the spec
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+TILE_TYPE_MVT = 1
+
+HEADER = struct.Struct('<7sBQQQQQQQQQQQBBBBBBiiiiBii')
+HEADER_FIELDS = (
+    'magic', 'version', 'root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+    'leaves_offset', 'leaves_length', 'data_offset', 'data_length',
+    'addressed_tiles', 'tile_entries', 'tile_contents', 'clustered', 'internal_compression',
+    'tile_compression', 'tile_type', 'min_zoom', 'max_zoom', 'min_lon_e7', 'min_lat_e7',
+    'max_lon_e7', 'max_lat_e7', 'center_zoom', 'center_lon_e7', 'center_lat_e7',
+)
+HEADER_SIZE = 127
+ROOT_DIRECTORY_MAX = 16384 - HEADER_SIZE  # Header and root directory fit in the first 16 KiB
+LEAF_SIZE = 4096  # Starting entries per leaf directory when the root overflows
+
+
+def zxy_to_tile_id(z, x, y):
+    """PMTiles tile ID: tiles in all lower zooms, plus the Hilbert curve position within zoom z"""
+    if x >= 1 << z or y >= 1 << z:
+        raise ValueError(f"Tile {z}/{x}/{y} is outside zoom level {z}")
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    size = 1 << z
+    s = size >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        if ry == 0:
+            if rx == 1:
+                x = size - 1 - x
+                y = size - 1 - y
+            x, y = y, x
+        s >>= 1
+    return tile_id
+
+
+def tile_id_to_zxy(tile_id):
+    """Inverse of zxy_to_tile_id"""
+    z = 0
+    while tile_id >= ((1 << (2 * (z + 1))) - 1) // 3:
+        z += 1
+    position = tile_id - ((1 << (2 * z)) - 1) // 3
+    size = 1 << z
+    x = y = 0
+    s = 1
+    while s < size:
+        rx = 1 & (position // 2)
+        ry = 1 & (position ^ rx)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        x += s * rx
+        y += s * ry
+        position //= 4
+        s <<= 1
+    return z, x, y
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def serialize_directory(entries):
+    """
+    Gzip-compressed directory for a list of (tile_id, offset, length, run_length) entries
+
+    Tile IDs are delta-coded, and an offset that directly follows the previous
+    entry's data is written as 0.
+    """
+    out = _varint(len(entries))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        out += _varint(tile_id - last_id)
+        last_id = tile_id
+    for entry in entries:
+        out += _varint(entry[3])
+    for entry in entries:
+        out += _varint(entry[2])
+    next_offset = None
+    for _, offset, length, _ in entries:
+        out += _varint(0 if offset == next_offset else offset + 1)
+        next_offset = offset + length
+    return gzip.compress(bytes(out), mtime=0)
+
+
+def deserialize_directory(data, compression=COMPRESSION_GZIP):
+    """Inverse of serialize_directory: list of (tile_id, offset, length, run_length)"""
+    buf = gzip.decompress(data) if compression == COMPRESSION_GZIP else data
+    count, pos = _read_varint(buf, 0)
+    values = []
+    for _ in range(4 * count):
+        value, pos = _read_varint(buf, pos)
+        values.append(value)
+
+    entries = []
+    tile_id = 0
+    for i in range(count):
+        tile_id += values[i]
+        length = values[2 * count + i]
+        offset = values[3 * count + i]
+        if offset == 0 and i > 0:
+            offset = entries[-1][1] + entries[-1][2]
+        else:
+            offset -= 1
+        entries.append((tile_id, offset, length, values[count + i]))
+    return entries
+
+
+def build_directories(entries):
+    """
+    Root directory, and leaf directories if the root would not fit in the first 16 KiB
+
+    Returns:
+        (root directory bytes, leaf directories bytes)
+    """
+    root = serialize_directory(entries)
+    if len(root) <= ROOT_DIRECTORY_MAX:
+        return root, b''
+
+    leaf_size = LEAF_SIZE
+    while True:
+        root_entries = []
+        leaves = bytearray()
+        for start in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[start:start + leaf_size])
+            # A run length of 0 marks an entry pointing at a leaf directory
+            root_entries.append((entries[start][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+        root = serialize_directory(root_entries)
+        if len(root) <= ROOT_DIRECTORY_MAX:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+
+class PMTilesWriter:
+    """
+    Streams tiles into a new PMTiles archive
+
+    Args:
+        path: Output .pmtiles path (replaced when finish() succeeds)
+        tile_type: Tile format code (TILE_TYPE_MVT)
+        tile_compression: How the tile bytes passed to add() are compressed
+    """
+
+    def __init__(self, path, tile_type=TILE_TYPE_MVT, tile_compression=COMPRESSION_GZIP):
+        self.path = path
+        self.tile_type = tile_type
+        self.tile_compression = tile_compression
+        self.entries = []
+        self.addressed_tiles = 0
+        self._contents = {}
+        self._offset = 0
+        self._last_id = -1
+        self._last_digest = None
+        self._data = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+
+    def add(self, tile_id, data):
+        """Add one tile; tile IDs must strictly increase from call to call"""
+        if tile_id <= self._last_id:
+            raise ValueError(f"Tiles must be added in ascending tile ID order ({tile_id} after {self._last_id})")
+        self._last_id = tile_id
+        self.addressed_tiles += 1
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+
+        # The next tile ID with the same content just extends the previous entry's run
+        if self.entries and digest == self._last_digest:
+            last_tile_id, offset, length, run_length = self.entries[-1]
+            if tile_id == last_tile_id + run_length:
+                self.entries[-1] = (last_tile_id, offset, length, run_length + 1)
+                return
+        self._last_digest = digest
+
+        location = self._contents.get(digest)
+        if location is None:
+            location = self._contents[digest] = (self._offset, len(data))
+            self._data.write(data)
+            self._offset += len(data)
+        self.entries.append((tile_id, location[0], location[1], 1))
+
+    def finish(self, metadata, min_zoom, max_zoom, bounds, center_zoom=None):
+        """
+        Write the header, directories and metadata, then the tile data
+
+        Args:
+            metadata: JSON-serializable dict (name, vector_layers, ...)
+            min_zoom, max_zoom: Zoom range of the tiles
+            bounds: (min_lon, min_lat, max_lon, max_lat) of the data
+            center_zoom: Initial zoom for viewers (default: min_zoom)
+        """
+        root, leaves = build_directories(self.entries)
+        metadata_bytes = gzip.compress(json.dumps(metadata).encode('utf-8'), mtime=0)
+
+        root_offset = HEADER_SIZE
+        metadata_offset = root_offset + len(root)
+        leaves_offset = metadata_offset + len(metadata_bytes)
+        data_offset = leaves_offset + len(leaves)
+        min_lon, min_lat, max_lon, max_lat = bounds
+
+        def e7(degrees):
+            return int(round(degrees * 10_000_000))
+
+        header = HEADER.pack(
+            MAGIC, VERSION,
+            root_offset, len(root),
+            metadata_offset, len(metadata_bytes),
+            leaves_offset, len(leaves),
+            data_offset, self._offset,
+            self.addressed_tiles, len(self.entries), len(self._contents),
+            1,  # clustered: tile data is in tile ID order
+            COMPRESSION_GZIP, self.tile_compression, self.tile_type,
+            min_zoom, max_zoom,
+            e7(min_lon), e7(min_lat), e7(max_lon), e7(max_lat),
+            min_zoom if center_zoom is None else center_zoom,
+            e7((min_lon + max_lon) / 2), e7((min_lat + max_lat) / 2),
+        )
+
+        partial = f"{self.path}.partial"
+        with open(partial, 'wb') as out:
+            out.write(header)
+            out.write(root)
+            out.write(metadata_bytes)
+            out.write(leaves)
+            self._data.seek(0)
+            shutil.copyfileobj(self._data, out, 1 << 20)
+        self._data.close()
+        os.replace(partial, self.path)
+
+    def close(self):
+        """Drop the temporary tile data without writing an archive (after an error)"""
+        self._data.close()
+
+    def summary(self):
+        return (f"{self.addressed_tiles} tiles, {len(self._contents)} unique, "
+                f"{self._offset / 1048576:.1f} MB of tile data")
+
+
+class PMTilesReader:
+    """
+    Reads the header, metadata and tiles of an existing archive
+
+    Args:
+        path: .pmtiles file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        values = HEADER.unpack(self._file.read(HEADER_SIZE))
+        if values[0] != MAGIC or values[1] != VERSION:
+            self._file.close()
+            raise ValueError(f"{path} is not a PMTiles v{VERSION} archive")
+        self.header = dict(zip(HEADER_FIELDS, values))
+        metadata = self._read(self.header['metadata_offset'], self.header['metadata_length'])
+        if self.header['internal_compression'] == COMPRESSION_GZIP:
+            metadata = gzip.decompress(metadata)
+        self.metadata = json.loads(metadata) if metadata else {}
+
+    def _read(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    @property
+    def bounds(self):
+        """(min_lon, min_lat, max_lon, max_lat) from the header"""
+        names = ('min_lon_e7', 'min_lat_e7', 'max_lon_e7', 'max_lat_e7')
+        return tuple(self.header[name] / 10_000_000 for name in names)
+
+    def _directory(self, offset, length):
+        return deserialize_directory(self._read(offset, length), self.header['internal_compression'])
+
+    def entries(self):
+        """Tile entries (tile_id, offset, length, run_length) in tile ID order, leaf directories expanded"""
+        def walk(entries):
+            for entry in entries:
+                if entry[3] == 0:
+                    yield from walk(self._directory(self.header['leaves_offset'] + entry[1], entry[2]))
+                else:
+                    yield entry
+
+        yield from walk(self._directory(self.header['root_offset'], self.header['root_length']))
+
+    def locations(self):
+        """Dict tile ID -> (offset, length) of its data, one key per tile of every run"""
+        locations = {}
+        for tile_id, offset, length, run_length in self.entries():
+            for step in range(run_length):
+                locations[tile_id + step] = (offset, length)
+        return locations
+
+    def read_tile(self, offset, length):
+        """Stored (still compressed) bytes of a tile, from a location in the tile data"""
+        return self._read(self.header['data_offset'] + offset, length)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def patch_archive(path, tiles, bounds=None):
+    """
+    Rewrite an archive in place with some tiles replaced, added or removed
+
+    Every other tile is copied as stored (no re-encoding), and header,
+    metadata and zoom range are kept; the new archive replaces the old one in
+    one rename, so readers never see a half-written file.
+
+    Args:
+        path: Existing .pmtiles archive
+        tiles: Dict tile ID -> new stored tile bytes, or None to remove the tile
+        bounds: Optional (min_lon, min_lat, max_lon, max_lat) to widen the header bounds by
+
+    Returns:
+        The finished PMTilesWriter (for its summary)
+    """
+    with PMTilesReader(path) as reader:
+        header = reader.header
+        metadata = reader.metadata
+        archive_bounds = reader.bounds
+        locations = reader.locations()
+        writer = PMTilesWriter(path, header['tile_type'], header['tile_compression'])
+        try:
+            for tile_id in sorted(locations.keys() | tiles.keys()):
+                if tile_id in tiles:
+                    data = tiles[tile_id]
+                    if data is None:
+                        continue
+                else:
+                    data = reader.read_tile(*locations[tile_id])
+                writer.add(tile_id, data)
+        except BaseException:
+            writer.close()
+            raise
+
+    if bounds is not None:
+        archive_bounds = (min(archive_bounds[0], bounds[0]), min(archive_bounds[1], bounds[1]),
+                          max(archive_bounds[2], bounds[2]), max(archive_bounds[3], bounds[3]))
+    writer.finish(metadata, header['min_zoom'], header['max_zoom'], archive_bounds, header['center_zoom'])
+    return writer
@@ -0,0 +1,213 @@
+"""
+Adaptive, server-aware rate limiting shared by every external call
+Each endpoint (an ArcGIS host, Airtable, Supabase) gets one token bucket.
+Throttling (429) and server errors (5xx) halve its rate and honor Retry-After;
+a run of successful calls ramps the rate back up, so each service is driven at
+the fastest rate it actually tolerates instead of a guessed fixed sleep.
+"""
+
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+import requests
+
+from metrics import recorder
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 60.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Starting, minimum and maximum requests/second per endpoint kind
+ENDPOINT_DEFAULTS = {
+    'arcgis': {'rate': 10.0, 'min_rate': 0.5, 'max_rate': 50.0},
+    'airtable': {'rate': 5.0, 'min_rate': 0.5, 'max_rate': 5.0},  # Airtable's base limit is 5 req/s
+    'supabase': {'rate': 20.0, 'min_rate': 1.0, 'max_rate': 100.0},
+}
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate adapts to server feedback (AIMD)
+
+    Args:
+        name: Endpoint name, used in messages
+        rate: Starting requests/second
+        min_rate: Floor the rate never drops below
+        max_rate: Ceiling the rate never ramps above
+        burst: Bucket size (defaults to one second of max_rate)
+    """
+
+    def __init__(self, name, rate, min_rate, max_rate, burst=None):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst or max(1.0, max_rate)
+        self.throttled = 0
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return
+                    wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additive increase: ramp back up while the server is healthy"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + max(0.1, self.rate * 0.05))
+
+    def on_throttle(self, retry_after=None):
+        """Multiplicative decrease, plus a pause for the whole endpoint if the server asked for one"""
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(name, kind=None):
+    """
+    Get the shared limiter for an endpoint, creating it on first use
+
+    Args:
+        name: Endpoint key, e.g. 'arcgis:services1.arcgis.com' or 'airtable'
+        kind: Key into ENDPOINT_DEFAULTS (defaults to the part of name before ':')
+    """
+    with _registry_lock:
+        if name not in _limiters:
+            defaults = ENDPOINT_DEFAULTS[kind or name.split(':')[0]]
+            _limiters[name] = AdaptiveRateLimiter(name, **defaults)
+        return _limiters[name]
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for a 0-based retry attempt"""
+    return random.uniform(BACKOFF_BASE, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt + 1)))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def request_with_retry(session, method, url, limiter, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Send an HTTP request through a limiter, retrying 429/5xx and connection errors
+
+    Args:
+        session: requests.Session (or the requests module)
+        method: HTTP method
+        url: Request URL
+        limiter: AdaptiveRateLimiter for the endpoint
+        **kwargs: Passed to session.request (params, json, headers, timeout, ...)
+
+    Returns:
+        The final requests.Response (raise_for_status is left to the caller)
+    """
+    stage = f"http:{limiter.name}"
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            with recorder.time(stage) as timer:
+                response = session.request(method, url, **kwargs)
+                timer.add(nbytes=len(response.content))
+        except (requests.ConnectionError, requests.Timeout):
+            limiter.on_throttle()
+            if attempt == max_retries:
+                raise
+            recorder.count(stage, retries=1)
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS:
+            limiter.on_success()
+            if response.status_code >= 400:
+                recorder.count(stage, errors=1)
+            return response
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        limiter.on_throttle(retry_after)
+        if attempt == max_retries:
+            recorder.count(stage, errors=1)
+            return response
+        recorder.count(stage, retries=1)
+        if retry_after is None:
+            time.sleep(backoff_delay(attempt))
+
+    return response
+
+
+def _is_retryable_error(error):
+    """True for errors worth retrying: HTTP 429/5xx and transport failures"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        try:
+            status = int(getattr(error, 'code', None))
+        except (TypeError, ValueError):
+            status = None
+    if status in RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in ('ConnectError', 'ReadTimeout', 'WriteTimeout', 'ConnectTimeout',
+                                    'RemoteProtocolError', 'ConnectionError', 'Timeout')
+
+
+def call_with_backoff(limiter, func, max_retries=MAX_RETRIES):
+    """
+    Call a client function (e.g. a Supabase query's execute) through a limiter
+
+    Rate-limit, server and transport errors are retried with backoff; any
+    other exception is raised to the caller unchanged.
+    """
+    stage = f"http:{limiter.name}"
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            with recorder.time(stage):
+                result = func()
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable_error(e):
+                raise
+            limiter.on_throttle()
+            recorder.count(stage, retries=1)
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.on_success()
+        return result
+
+
+def execute(query):
+    """Execute a Supabase query builder through the shared Supabase limiter"""
+    return call_with_backoff(get_limiter('supabase'), query.execute)
@@ -0,0 +1,160 @@
+"""
+Parallel reprojection and acreage for parcel geometries
+Each chunk's coordinates are read once and transformed to both UTM Zone 12N
+(for the planar area in acres) and WGS84 (what the parcels table stores),
+instead of two separate to_crs() passes over the frame. Large chunks are
+split into coordinate parts spread over a process pool, so the (CPU bound)
+projection scales with core count. pyproj transformers are built once per
+process and reused for every part.
+
+Typical use:
+    with Reprojector(workers=8) as reprojector:
+        for gdf in iter_chunks(path):
+            gdf = reprojector.project_frame(gdf)  # adds calculated_acres, EPSG:4326 geometry
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+UTM_EPSG = 26912  # UTM Zone 12N, Utah
+WGS84_EPSG = 4326
+SQ_METERS_PER_ACRE = 4046.86
+
+DEFAULT_REPROJECT_WORKERS = os.cpu_count() or 1
+DEFAULT_PART_SIZE = 100000  # Coordinates per pool task
+
+
+@lru_cache(maxsize=None)
+def transformer(source, target):
+    """
+    Cached always_xy Transformer from source to target, or None if they are the same CRS
+
+    Args:
+        source, target: Anything pyproj.CRS accepts and can hash (WKT string, EPSG code)
+    """
+    source, target = CRS.from_user_input(source), CRS.from_user_input(target)
+    if source == target:
+        return None
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def transform_coords(coords, source, targets):
+    """
+    Transform a coordinate array from source into each target CRS
+
+    Args:
+        coords: (n, 2) or (n, 3) float array; z is carried through unchanged
+        source: Source CRS as WKT (or an EPSG code)
+        targets: Target CRS, e.g. (UTM_EPSG, WGS84_EPSG)
+
+    Returns:
+        List with one coordinate array per target (coords itself when target == source)
+    """
+    out = []
+    for target in targets:
+        project = transformer(source, target)
+        if project is None:
+            out.append(coords)
+            continue
+        projected = coords.copy()
+        projected[:, 0], projected[:, 1] = project.transform(coords[:, 0], coords[:, 1])
+        out.append(projected)
+    return out
+
+
+def source_crs(gdf):
+    """The frame's CRS as WKT (hashable, so transformers can be cached per source)"""
+    if gdf.crs is None:
+        raise ValueError("Shapefile has no CRS (missing .prj file), can't reproject it")
+    return gdf.crs.to_wkt()
+
+
+class Reprojector:
+    """
+    Projects geometry arrays with the coordinate transforms spread over a process pool
+
+    Only the flat coordinate arrays go to the workers: pickling geometry
+    objects costs more than projecting them. Geometries are rebuilt from the
+    projected coordinates in the calling process.
+    """
+
+    def __init__(self, workers=DEFAULT_REPROJECT_WORKERS, part_size=DEFAULT_PART_SIZE):
+        """
+        Args:
+            workers: Worker processes (1 projects in the calling process)
+            part_size: Coordinates per pool task
+        """
+        self.workers = max(1, workers or 1)
+        self.part_size = part_size
+        self._pool = None
+
+    def _transform(self, coords, source, targets):
+        """transform_coords, with large arrays split across the pool"""
+        if self.workers == 1 or len(coords) < 2 * self.part_size:
+            return transform_coords(coords, source, targets)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        parts = [coords[start:start + self.part_size] for start in range(0, len(coords), self.part_size)]
+        results = list(self._pool.map(transform_coords, parts, repeat(source), repeat(targets)))
+        return [np.concatenate([result[i] for result in results]) for i in range(len(targets))]
+
+    def project(self, geoms, source, wgs84=True):
+        """
+        Acreage and (optionally) WGS84 geometries for an array of geometries
+
+        Args:
+            geoms: NumPy object array of shapely geometries in the source CRS
+            source: Source CRS as WKT (or an EPSG code)
+            wgs84: Also return the geometries reprojected to EPSG:4326
+
+        Returns:
+            (float array of acres, NaN for missing geometry; WGS84 geometry array or None)
+        """
+        include_z = bool(shapely.has_z(geoms).any())
+        coords = shapely.get_coordinates(geoms, include_z=include_z)
+        targets = (UTM_EPSG, WGS84_EPSG) if wgs84 else (UTM_EPSG,)
+        projected = self._transform(coords, source, targets)
+
+        def rebuild(target_coords):
+            if target_coords is coords:
+                return geoms
+            return shapely.set_coordinates(geoms.copy(), target_coords)
+
+        acres = shapely.area(rebuild(projected[0])) / SQ_METERS_PER_ACRE
+        return acres, rebuild(projected[1]) if wgs84 else None
+
+    def project_frame(self, gdf):
+        """Add calculated_acres and reproject a GeoDataFrame to EPSG:4326 in one pass"""
+        acres, projected = self.project(np.asarray(gdf.geometry.values, dtype=object), source_crs(gdf))
+        gdf['calculated_acres'] = acres
+        return gdf.set_geometry(gpd.GeoSeries(projected, index=gdf.index, crs=WGS84_EPSG, name=gdf.geometry.name))
+
+    def acreage(self, gdf):
+        """Planar UTM acreage of every geometry in a GeoDataFrame (no WGS84 output)"""
+        return self.project(np.asarray(gdf.geometry.values, dtype=object), source_crs(gdf), wgs84=False)[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_reproject_arguments(parser):
+    """Add the reprojection worker option to a script's argparse parser"""
+    parser.add_argument('--reproject-workers', type=int, default=DEFAULT_REPROJECT_WORKERS,
+                        help=f'Processes reprojecting geometry and computing acreage '
+                             f'(default: {DEFAULT_REPROJECT_WORKERS}, the number of CPUs)')
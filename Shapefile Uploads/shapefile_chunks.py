@@ -0,0 +1,48 @@
+"""
+Chunked shapefile reading with bounded memory
+Reads a shapefile (or any OGR source) in fixed-size feature slices so that
+callers can reproject, transform and upload one chunk at a time instead of
+holding the whole file in memory
+"""
+
+import geopandas as gpd
+
+DEFAULT_CHUNK_SIZE = 20000
+
+
+def count_features(path):
+    """Number of features in a source, or None if the reader can't report it cheaply"""
+    try:
+        import pyogrio
+        return pyogrio.read_info(path)['features']
+    except Exception:
+        return None
+
+
+def iter_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """
+    Yield GeoDataFrames of at most chunk_size features
+
+    Args:
+        path: Path to the .shp file
+        chunk_size: Features per chunk (None reads the whole file at once)
+        limit: Maximum number of features to read in total (None for all)
+
+    Yields:
+        GeoDataFrame chunks in file order
+    """
+    if not chunk_size:
+        gdf = gpd.read_file(path, rows=limit) if limit else gpd.read_file(path)
+        yield gdf
+        return
+
+    start = 0
+    while limit is None or start < limit:
+        stop = start + chunk_size if limit is None else min(start + chunk_size, limit)
+        chunk = gpd.read_file(path, rows=slice(start, stop))
+        if chunk.empty:
+            break
+        yield chunk
+        if len(chunk) < stop - start:
+            break
+        start = stop
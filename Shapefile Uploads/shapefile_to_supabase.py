@@ -1,15 +1,25 @@
 """
 Parcel Shapefile to Supabase Uploader
 Reads a parcel shapefile and uploads it to Supabase PostGIS database
+
+Writers:
+  rest - Supabase REST API, one insert per record (default); with
+         --geometry-format ewkb one upsert_parcels call per batch (migration 044)
+  copy - direct Postgres connection, binary COPY into a staging table and a
+         set-based merge into parcels (see pg_copy.py)
 """
 
-import geopandas as gpd
+import numpy as np
+import shapely
 from supabase import create_client
-from shapely.geometry import mapping
-import json
 from tqdm import tqdm
 import os
 from dotenv import load_dotenv
+from geometry_encoding import add_geometry_arguments, encode_geometries, snap_geometries
+from metrics import add_metrics_arguments, metrics_from_args, recorder
+from reproject import DEFAULT_REPROJECT_WORKERS, Reprojector, add_reproject_arguments
+from shapefile_chunks import DEFAULT_CHUNK_SIZE, count_features, iter_chunks
+from rate_limit import execute
 
 # Load environment variables
 load_dotenv()
@@ -20,123 +30,157 @@ SUPABASE_KEY = os.getenv("VITE_SUPABASE_ANON_KEY")  # or use service_role key fo
 # Initialize Supabase client
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-def clean_value(value):
-    """Clean None/NaN values for JSON serialization"""
-    if value is None or (isinstance(value, float) and str(value) == 'nan'):
-        return None
-    return value
+# Davis County shapefile column -> parcels column (all stored as text)
+COLUMN_MAP = {
+    'PARCEL_ID': 'apn',
+    'PARCEL_ADD': 'address',
+    'PARCEL_CIT': 'city',
+    'PARCEL_ZIP': 'zip_code',
+    'FIPS': 'fips',
+    'OWN_TYPE': 'owner_type',
+    'RECORDER': 'recorder_phone',
+    'CoParcel_U': 'property_url',
+}
+
+def text_column(gdf, column):
+    """Whole-column NaN -> None and value -> str conversion (all None if the column is missing)"""
+    if column not in gdf.columns:
+        return np.full(len(gdf), None, dtype=object)
+    values = gdf[column].to_numpy(dtype=object)
+    mask = gdf[column].notna().to_numpy()
+    out = np.full(len(values), None, dtype=object)
+    out[mask] = values[mask].astype(str)
+    return out
+
+def build_records(gdf, geometry_format='ewkt', precision=None):
+    """
+    Columnar transform of a GeoDataFrame (already in EPSG:4326) into parcel records
+
+    Column mapping, NaN -> None, type coercion, Polygon -> MultiPolygon
+    promotion and geometry encoding all run on whole arrays at once.
+
+    Args:
+        gdf: GeoDataFrame with the shapefile columns plus 'calculated_acres'
+        geometry_format: 'ewkt' ('SRID=4326;<WKT>' for the REST API), 'ewkb' (hex string,
+            for the REST API) or 'wkb' (bytes for COPY), see geometry_encoding.py
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
+
+    Returns:
+        (list of record dicts, number of rows skipped for missing/empty geometry)
+    """
+    geoms = snap_geometries(np.asarray(gdf.geometry.values, dtype=object), precision)
+    valid = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    failed = int((~valid).sum())
+    gdf = gdf[valid]
+    geoms = geoms[valid]
+
+    # Promote Polygons to single-part MultiPolygons (Supabase table expects MultiPolygon)
+    is_polygon = shapely.get_type_id(geoms) == 3
+    if is_polygon.any():
+        polygons = geoms[is_polygon]
+        geoms[is_polygon] = shapely.multipolygons(polygons, indices=np.arange(len(polygons)))
 
-def upload_parcels(shapefile_path, batch_size=100, limit=None):
+    # Encode every geometry in one call (PostGIS format)
+    geom_values = encode_geometries(geoms, geometry_format)
+
+    columns = {target: text_column(gdf, source) for source, target in COLUMN_MAP.items()}
+    acres = gdf['calculated_acres'].to_numpy(dtype=float)
+    columns['size_acres'] = np.where(np.isnan(acres), None, acres).astype(object)
+    columns['county'] = np.full(len(gdf), 'Davis', dtype=object)
+    columns['geom'] = geom_values
+
+    keys = list(columns.keys())
+    records = [dict(zip(keys, row)) for row in zip(*(columns[key].tolist() for key in keys))]
+    return records, failed
+
+def add_acreage_and_reproject(gdf, reprojector=None):
+    """
+    Add calculated_acres and reproject a chunk to WGS84 (EPSG:4326)
+
+    The coordinates are read once and projected to UTM Zone 12N (for the
+    area) and WGS84 together, across the reprojector's process pool.
+    """
+    if reprojector is None:
+        with Reprojector(workers=1) as reprojector:
+            return reprojector.project_frame(gdf)
+    return reprojector.project_frame(gdf)
+
+def upload_parcels(shapefile_path, batch_size=100, limit=None, writer='rest', database_url=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE, geometry_format='ewkt', precision=None,
+                   reproject_workers=DEFAULT_REPROJECT_WORKERS):
     """
     Upload parcels from shapefile to Supabase
 
+    The file is streamed in chunks of chunk_size features; each chunk is
+    reprojected, transformed and uploaded before the next one is read, so
+    peak memory depends on the chunk size rather than the file size.
+
     Args:
         shapefile_path: Path to the .shp file
         batch_size: Number of records to upload at once
         limit: Maximum number of parcels to upload (None for all)
+        writer: 'rest' (Supabase REST inserts) or 'copy' (direct Postgres binary COPY)
+        database_url: Postgres connection string for the copy writer
+        chunk_size: Features read per chunk (None reads the whole file at once)
+        geometry_format: Geometry encoding for the rest writer, 'ewkt' or 'ewkb' (copy always sends WKB)
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
+        reproject_workers: Processes projecting each chunk's coordinates (1 projects in this process)
     """
-    print(f"Reading shapefile: {shapefile_path}")
-    
-    # Read shapefile
-    gdf = gpd.read_file(shapefile_path)
+    copy_writer = None
+    if writer == 'copy':
+        from pg_copy import ParcelCopyWriter
+        copy_writer = ParcelCopyWriter(database_url)
+
+    def write(batch):
+        with recorder.time('upload', items=len(batch)):
+            if copy_writer is not None:
+                copy_writer.write_batch(batch)
+            elif geometry_format == 'ewkb':
+                upsert_batch(batch)
+            else:
+                upload_batch(batch)
 
-    # Limit to subset if specified
+    print(f"Reading shapefile: {shapefile_path}")
+    total = count_features(shapefile_path)
     if limit:
         print(f"Limiting to first {limit} parcels for testing...")
-        gdf = gdf.head(limit)
-
-    # Calculate acreage from geometry
-    print("Calculating acreage from geometry...")
-    gdf_utm = gdf.to_crs(epsg=26912)  # UTM Zone 12N for Utah
-    gdf['calculated_acres'] = gdf_utm.geometry.area / 4046.86  # Convert sq meters to acres
-
-    # Reproject to WGS84 (EPSG:4326) if needed
-    if gdf.crs.to_epsg() != 4326:
-        print(f"Reprojecting from {gdf.crs} to EPSG:4326...")
-        gdf = gdf.to_crs(epsg=4326)
-
-    print(f"Total parcels to upload: {len(gdf)}")
-    print(f"Columns in shapefile: {list(gdf.columns)}")
-    
-    # Show user the actual column names
-    print("\nAvailable columns:")
-    for i, col in enumerate(gdf.columns):
-        print(f"  {i}: {col}")
-
-    # Prepare records for upload
-    records = []
+        total = min(total, limit) if total is not None else limit
+    if total is not None:
+        print(f"Total parcels to upload: {total}")
+
+    uploaded = 0
     failed = 0
 
-    for idx, row in tqdm(gdf.iterrows(), total=len(gdf), desc="Processing parcels"):
-        try:
-            # Extract Davis County specific fields
-            apn = clean_value(row.get('PARCEL_ID'))
-            address = clean_value(row.get('PARCEL_ADD'))
-            city = clean_value(row.get('PARCEL_CIT'))
-            zip_code = clean_value(row.get('PARCEL_ZIP'))
-            fips = clean_value(row.get('FIPS'))
-            owner_type = clean_value(row.get('OWN_TYPE'))
-            recorder_phone = clean_value(row.get('RECORDER'))
-            property_url = clean_value(row.get('CoParcel_U'))
-            size_acres = row.get('calculated_acres')
-
-            # Convert to strings where needed
-            if apn: apn = str(apn)
-            if address: address = str(address)
-            if city: city = str(city)
-            if zip_code: zip_code = str(zip_code)
-            if fips: fips = str(fips)
-            if owner_type: owner_type = str(owner_type)
-            if recorder_phone: recorder_phone = str(recorder_phone)
-            if property_url: property_url = str(property_url)
-            if size_acres: size_acres = float(size_acres)
-            
-            # Get geometry as GeoJSON
-            geom = row.geometry
-            if geom is None or geom.is_empty:
-                failed += 1
-                continue
-            
-            # Convert to MultiPolygon if it's a Polygon
-            if geom.geom_type == 'Polygon':
-                from shapely.geometry import MultiPolygon
-                geom = MultiPolygon([geom])
-            
-            # Convert to GeoJSON string for PostGIS
-            geojson = json.dumps(mapping(geom))
-
-            record = {
-                'apn': apn,
-                'address': address,
-                'city': city,
-                'zip_code': zip_code,
-                'county': 'Davis',
-                'fips': fips,
-                'owner_type': owner_type,
-                'size_acres': size_acres,
-                'recorder_phone': recorder_phone,
-                'property_url': property_url,
-                'geom': f'SRID=4326;{geom.wkt}'  # PostGIS format
-            }
-            
-            records.append(record)
-            
+    with tqdm(total=total, desc="Uploading parcels") as pbar, Reprojector(reproject_workers) as reprojector:
+        for chunk_index, gdf in enumerate(recorder.iter_timed('read', iter_chunks(shapefile_path, chunk_size, limit))):
+            if chunk_index == 0:
+                # Show user the actual column names
+                print("\nAvailable columns:")
+                for i, col in enumerate(gdf.columns):
+                    print(f"  {i}: {col}")
+                if gdf.crs.to_epsg() != 4326:
+                    print(f"Reprojecting from {gdf.crs} to EPSG:4326 and calculating acreage per chunk...")
+
+            with recorder.time('transform', items=len(gdf)):
+                gdf = add_acreage_and_reproject(gdf, reprojector)
+
+                # Transform the whole chunk at once
+                records, chunk_failed = build_records(gdf, 'wkb' if copy_writer is not None else geometry_format,
+                                                      precision)
+
             # Upload in batches
-            if len(records) >= batch_size:
-                upload_batch(records)
-                records = []
-                
-        except Exception as e:
-            print(f"\nError processing record {idx}: {e}")
-            failed += 1
-            continue
-    
-    # Upload remaining records
-    if records:
-        upload_batch(records)
-    
+            for start in range(0, len(records), batch_size):
+                write(records[start:start + batch_size])
+
+            uploaded += len(records)
+            failed += chunk_failed
+            pbar.update(len(gdf))
+
+    if copy_writer is not None:
+        copy_writer.close()
+
     print(f"\nUpload complete!")
-    print(f"  Successfully uploaded: {len(gdf) - failed}")
+    print(f"  Successfully uploaded: {uploaded}")
     print(f"  Failed: {failed}")
 
 def upload_batch(records):
@@ -144,16 +188,24 @@ def upload_batch(records):
     try:
         # Use raw SQL for PostGIS geometry insertion
         for record in records:
-            supabase.table('parcels').insert(record).execute()
+            execute(supabase.table('parcels').insert(record))
     except Exception as e:
         print(f"\nBatch upload error: {e}")
         print("Trying individual inserts...")
         for record in records:
             try:
-                supabase.table('parcels').insert(record).execute()
+                execute(supabase.table('parcels').insert(record))
             except Exception as e2:
                 print(f"Failed to insert record: {e2}")
 
+def upsert_batch(records):
+    """Upsert a batch in one upsert_parcels call (migration 044), falling back to single inserts"""
+    try:
+        execute(supabase.rpc('upsert_parcels', {'parcel_data': records}))
+    except Exception as e:
+        print(f"\nBatch upsert error: {e}")
+        upload_batch(records)
+
 def test_connection():
     """Test Supabase connection"""
     try:
@@ -165,17 +217,45 @@ def test_connection():
         return False
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Upload a parcel shapefile to Supabase')
+    parser.add_argument('shapefile', nargs='?', help='Path to the parcel shapefile (.shp); prompted for if omitted')
+    parser.add_argument('--limit', type=int, default=500, help='Maximum parcels to upload (default: 500 for testing, 0 for all)')
+    parser.add_argument('--batch-size', type=int, help='Records per batch (default: 50 for rest, 10000 for copy)')
+    parser.add_argument('--writer', choices=['rest', 'copy'], default='rest',
+                        help='rest: Supabase REST inserts; copy: binary COPY over a direct Postgres connection')
+    parser.add_argument('--database-url', help='Postgres connection string for --writer copy (default: SUPABASE_DB_URL from .env)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Features read per chunk, bounds peak memory (default: {DEFAULT_CHUNK_SIZE}, 0 reads the whole file)')
+    add_geometry_arguments(parser, 'ewkt', formats=('ewkt', 'ewkb'))
+    add_reproject_arguments(parser)
+    add_metrics_arguments(parser)
+
+    args = parser.parse_args()
+    metrics_from_args('shapefile_to_supabase', args)
+
     # Test connection first
-    if not test_connection():
+    if args.writer == 'rest' and not test_connection():
         print("\nPlease check your Supabase credentials in .env file")
         exit(1)
-    
+
     # Path to your shapefile
-    shapefile_path = input("Enter path to your parcel shapefile (.shp): ").strip('"')
-    
+    shapefile_path = args.shapefile or input("Enter path to your parcel shapefile (.shp): ").strip('"')
+
     if not os.path.exists(shapefile_path):
         print(f"Error: File not found: {shapefile_path}")
         exit(1)
-    
-    # Upload parcels (limit to 500 for testing)
-    upload_parcels(shapefile_path, batch_size=50, limit=500)
\ No newline at end of file
+
+    batch_size = args.batch_size or (10000 if args.writer == 'copy' else 50)
+    upload_parcels(
+        shapefile_path,
+        batch_size=batch_size,
+        limit=args.limit or None,
+        writer=args.writer,
+        database_url=args.database_url,
+        chunk_size=args.chunk_size or None,
+        geometry_format=args.geometry_format,
+        precision=args.precision,
+        reproject_workers=args.reproject_workers
+    )
\ No newline at end of file
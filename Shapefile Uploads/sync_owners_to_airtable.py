@@ -3,56 +3,177 @@ Sync Landowner Data to Airtable
 Once you get owner data from Davis County, this script will:
 1. Read the owner CSV/Excel file
 2. Match with parcel data
-3. Create/update landowner records in Airtable
+3. Create/update landowner records in Airtable (upserted on APN, 10 per request)
+
+With --from-parcels the owners are streamed from the Supabase parcels table
+instead (the owner_* columns loaded by sync_parcels_from_utah_api.py), one
+keyset page at a time, optionally filtered by city, prop_class or acreage.
+
+With --diff the Landowners table is read once first, and only new and
+changed owners are sent (--delete also removes landowners no longer in the
+file), so a refresh that touches 2% of parcels costs ~2% of the writes.
 """
 
+import numpy as np
 import pandas as pd
 import os
 from dotenv import load_dotenv
-import requests
 from tqdm import tqdm
-import time
+
+from airtable_writer import (DEFAULT_AIRTABLE_WORKERS, AirtableUpsertWriter, add_airtable_arguments,
+                             fields_fingerprint, load_record_index)
+from metrics import add_metrics_arguments, metrics_from_args, recorder
+from rate_limit import execute
 
 # Load environment variables
 load_dotenv('../.env')
 
 AIRTABLE_TOKEN = os.getenv("VITE_AIRTABLE_TOKEN")
 AIRTABLE_BASE = os.getenv("VITE_AIRTABLE_BASE")
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com/v0")  # Overridden by the benchmark stand-in
 
 # You'll need to create a "Landowners" table in Airtable
 LANDOWNERS_TABLE = "Landowners"  # Change this to your actual table name
 
-def read_owner_data(file_path):
+# Fields this script writes (the optional property fields only when their columns are given)
+OWNER_FIELDS = ["APN", "Owner Name", "Mailing Address", "City", "State", "ZIP"]
+
+# parcels columns read by --from-parcels, and the rows fetched per keyset page
+PARCEL_OWNER_COLUMNS = 'apn,owner_name,owner_address,owner_city,owner_state,owner_zip,address,total_mkt_value'
+PARCEL_PAGE_SIZE = 1000
+
+# Owner file rows per chunk (CSV chunks through pyarrow are ~16 MB blocks instead)
+DEFAULT_OWNER_CHUNK_SIZE = 50000
+CSV_BLOCK_SIZE = 16 << 20
+
+# Text fields and the value used when a row has none ("State" defaults to Utah)
+TEXT_FIELD_DEFAULTS = {"APN": "", "Owner Name": "", "Mailing Address": "", "City": "", "State": "UT", "ZIP": "",
+                       "Property Address": ""}
+
+def owner_file_columns(file_path):
+    """Column names of a CSV/Excel owner file (reads only the header)"""
+    if file_path.endswith('.csv'):
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    if file_path.endswith(('.xlsx', '.xls')):
+        return list(pd.read_excel(file_path, nrows=0).columns)
+    raise ValueError("File must be CSV or Excel format")
+
+def iter_owner_chunks(file_path, columns=None, numeric_columns=(), chunk_size=DEFAULT_OWNER_CHUNK_SIZE):
     """
-    Read owner data from CSV or Excel
+    Stream a CSV/Excel owner file as DataFrame chunks
+
+    Every column is read as text, so APNs and ZIP codes keep their leading
+    zeros and a stray value ("N/A", "12.5" in a column of whole numbers) deep
+    in the file cannot fail type inference made on an earlier block or chunk;
+    numeric_columns are then converted per chunk with pd.to_numeric. Only the
+    listed columns are parsed.
+    CSV files stream through pyarrow's multithreaded reader when it is
+    installed, else pandas' C parser in chunk_size rows; Excel files have no
+    streaming reader and are loaded whole, then sliced.
 
     Args:
         file_path: Path to owner data file from county
+        columns: Columns to read (None for all)
+        numeric_columns: Columns parsed as numbers (unparseable values become NaN)
+        chunk_size: Rows per chunk
 
-    Returns:
-        DataFrame with owner information
+    Yields:
+        DataFrame chunks in file order
     """
-    print(f"Reading owner data from: {file_path}")
+    columns = list(columns) if columns is not None else owner_file_columns(file_path)
 
     if file_path.endswith('.csv'):
-        df = pd.read_csv(file_path)
+        try:
+            from pyarrow import csv as pa_csv
+            import pyarrow as pa
+        except ImportError:
+            pa_csv = None
+
+        if pa_csv is not None:
+            reader = pa_csv.open_csv(
+                file_path,
+                read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+                convert_options=pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True,
+                                                      column_types={c: pa.string() for c in columns}))
+            chunks = (batch.to_pandas() for batch in reader)
+        else:
+            chunks = pd.read_csv(file_path, usecols=columns, dtype={c: str for c in columns},
+                                 engine='c', chunksize=chunk_size)
     elif file_path.endswith(('.xlsx', '.xls')):
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(file_path, usecols=columns, dtype={c: str for c in columns})
+        chunks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
     else:
         raise ValueError("File must be CSV or Excel format")
 
+    for chunk in chunks:
+        for column in numeric_columns:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        yield chunk
+
+def read_owner_data(file_path):
+    """
+    Read owner data from CSV or Excel
+
+    Args:
+        file_path: Path to owner data file from county
+
+    Returns:
+        DataFrame with owner information (all columns as text)
+    """
+    print(f"Reading owner data from: {file_path}")
+
+    chunks = list(iter_owner_chunks(file_path))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=owner_file_columns(file_path))
+
     print(f"Loaded {len(df)} owner records")
     print(f"Columns: {list(df.columns)}")
 
     return df
 
-def create_airtable_record(apn, owner_name, mailing_address, city, state, zip_code,
-                          property_address=None, property_value=None):
+def owner_field_batch(chunk, mapping):
+    """
+    Vectorized owner_fields for a DataFrame chunk
+
+    Args:
+        chunk: DataFrame read by iter_owner_chunks
+        mapping: Airtable field -> column, only for columns the file has
+
+    Returns:
+        (list of Airtable fields dicts, number of rows skipped for no APN or owner name)
     """
-    Create or update a landowner record in Airtable
+    keep = (chunk[mapping["APN"]].notna() & chunk[mapping["Owner Name"]].notna()).to_numpy()
+    chunk = chunk[keep]
+
+    def text(field):
+        default = TEXT_FIELD_DEFAULTS[field]
+        column = mapping.get(field)
+        if column is None:
+            return np.full(len(chunk), default, dtype=object)
+        values = chunk[column]
+        return values.where(values.notna() & (values != ''), default).to_numpy(dtype=object)
+
+    records = [dict(zip(OWNER_FIELDS, row)) for row in zip(*(text(field) for field in OWNER_FIELDS))]
+
+    # Optional fields only on the rows that have them
+    if "Property Address" in mapping:
+        for record, address in zip(records, text("Property Address")):
+            if address:
+                record["Property Address"] = address
+    if "Property Value" in mapping:
+        values = chunk[mapping["Property Value"]].to_numpy(dtype=float)
+        for record, value in zip(records, values):
+            if value and not np.isnan(value):
+                record["Property Value"] = float(value)
+
+    return records, int((~keep).sum())
+
+def owner_fields(apn, owner_name, mailing_address, city, state, zip_code,
+                 property_address=None, property_value=None):
+    """
+    Build the Airtable fields of a landowner record
 
     Args:
-        apn: Parcel ID
+        apn: Parcel ID (the field records are merged on)
         owner_name: Owner full name
         mailing_address: Mailing street address
         city: City
@@ -62,50 +183,24 @@ def create_airtable_record(apn, owner_name, mailing_address, city, state, zip_co
         property_value: Assessed value (optional)
 
     Returns:
-        Airtable record ID or None if failed
+        Dictionary of Airtable field name -> value
     """
-    url = f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{LANDOWNERS_TABLE}"
-
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
-    # Construct the record
-    record = {
-        "fields": {
-            "APN": str(apn),
-            "Owner Name": str(owner_name) if owner_name else "",
-            "Mailing Address": str(mailing_address) if mailing_address else "",
-            "City": str(city) if city else "",
-            "State": str(state) if state else "UT",
-            "ZIP": str(zip_code) if zip_code else "",
-        }
+    fields = {
+        "APN": str(apn),
+        "Owner Name": str(owner_name) if owner_name else "",
+        "Mailing Address": str(mailing_address) if mailing_address else "",
+        "City": str(city) if city else "",
+        "State": str(state) if state else "UT",
+        "ZIP": str(zip_code) if zip_code else "",
     }
 
     # Add optional fields if provided
     if property_address:
-        record["fields"]["Property Address"] = str(property_address)
+        fields["Property Address"] = str(property_address)
     if property_value:
-        record["fields"]["Property Value"] = float(property_value)
-
-    try:
-        response = requests.post(url, json=record, headers=headers)
-
-        if response.status_code == 200:
-            return response.json()['id']
-        elif response.status_code == 429:
-            # Rate limit - wait and retry
-            print("Rate limited, waiting...")
-            time.sleep(30)
-            return create_airtable_record(apn, owner_name, mailing_address, city,
-                                        state, zip_code, property_address, property_value)
-        else:
-            print(f"Error creating record for APN {apn}: {response.text}")
-            return None
-    except Exception as e:
-        print(f"Exception creating record for APN {apn}: {e}")
-        return None
+        fields["Property Value"] = float(property_value)
+
+    return fields
 
 def sync_owners_to_airtable(owner_file_path,
                             apn_column='PARCEL_ID',
@@ -116,91 +211,287 @@ def sync_owners_to_airtable(owner_file_path,
                             mail_zip_column='MAIL_ZIP',
                             property_addr_column=None,
                             property_value_column=None,
-                            limit=None):
+                            limit=None,
+                            workers=DEFAULT_AIRTABLE_WORKERS,
+                            diff=False,
+                            delete=False,
+                            chunk_size=DEFAULT_OWNER_CHUNK_SIZE):
     """
     Sync owner data from county file to Airtable
 
+    Records are upserted on APN, so re-running the sync updates existing
+    landowners instead of creating duplicates. The file is streamed in typed
+    chunks, so memory is bounded by the chunk size rather than the county.
+
     Args:
         owner_file_path: Path to CSV/Excel file from county
         *_column: Column names in the file (adjust based on actual file)
         limit: Max records to sync (for testing)
+        workers: Upsert requests in flight at once (see airtable_writer.py)
+        diff: Read the Landowners table first and only send new and changed records
+        delete: With diff, also delete landowners whose APN is not in the file
+            (and duplicate records for one APN)
+        chunk_size: Rows read per chunk
+
+    Returns:
+        The closed AirtableUpsertWriter (created/updated/deleted/failed counts), or None if aborted
     """
     print("=" * 60)
     print("Landowner Data Sync - County Data → Airtable")
     print("=" * 60)
 
-    # Read owner data
-    df = read_owner_data(owner_file_path)
+    if delete and limit:
+        print("--delete cannot be combined with --limit (it would delete every landowner past the limit). Aborting.")
+        return
 
-    if limit:
-        print(f"Limiting to first {limit} records for testing")
-        df = df.head(limit)
+    # Resolve the column mapping once, from the header
+    print(f"Reading owner data from: {owner_file_path}")
+    available = owner_file_columns(owner_file_path)
+    print(f"Columns: {available}")
 
-    # Check if columns exist
     required_cols = [apn_column, owner_column]
-    missing = [col for col in required_cols if col not in df.columns]
+    missing = [col for col in required_cols if col not in available]
     if missing:
         print(f"\nERROR: Missing required columns: {missing}")
-        print(f"Available columns: {list(df.columns)}")
+        print(f"Available columns: {available}")
         return
 
-    # Sync to Airtable
-    success_count = 0
-    failed_count = 0
-
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Syncing to Airtable"):
-        apn = row.get(apn_column)
-        owner_name = row.get(owner_column)
-        mail_addr = row.get(mail_addr_column) if mail_addr_column in df.columns else None
-        mail_city = row.get(mail_city_column) if mail_city_column in df.columns else None
-        mail_state = row.get(mail_state_column) if mail_state_column in df.columns else 'UT'
-        mail_zip = row.get(mail_zip_column) if mail_zip_column in df.columns else None
-        prop_addr = row.get(property_addr_column) if property_addr_column and property_addr_column in df.columns else None
-        prop_value = row.get(property_value_column) if property_value_column and property_value_column in df.columns else None
-
-        # Skip if no APN or owner name
-        if pd.isna(apn) or pd.isna(owner_name):
-            failed_count += 1
-            continue
-
-        # Create record in Airtable
-        record_id = create_airtable_record(
-            apn=apn,
-            owner_name=owner_name,
-            mailing_address=mail_addr,
-            city=mail_city,
-            state=mail_state,
-            zip_code=mail_zip,
-            property_address=prop_addr,
-            property_value=prop_value
-        )
+    configured = {"APN": apn_column, "Owner Name": owner_column, "Mailing Address": mail_addr_column,
+                  "City": mail_city_column, "State": mail_state_column, "ZIP": mail_zip_column,
+                  "Property Address": property_addr_column, "Property Value": property_value_column}
+    mapping = {field: column for field, column in configured.items() if column and column in available}
+    numeric = [mapping["Property Value"]] if "Property Value" in mapping else []
 
-        if record_id:
-            success_count += 1
-        else:
-            failed_count += 1
+    if limit:
+        print(f"Limiting to first {limit} records for testing")
+
+    skipped = {'count': 0}
+
+    def owner_batches():
+        """Typed file chunks -> batches of Airtable fields (APN repeats are dropped by write_owners)"""
+        remaining = limit
+        chunks = iter_owner_chunks(owner_file_path, list(dict.fromkeys(mapping.values())), numeric, chunk_size)
+        for chunk in recorder.iter_timed('read', chunks):
+            if remaining is not None:
+                chunk = chunk.iloc[:remaining]
+                remaining -= len(chunk)
+            with recorder.time('transform', items=len(chunk)):
+                records, chunk_skipped = owner_field_batch(chunk, mapping)
+            skipped['count'] += chunk_skipped
+            yield records
+            if remaining == 0:
+                return
+
+    synced_fields = OWNER_FIELDS + [name for name in ("Property Address", "Property Value")
+                                    if configured[name]]
+    return write_owners(owner_batches(), synced_fields, workers=workers, diff=diff, delete=delete, skipped=skipped)
+
+def iter_parcel_owners(client, cities=None, prop_classes=None, min_acres=None, max_acres=None, limit=None,
+                       page_size=PARCEL_PAGE_SIZE):
+    """
+    Stream owner fields out of the parcels table, one keyset page at a time
+
+    Pages are ordered by apn and each one starts after the last apn of the
+    previous page, so every page is an index range scan and memory stays at
+    one page however large the county is.
+
+    Args:
+        client: Supabase client
+        cities: Only parcels in these cities
+        prop_classes: Only parcels with these LIR property classes (e.g. ['Vacant'])
+        min_acres, max_acres: parcel_acres range (LIR acreage, as in search_parcels)
+        limit: Stop after this many parcels
+        page_size: Rows per request
+
+    Yields:
+        One list per page with the Airtable fields of each parcel with an owner name
+    """
+    last_apn = None
+    yielded = 0
+    while limit is None or yielded < limit:
+        size = page_size if limit is None else min(page_size, limit - yielded)
+        query = (client.table('parcels').select(PARCEL_OWNER_COLUMNS)
+                 .not_.is_('owner_name', 'null').order('apn').limit(size))
+        if last_apn is not None:
+            query = query.gt('apn', last_apn)
+        if cities:
+            query = query.in_('city', cities)
+        if prop_classes:
+            query = query.in_('prop_class', prop_classes)
+        if min_acres is not None:
+            query = query.gte('parcel_acres', min_acres)
+        if max_acres is not None:
+            query = query.lte('parcel_acres', max_acres)
+
+        with recorder.time('read') as timer:
+            rows = execute(query).data
+            timer.add(items=len(rows))
+        yield [owner_fields(
+            apn=row['apn'],
+            owner_name=row['owner_name'],
+            mailing_address=row.get('owner_address'),
+            city=row.get('owner_city'),
+            state=row.get('owner_state'),
+            zip_code=row.get('owner_zip'),
+            property_address=row.get('address'),
+            property_value=row.get('total_mkt_value')
+        ) for row in rows]
+        yielded += len(rows)
+        if len(rows) < size:
+            break
+        last_apn = rows[-1]['apn']
+
+def sync_owners_from_parcels(cities=None, prop_classes=None, min_acres=None, max_acres=None, limit=None,
+                             workers=DEFAULT_AIRTABLE_WORKERS, diff=False, delete=False):
+    """
+    Sync owner data from the Supabase parcels table to Airtable, streamed with no intermediate file
+
+    Args:
+        cities, prop_classes, min_acres, max_acres: Parcel filters (see iter_parcel_owners)
+        limit: Max records to sync (for testing)
+        workers: Upsert requests in flight at once (see airtable_writer.py)
+        diff: Read the Landowners table first and only send new and changed records
+        delete: With diff, also delete landowners whose APN is not in the parcels table
+
+    Returns:
+        The closed AirtableUpsertWriter (created/updated/deleted/failed counts), or None if aborted
+    """
+    from lir_merge import create_supabase_client
+
+    print("=" * 60)
+    print("Landowner Data Sync - Supabase parcels → Airtable")
+    print("=" * 60)
+
+    filtered = cities or prop_classes or min_acres is not None or max_acres is not None
+    if delete and (limit or filtered):
+        print("--delete cannot be combined with --limit or parcel filters "
+              "(it would delete every landowner outside them). Aborting.")
+        return
+
+    owners = iter_parcel_owners(create_supabase_client(), cities, prop_classes, min_acres, max_acres, limit)
+    return write_owners(owners, OWNER_FIELDS + ["Property Address", "Property Value"], workers=workers, diff=diff,
+                        delete=delete)
+
+def write_owners(batches, synced_fields, workers=DEFAULT_AIRTABLE_WORKERS, diff=False, delete=False, skipped=None):
+    """
+    Write landowner records to Airtable as they arrive, 10 per request
 
-        # Rate limiting - Airtable allows 5 requests/second
-        time.sleep(0.21)
+    Args:
+        batches: Iterable of lists of Airtable fields dicts, consumed lazily
+            (the first record for an APN wins, later repeats are ignored)
+        synced_fields: Field names this sync owns (compared in diff mode)
+        workers: Upsert requests in flight at once
+        diff: Read the Landowners table first and only send new and changed records
+        delete: With diff, also delete landowners whose APN was not in records
+            (and duplicate records for one APN)
+        skipped: {'count': n} the source fills in with the rows it dropped (no APN or
+            owner name), for the summary
+
+    Returns:
+        The closed AirtableUpsertWriter (created/updated/deleted/failed counts), or None if aborted
+    """
+    if delete and not diff:
+        print("--delete needs --diff. Aborting.")
+        return
+
+    url = f"{AIRTABLE_API_URL}/{AIRTABLE_BASE}/{LANDOWNERS_TABLE}"
+
+    # Diff: compare against what the table already holds
+    index, duplicates = {}, []
+    if diff:
+        with recorder.time('index') as timer:
+            index, duplicates = load_record_index(url, AIRTABLE_TOKEN, 'APN', synced_fields)
+            timer.add(items=len(index) + len(duplicates))
+        print(f"Indexed {len(index)} existing landowners ({len(duplicates)} duplicate records)")
+        if duplicates and not delete:
+            print("  Re-run with --diff --delete to remove the duplicates")
+
+    seen = set()
+    unchanged_count = 0
+    with tqdm(desc="Syncing to Airtable") as pbar, recorder.time('upload') as timer:
+        writer = AirtableUpsertWriter(url, AIRTABLE_TOKEN, merge_on=['APN'], workers=workers, progress=pbar.update)
+        try:
+            for batch in batches:
+                for fields in batch:
+                    apn = fields["APN"]
+                    if apn in seen:
+                        continue
+                    seen.add(apn)
+
+                    existing = index.get(apn)
+                    if not diff or existing is None:
+                        writer.add(fields)
+                    elif existing[1] != fields_fingerprint(fields, synced_fields):
+                        # Synced fields missing from this row are cleared
+                        writer.update(existing[0], {name: fields.get(name) for name in synced_fields})
+                    else:
+                        unchanged_count += 1
+
+            if delete:
+                for apn, (record_id, _) in index.items():
+                    if apn not in seen:
+                        writer.delete(record_id)
+                for record_id in duplicates:
+                    writer.delete(record_id)
+        finally:
+            writer.close()
+        timer.add(items=writer.created + writer.updated + writer.deleted + writer.failed)
 
     print("\n" + "=" * 60)
     print("Sync Complete!")
-    print(f"  Successfully synced: {success_count}")
-    print(f"  Failed: {failed_count}")
+    print(f"  Created: {writer.created}")
+    print(f"  Updated: {writer.updated}")
+    if diff:
+        print(f"  Unchanged (skipped): {unchanged_count}")
+        print(f"  Deleted: {writer.deleted}")
+    print(f"  Failed: {writer.failed}")
+    if skipped is not None:
+        print(f"  Skipped (no APN or owner name): {skipped['count']}")
     print("=" * 60)
+    return writer
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description='Sync landowner data to Airtable')
-    parser.add_argument('file', help='Path to owner data CSV/Excel file')
+    parser.add_argument('file', nargs='?', help='Path to owner data CSV/Excel file')
     parser.add_argument('--limit', type=int, help='Limit number of records (for testing)')
+    parser.add_argument('--from-parcels', action='store_true',
+                        help='Stream owners from the Supabase parcels table instead of a file')
+    parser.add_argument('--city', action='append', help='With --from-parcels: only this city (repeatable)')
+    parser.add_argument('--prop-class', action='append',
+                        help='With --from-parcels: only this property class, e.g. Vacant (repeatable)')
+    parser.add_argument('--min-acres', type=float, help='With --from-parcels: minimum parcel_acres')
+    parser.add_argument('--max-acres', type=float, help='With --from-parcels: maximum parcel_acres')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_OWNER_CHUNK_SIZE,
+                        help=f'Owner file rows read per chunk (default: {DEFAULT_OWNER_CHUNK_SIZE})')
+    add_airtable_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
-
-    # Adjust column names based on your actual file
-    # Run with --limit 10 first to test!
-    sync_owners_to_airtable(
-        owner_file_path=args.file,
-        limit=args.limit
-    )
+    if bool(args.file) == args.from_parcels:
+        parser.error('give either an owner file or --from-parcels')
+    metrics_from_args('sync_owners_to_airtable', args)
+
+    if args.from_parcels:
+        sync_owners_from_parcels(
+            cities=args.city,
+            prop_classes=args.prop_class,
+            min_acres=args.min_acres,
+            max_acres=args.max_acres,
+            limit=args.limit,
+            workers=args.airtable_workers,
+            diff=args.diff,
+            delete=args.delete
+        )
+    else:
+        # Adjust column names based on your actual file
+        # Run with --limit 10 first to test!
+        sync_owners_to_airtable(
+            owner_file_path=args.file,
+            limit=args.limit,
+            workers=args.airtable_workers,
+            diff=args.diff,
+            delete=args.delete,
+            chunk_size=args.chunk_size
+        )
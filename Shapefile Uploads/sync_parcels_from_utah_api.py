@@ -3,13 +3,23 @@ Sync Davis County Parcels from Utah AGRC API to Supabase
 Fetches latest parcel data from Utah's official ArcGIS REST API
 """
 
-import requests
 import json
 import os
+from functools import partial
 from dotenv import load_dotenv
 from supabase import create_client
 from tqdm import tqdm
-import time
+from adaptive_batch import AdaptiveBatcher, add_batch_arguments
+from arcgis_fetch import ArcGISLayer, DEFAULT_BATCH_SIZE, add_fetch_arguments, layer_from_args
+from checkpoint import Checkpoint, add_checkpoint_arguments
+from geometry_encoding import add_geometry_arguments, encode_geojson
+from pipeline import DEFAULT_TRANSFORM_WORKERS, DEFAULT_UPLOAD_WORKERS, add_pipeline_arguments, run_pipeline
+from metrics import add_metrics_arguments, metrics_from_args, recorder
+from parcels_refresh import (SHADOW_TABLE, add_refresh_arguments, begin_refresh, check_refresh_arguments,
+                             finish_refresh, refresh_min_rows)
+from sync_state import (SyncState, TileChangeLog, add_delta_arguments, add_tile_change_arguments, edited_since_where,
+                        geometry_bounds)
+from rate_limit import execute
 
 # Load environment variables
 load_dotenv('../.env')
@@ -31,57 +41,23 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 # Davis County GIS Portal API - has owner information!
 DAVIS_PARCELS_URL = "https://gisportal-pro.daviscountyutah.gov/server/rest/services/Operational/Parcels/MapServer/0"
 
-def get_parcel_count():
-    """Get total count of parcels in the API"""
-    url = f"{DAVIS_PARCELS_URL}/query"
-    params = {
-        'where': '1=1',
-        'returnCountOnly': 'true',
-        'f': 'json'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    return data.get('count', 0)
+# Query parameters - request all fields and geometry
+PARCEL_QUERY = {
+    'where': '1=1',
+    'outFields': '*',
+    'returnGeometry': 'true',
+    'outSR': '4326',  # WGS84
+    'f': 'geojson'
+}
 
-def fetch_parcels_batch(offset=0, batch_size=1000):
-    """
-    Fetch a batch of parcels from Utah API
-
-    Args:
-        offset: Starting record number
-        batch_size: Number of records to fetch
-
-    Returns:
-        List of parcel features
-    """
-    url = f"{DAVIS_PARCELS_URL}/query"
-
-    # Query parameters - request all fields and geometry
-    params = {
-        'where': '1=1',
-        'outFields': '*',
-        'returnGeometry': 'true',
-        'outSR': '4326',  # WGS84
-        'f': 'geojson',
-        'resultOffset': offset,
-        'resultRecordCount': batch_size
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('features', [])
-    except Exception as e:
-        print(f"Error fetching batch at offset {offset}: {e}")
-        return []
-
-def transform_parcel_to_supabase(feature):
+def transform_parcel_to_supabase(feature, geometry_format='geojson', precision=None):
     """
     Transform ArcGIS feature to Supabase parcel record
 
     Args:
         feature: GeoJSON feature from Utah API
+        geometry_format: How geom is encoded, 'geojson', 'ewkt' or 'ewkb' (see geometry_encoding.py)
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
 
     Returns:
         Dictionary ready for Supabase insert
@@ -125,7 +101,7 @@ def transform_parcel_to_supabase(feature):
         'size_acres': float(props.get('ParcelAcreage') or 0) if props.get('ParcelAcreage') else None,
         'recorder_phone': '1-801-451-3225',
         'property_url': 'https://webportal.daviscountyutah.gov/App/PropertySearch/esri/map',
-        'geom': geom
+        'geom': encode_geojson(geom, geometry_format, precision)
     }
 
     return record
@@ -142,15 +118,27 @@ def clear_existing_parcels():
         print(f"✗ Error clearing parcels: {e}")
         return False
 
-def upload_batch(records):
-    """Upload a batch of records to Supabase - much faster than one at a time!"""
+def upsert_records(records, table='parcels'):
+    """Upsert records in one request; raises on failure"""
+    # Use UPSERT to handle duplicates gracefully (update if exists, insert if not)
+    execute(supabase.table(table).upsert(records, on_conflict='apn'))
+    return len(records)
+
+def upload_batch(records, batcher=None, table='parcels'):
+    """
+    Upload a batch of records to Supabase - much faster than one at a time!
+
+    With a batcher, the records are upserted in adaptively sized requests,
+    halved and retried on statement timeouts and payload-limit errors.
+    table is parcels_shadow during a --refresh.
+    """
     if not records:
         return 0
 
     try:
-        # Use UPSERT to handle duplicates gracefully (update if exists, insert if not)
-        supabase.table('parcels').upsert(records, on_conflict='apn').execute()
-        return len(records)
+        if batcher is not None:
+            return batcher.write(records, partial(upsert_records, table=table))
+        return upsert_records(records, table)
     except Exception as e:
         error_msg = str(e).lower()
 
@@ -168,83 +156,204 @@ def upload_batch(records):
         success_count = 0
         for record in records:
             try:
-                supabase.table('parcels').upsert(record, on_conflict='apn').execute()
+                execute(supabase.table(table).upsert(record, on_conflict='apn'))
                 success_count += 1
             except Exception as e2:
                 print(f"Error upserting parcel {record.get('apn')}: {e2}")
         return success_count
 
-def sync_parcels(limit=None, clear_first=False):
+def sync_parcels(limit=None, clear_first=False, layer=None, state_file=None,
+                 transform_workers=DEFAULT_TRANSFORM_WORKERS, upload_workers=DEFAULT_UPLOAD_WORKERS,
+                 checkpoint_file=None, resume=False, batcher=None, refresh=False,
+                 geometry_format='geojson', precision=None, tile_changes_file=None):
     """
     Sync parcels from Utah API to Supabase
 
     Args:
         limit: Maximum number of parcels to sync (None for all)
         clear_first: Whether to clear existing data before syncing
+        layer: ArcGISLayer to fetch from (defaults to the standard fetch settings)
+        state_file: Delta sync state file; when set, only features edited since
+            the last sync are fetched and only changed rows are uploaded
+        transform_workers: Threads transforming fetched pages
+        upload_workers: Threads upserting batches into Supabase
+        checkpoint_file: Where committed pages are recorded after every batch (None disables checkpoints)
+        resume: Skip the pages committed by an interrupted run with the same options
+        batcher: AdaptiveBatcher splitting each page into upsert requests (None upserts whole pages)
+        refresh: Load into the shadow table and swap it in at the end (see parcels_refresh.py)
+        geometry_format: Geometry encoding sent to Supabase, 'geojson', 'ewkt' or 'ewkb'
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
+        tile_changes_file: Log the bounding boxes of the parcels written here, for
+            build_tiles.py --update (in delta mode, also where moved parcels were before)
     """
     print("=" * 60)
     print("Davis County Parcel Sync - Utah AGRC API to Supabase")
     print("=" * 60)
 
+    layer = layer or ArcGISLayer(DAVIS_PARCELS_URL)
+    query = PARCEL_QUERY
+    state = None
+    edit_field = None
+
+    if refresh and clear_first:
+        print("--refresh replaces --clear, use one or the other. Aborting.")
+        return
+    if refresh and limit:
+        print("--refresh replaces the whole table and cannot be combined with --limit. Aborting.")
+        return
+
+    if state_file:
+        if clear_first or refresh:
+            print("--clear/--refresh cannot be combined with --delta (a delta run only writes changed rows). Aborting.")
+            return
+
+        state = SyncState.load(state_file)
+        previous_watermark = state.watermark
+        edit_field = layer.edit_date_field()
+        if edit_field and state.watermark:
+            query = dict(PARCEL_QUERY, where=edited_since_where(edit_field, state.watermark))
+            print(f"Delta sync: fetching parcels edited since watermark ({query['where']})")
+        elif not edit_field:
+            print("Delta sync: service has no edit date field, fetching all and uploading changed rows only")
+        else:
+            print("Delta sync: no watermark yet, fetching all parcels to build the state file")
+
     # Get total count
-    total_count = get_parcel_count()
+    total_count = layer.count(query['where'])
+    available_count = total_count
     print(f"Total parcels available in Utah API: {total_count:,}")
 
     if limit:
         print(f"Limiting sync to first {limit:,} parcels")
         total_count = min(total_count, limit)
 
-    # Clear existing data if requested
-    if clear_first:
+    checkpoint = None
+    if checkpoint_file:
+        signature = {'where': query['where'], 'paging': layer.paging, 'batch_size': DEFAULT_BATCH_SIZE, 'limit': limit,
+                     'refresh': refresh}
+        checkpoint = Checkpoint.open(checkpoint_file, signature, resume)
+
+    # Clear existing data if requested (not when resuming, that would throw away the committed pages)
+    if clear_first and checkpoint is not None and checkpoint.resumed:
+        print("Resuming: not clearing the parcels already committed by the interrupted run")
+    elif clear_first:
         if not clear_existing_parcels():
             print("Failed to clear existing data. Aborting.")
             return
 
-    # Fetch and upload in batches
-    batch_size = 1000
-    offset = 0
+    # Refresh: load into the shadow table (a resumed refresh keeps loading the same shadow)
+    table = 'parcels'
+    if refresh:
+        table = SHADOW_TABLE
+        if checkpoint is not None and checkpoint.resumed:
+            print(f"Resuming: continuing to load the existing {SHADOW_TABLE}")
+        else:
+            begin_refresh(supabase)
+
+    tile_changes = None
+    if tile_changes_file and (clear_first or refresh):
+        print("Tile changes: not logged for a full reload, rebuild the tiles in full with build_tiles.py")
+    elif tile_changes_file:
+        tile_changes = TileChangeLog(tile_changes_file, 'sync_parcels_from_utah_api')
+
+    def transform_page(page):
+        """Transform stage: features -> deduplicated (and, in delta mode, changed-only) records"""
+        offset, features = page
+        records = []
+        seen_apns = set()
+        bounds = {}
+        for feature in features:
+            try:
+                record = transform_parcel_to_supabase(feature, geometry_format, precision)
+                apn = record.get('apn')
+                # Only include if has APN and not a duplicate within this batch
+                if apn and apn not in seen_apns:
+                    records.append(record)
+                    seen_apns.add(apn)
+                    if tile_changes is not None:
+                        bounds[apn] = geometry_bounds(feature.get('geometry'))
+            except Exception as e:
+                print(f"\nError transforming feature: {e}")
+
+        # Delta mode: skip rows whose content hash matches the last sync
+        if state is not None:
+            changed = state.changed(records)
+            if tile_changes is not None:
+                bounds = {record['apn']: bounds[record['apn']] for record in changed}
+            return changed, len(records) - len(changed), bounds
+        return records, 0, bounds
+
+    def upload_stage(batch):
+        records = batch[0]
+        return upload_batch(records, batcher, table)
+
+    # Fetch, transform and upload run as overlapping stages joined by bounded queues
+    total_processed = 0
     total_uploaded = 0
+    total_unchanged = 0
+
+    pages = layer.iter_pages(query, total_count, DEFAULT_BATCH_SIZE,
+                             skip=checkpoint.is_done if checkpoint is not None else None)
+    failed_batches = 0
 
     with tqdm(total=total_count, desc="Syncing parcels") as pbar:
-        while offset < total_count:
-            # Fetch batch
-            features = fetch_parcels_batch(offset, batch_size)
-
-            if not features:
-                print(f"\nNo more features returned at offset {offset}")
-                break
-
-            # Transform to Supabase format
-            records = []
-            seen_apns = set()
-            for feature in features:
-                try:
-                    record = transform_parcel_to_supabase(feature)
-                    apn = record.get('apn')
-                    # Only include if has APN and not a duplicate within this batch
-                    if apn and apn not in seen_apns:
-                        records.append(record)
-                        seen_apns.add(apn)
-                    elif apn and apn in seen_apns:
-                        # Skip duplicate within batch
-                        pass
-                except Exception as e:
-                    print(f"\nError transforming feature: {e}")
-
-            # Upload batch
-            uploaded = upload_batch(records)
+        for (offset, features), (records, unchanged, bounds), uploaded in run_pipeline(
+                pages, transform_page, upload_stage,
+                transform_workers=transform_workers, upload_workers=upload_workers):
             total_uploaded += uploaded
+            total_unchanged += unchanged
+            recorder.count('fetch', items=len(features))
+            recorder.count('transform', items=len(features))
+            recorder.count('upload', items=uploaded)
+
+            if uploaded < len(records):
+                failed_batches += 1
+            if checkpoint is not None:
+                checkpoint.record(layer.page_params[offset], done=uploaded == len(records),
+                                  records=len(features), written=uploaded, unchanged=unchanged)
+
+            if tile_changes is not None and uploaded:
+                # Old boxes of parcels that moved, so the tiles they left are rebuilt too
+                previous = state.swap_bounds(bounds) if state is not None and uploaded == len(records) else []
+                tile_changes.record(list(bounds.values()) + previous)
+
+            if state is not None:
+                if uploaded == len(records):
+                    state.mark_synced(records)
+                if edit_field:
+                    state.advance_watermark(f.get('properties', {}).get(edit_field) for f in features)
 
             pbar.update(len(features))
-            offset += batch_size
+            total_processed += len(features)
+
+    layer.report()
+    if batcher is not None:
+        print(batcher.summary())
+
+    complete = not layer.failed_pages and not failed_batches
+    if refresh and not complete:
+        print(f"\nRefresh: not swapping {SHADOW_TABLE} in, it is missing failed pages; re-run with --refresh --resume")
+    elif refresh:
+        complete = finish_refresh(supabase, refresh_min_rows(available_count)) is not None
+
+    if checkpoint is not None:
+        checkpoint.finish(complete=complete)
 
-            # Rate limiting - be nice to the API
-            time.sleep(0.5)
+    if state is not None:
+        # Only move the watermark forward when every edited feature was fetched and written;
+        # rows of a failed batch would otherwise fall behind it and never be queried again
+        if layer.failed_pages or failed_batches or total_count < available_count:
+            state.watermark = previous_watermark
+        state.save()
 
     print("\n" + "=" * 60)
     print(f"Sync complete!")
-    print(f"  Total processed: {offset:,}")
+    print(f"  Total processed: {total_processed:,}")
     print(f"  Successfully uploaded: {total_uploaded:,}")
+    if state is not None:
+        print(f"  Unchanged (skipped): {total_unchanged:,}")
+    if tile_changes is not None:
+        print(f"  Changed areas logged for tile updates: {tile_changes.count:,} ({tile_changes_file})")
     print("=" * 60)
 
 if __name__ == "__main__":
@@ -253,8 +362,34 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Sync Davis County parcels from Utah API to Supabase')
     parser.add_argument('--limit', type=int, help='Limit number of parcels to sync (for testing)')
     parser.add_argument('--clear', action='store_true', help='Clear existing parcels before syncing')
+    add_refresh_arguments(parser)
+    add_fetch_arguments(parser)
+    add_delta_arguments(parser, 'davis_parcels.json')
+    add_pipeline_arguments(parser)
+    add_metrics_arguments(parser)
+    add_checkpoint_arguments(parser, 'davis_parcels.checkpoint.json')
+    add_batch_arguments(parser)
+    add_geometry_arguments(parser, 'geojson')
+    add_tile_change_arguments(parser)
 
     args = parser.parse_args()
+    check_refresh_arguments(parser, args)
+    metrics_from_args('sync_parcels_from_utah_api', args)
 
     # Run sync
-    sync_parcels(limit=args.limit, clear_first=args.clear)
+    sync_parcels(
+        limit=args.limit,
+        clear_first=args.clear,
+        layer=layer_from_args(DAVIS_PARCELS_URL, args),
+        state_file=args.state_file if args.delta else None,
+        transform_workers=args.transform_workers,
+        upload_workers=args.upload_workers,
+        checkpoint_file=args.checkpoint_file,
+        resume=args.resume,
+        batcher=AdaptiveBatcher(DEFAULT_BATCH_SIZE, minimum=args.min_batch_size,
+                                target_seconds=args.target_batch_seconds),
+        refresh=args.refresh,
+        geometry_format=args.geometry_format,
+        precision=args.precision,
+        tile_changes_file=args.tile_changes_file if args.tile_changes else None
+    )
@@ -4,13 +4,17 @@ Fetches latest parcel data with Land Information Records (LIR)
 including property classification, building details, and market values
 """
 
-import requests
 import json
 import os
 from dotenv import load_dotenv
 from supabase import create_client
 from tqdm import tqdm
-import time
+from arcgis_fetch import ArcGISLayer, DEFAULT_BATCH_SIZE, add_fetch_arguments, layer_from_args
+from columnar import ColumnBatch, add_columnar_arguments
+from geometry_encoding import add_geometry_arguments, encode_geojson
+from parcels_refresh import (SHADOW_TABLE, add_refresh_arguments, begin_refresh, check_refresh_arguments,
+                             finish_refresh, refresh_min_rows)
+from rate_limit import execute
 
 # Load environment variables
 load_dotenv('../.env')
@@ -34,50 +38,42 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 # Using LIR (Land Information Records) which includes property classification and building data
 DAVIS_PARCELS_LIR_URL = "https://services1.arcgis.com/99lidPhWCzftIe9K/ArcGIS/rest/services/Parcels_Davis_LIR/FeatureServer/0"
 
-def get_parcel_count():
-    """Get total count of parcels in the LIR API"""
-    url = f"{DAVIS_PARCELS_LIR_URL}/query"
-    params = {
-        'where': '1=1',
-        'returnCountOnly': 'true',
-        'f': 'json'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    return data.get('count', 0)
-
-def fetch_parcels_batch(offset=0, batch_size=1000):
-    """
-    Fetch a batch of parcels from Utah LIR API
-
-    Args:
-        offset: Starting record number
-        batch_size: Number of records to fetch
-
-    Returns:
-        List of parcel features
-    """
-    url = f"{DAVIS_PARCELS_LIR_URL}/query"
-
-    # Query parameters - request all fields and geometry
-    params = {
-        'where': '1=1',
-        'outFields': '*',
-        'returnGeometry': 'true',
-        'outSR': '4326',  # WGS84
-        'f': 'geojson',
-        'resultOffset': offset,
-        'resultRecordCount': batch_size
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('features', [])
-    except Exception as e:
-        print(f"Error fetching batch at offset {offset}: {e}")
-        return []
+# Query parameters - request all fields and geometry
+PARCEL_QUERY = {
+    'where': '1=1',
+    'outFields': '*',
+    'returnGeometry': 'true',
+    'outSR': '4326',  # WGS84
+    'f': 'geojson'
+}
+
+DEFAULT_PROPERTY_URL = 'https://webportal.daviscountyutah.gov/App/PropertySearch/esri/map'
+
+# LIR attributes as typed columns for --columnar: (column, attribute(s), kind), see columnar.py
+PARCEL_COLUMNS = [
+    ('apn', ('PARCEL_ID', 'PARCELID', 'APN'), 'text'),
+    ('address', 'PARCEL_ADD', 'text'),
+    ('city', 'PARCEL_CITY', 'text'),
+    ('zip_code', 'PARCEL_ZIP', 'text'),
+    ('owner_type', 'OWN_TYPE', 'text'),
+    ('prop_class', 'PROP_CLASS', 'text'),
+    ('taxexempt_type', 'TAXEXEMPT_TYPE', 'text'),
+    ('primary_res', 'PRIMARY_RES', 'text'),
+    ('bldg_sqft', 'BLDG_SQFT', 'float8'),
+    ('bldg_sqft_info', 'BLDG_SQFT_INFO', 'text'),
+    ('floors_cnt', 'FLOORS_CNT', 'float8'),
+    ('floors_info', 'FLOORS_INFO', 'text'),
+    ('built_yr', 'BUILT_YR', 'int4'),
+    ('effbuilt_yr', 'EFFBUILT_YR', 'int4'),
+    ('const_material', 'CONST_MATERIAL', 'text'),
+    ('total_mkt_value', 'TOTAL_MKT_VALUE', 'float8'),
+    ('land_mkt_value', 'LAND_MKT_VALUE', 'float8'),
+    ('parcel_acres', 'PARCEL_ACRES', 'float8'),
+    ('house_cnt', 'HOUSE_CNT', 'text'),
+    ('subdiv_name', 'SUBDIV_NAME', 'text'),
+    ('tax_dist', 'TAX_DIST', 'text'),
+    ('property_url', 'CoParcel_URL', 'text'),
+]
 
 def safe_float(value):
     """Safely convert value to float, handling None and empty strings"""
@@ -103,25 +99,29 @@ def safe_str(value):
         return None
     return str(value)
 
-def transform_parcel_to_supabase(feature):
+def to_multipolygon(geom):
+    """Convert Polygon to MultiPolygon if needed (Supabase table expects MultiPolygon)"""
+    if geom and geom.get('type') == 'Polygon':
+        return {
+            'type': 'MultiPolygon',
+            'coordinates': [geom['coordinates']]
+        }
+    return geom
+
+def transform_parcel_to_supabase(feature, geometry_format='geojson', precision=None):
     """
     Transform ArcGIS LIR feature to Supabase parcel record
 
     Args:
         feature: GeoJSON feature from Utah LIR API
+        geometry_format: How geom is encoded, 'geojson', 'ewkt' or 'ewkb' (see geometry_encoding.py)
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
 
     Returns:
         Dictionary ready for Supabase insert
     """
     props = feature.get('properties', {})
-    geom = feature.get('geometry')
-
-    # Convert Polygon to MultiPolygon if needed (Supabase table expects MultiPolygon)
-    if geom and geom.get('type') == 'Polygon':
-        geom = {
-            'type': 'MultiPolygon',
-            'coordinates': [geom['coordinates']]
-        }
+    geom = to_multipolygon(feature.get('geometry'))
 
     # Extract basic parcel fields
     parcel_id = props.get('PARCEL_ID') or props.get('PARCELID') or props.get('APN')
@@ -170,14 +170,29 @@ def transform_parcel_to_supabase(feature):
 
         # URLs and contact
         'recorder_phone': '1-801-451-3225',  # Davis County Recorder
-        'property_url': safe_str(props.get('CoParcel_URL')) or 'https://webportal.daviscountyutah.gov/App/PropertySearch/esri/map',
+        'property_url': safe_str(props.get('CoParcel_URL')) or DEFAULT_PROPERTY_URL,
 
         # Geometry
-        'geom': geom  # GeoJSON geometry
+        'geom': encode_geojson(geom, geometry_format, precision)  # GeoJSON, EWKT or hex-EWKB
     }
 
     return record
 
+def transform_page_columns(features, geometry_format='geojson', precision=None):
+    """
+    Transform a page of features through typed columns (--columnar)
+
+    Produces the same records as transform_parcel_to_supabase, without the
+    per-field safe_* calls, skipping features without an APN.
+    """
+    batch = ColumnBatch.from_rows([feature.get('properties', {}) for feature in features], PARCEL_COLUMNS)
+    batch.add_column('county', 'Davis', 'text')
+    batch.add_column('recorder_phone', '1-801-451-3225', 'text')  # Davis County Recorder
+    batch.fill('property_url', DEFAULT_PROPERTY_URL)
+    batch.add_column('geom', [encode_geojson(to_multipolygon(feature.get('geometry')), geometry_format, precision)
+                              for feature in features])
+    return batch.take(batch.present('apn')).to_records()
+
 def clear_existing_parcels():
     """
     Clear all existing parcels from Supabase
@@ -208,30 +223,44 @@ def clear_existing_parcels():
         print("  2. Manually truncate in Supabase SQL Editor: TRUNCATE TABLE parcels CASCADE;")
         return False
 
-def upload_batch(records):
-    """Upload a batch of records to Supabase"""
+def upload_batch(records, table='parcels'):
+    """
+    Upload a batch of records to Supabase (table is parcels_shadow during a --refresh)
+
+    Returns:
+        (rows inserted, rows that failed); duplicate APNs are skipped on purpose
+        and count as neither
+    """
     if not records:
-        return 0
+        return 0, 0
 
     success_count = 0
+    error_count = 0
     for record in records:
         try:
-            supabase.table('parcels').insert(record).execute()
+            execute(supabase.table(table).insert(record))
             success_count += 1
         except Exception as e:
-            # Skip duplicates or errors
+            # Skip duplicates, report real errors
             if 'duplicate key' not in str(e).lower():
+                error_count += 1
                 print(f"Error inserting parcel {record.get('apn')}: {e}")
 
-    return success_count
+    return success_count, error_count
 
-def sync_parcels(limit=None, clear_first=False):
+def sync_parcels(limit=None, clear_first=False, layer=None, columnar=False, refresh=False,
+                 geometry_format='geojson', precision=None):
     """
     Sync parcels from Utah LIR API to Supabase
 
     Args:
         limit: Maximum number of parcels to sync (None for all)
         clear_first: Whether to clear existing data before syncing
+        layer: ArcGISLayer to fetch from (defaults to the standard fetch settings)
+        columnar: Transform pages through typed columns instead of per-record dicts
+        refresh: Load into the shadow table and swap it in at the end (see parcels_refresh.py)
+        geometry_format: Geometry encoding sent to Supabase, 'geojson', 'ewkt' or 'ewkb'
+        precision: Snap coordinates to this many decimal places (None keeps full precision)
     """
     print("=" * 60)
     print("Davis County Parcel Sync - Utah AGRC LIR API to Supabase")
@@ -246,8 +275,11 @@ def sync_parcels(limit=None, clear_first=False):
         print("  Add SUPABASE_SERVICE_KEY or VITE_SUPABASE_SERVICE_ROLE_KEY to .env for full access")
     print()
 
+    layer = layer or ArcGISLayer(DAVIS_PARCELS_LIR_URL)
+
     # Get total count
-    total_count = get_parcel_count()
+    total_count = layer.count()
+    available_count = total_count
     print(f"Total parcels available in Utah LIR API: {total_count:,}")
 
     if limit:
@@ -255,49 +287,70 @@ def sync_parcels(limit=None, clear_first=False):
         total_count = min(total_count, limit)
 
     # Clear existing data if requested
+    if clear_first and refresh:
+        print("--refresh replaces --clear, use one or the other. Aborting.")
+        return
+    if refresh and limit:
+        print("--refresh replaces the whole table and cannot be combined with --limit. Aborting.")
+        return
     if clear_first:
         if not clear_existing_parcels():
             print("Failed to clear existing data. Aborting.")
             return
 
-    # Fetch and upload in batches
-    batch_size = 1000
-    offset = 0
+    # Refresh: load into the shadow table, parcels keeps serving until the swap
+    table = 'parcels'
+    if refresh:
+        table = SHADOW_TABLE
+        begin_refresh(supabase)
+
+    # Fetch (several pages in flight) and upload in batches
+    total_processed = 0
     total_uploaded = 0
+    failed_batches = 0
 
     with tqdm(total=total_count, desc="Syncing parcels") as pbar:
-        while offset < total_count:
-            # Fetch batch
-            features = fetch_parcels_batch(offset, batch_size)
-
+        for offset, features in layer.iter_pages(PARCEL_QUERY, total_count, DEFAULT_BATCH_SIZE):
             if not features:
-                print(f"\nNo more features returned at offset {offset}")
-                break
+                continue  # Empty range (e.g. IDs deleted since the ID list was pulled)
 
             # Transform to Supabase format
-            records = []
-            for feature in features:
-                try:
-                    record = transform_parcel_to_supabase(feature)
-                    if record.get('apn'):  # Only include if has APN
-                        records.append(record)
-                except Exception as e:
-                    print(f"\nError transforming feature: {e}")
+            if columnar:
+                records = transform_page_columns(features, geometry_format, precision)
+            else:
+                records = []
+                for feature in features:
+                    try:
+                        record = transform_parcel_to_supabase(feature, geometry_format, precision)
+                        if record.get('apn'):  # Only include if has APN
+                            records.append(record)
+                    except Exception as e:
+                        print(f"\nError transforming feature: {e}")
 
             # Upload batch
-            uploaded = upload_batch(records)
+            uploaded, errors = upload_batch(records, table)
             total_uploaded += uploaded
+            if errors:
+                failed_batches += 1
 
             pbar.update(len(features))
-            offset += batch_size
+            total_processed += len(features)
+
+    layer.report()
 
-            # Rate limiting - be nice to the API
-            time.sleep(0.5)
+    if refresh and (layer.failed_pages or failed_batches):
+        print(f"\nRefresh: not swapping {SHADOW_TABLE} in, it is missing failed pages or rows "
+              f"({failed_batches:,} batch(es) with insert errors)")
+        print("  Re-run with --refresh, or discard it in the SQL editor with SELECT abort_parcels_refresh();")
+    elif refresh:
+        finish_refresh(supabase, refresh_min_rows(available_count))
 
     print("\n" + "=" * 60)
     print(f"Sync complete!")
-    print(f"  Total processed: {offset:,}")
+    print(f"  Total processed: {total_processed:,}")
     print(f"  Successfully uploaded: {total_uploaded:,}")
+    if failed_batches:
+        print(f"  Batches with insert errors: {failed_batches:,}")
     print("=" * 60)
     print("\nNew LIR fields now available:")
     print("  - prop_class: Vacant, Residential, Commercial, etc.")
@@ -312,6 +365,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sync Davis County parcels from Utah LIR API')
     parser.add_argument('--limit', type=int, help='Limit number of parcels to sync')
     parser.add_argument('--clear', action='store_true', help='Clear existing parcels before sync')
+    add_fetch_arguments(parser)
+    add_columnar_arguments(parser)
+    add_refresh_arguments(parser)
+    add_geometry_arguments(parser, 'geojson')
     args = parser.parse_args()
+    check_refresh_arguments(parser, args)
 
-    sync_parcels(limit=args.limit, clear_first=args.clear)
+    sync_parcels(limit=args.limit, clear_first=args.clear, layer=layer_from_args(DAVIS_PARCELS_LIR_URL, args),
+                 columnar=args.columnar, refresh=args.refresh,
+                 geometry_format=args.geometry_format, precision=args.precision)
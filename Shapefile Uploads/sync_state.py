@@ -0,0 +1,186 @@
+"""
+Local state for incremental (delta) syncs
+Keeps the last edit-date watermark seen on the ArcGIS service and a content
+hash per APN, so a re-run only queries recently edited features and only
+writes rows whose content actually changed. With tile change logging on, it
+also keeps each parcel's last bounding box, so a parcel whose geometry moved
+invalidates the tiles it left as well as the ones it moved into.
+
+TileChangeLog appends what each sync run changed (parcel bounding boxes, or
+APNs and the columns written) to a JSON-lines file that build_tiles.py
+--update reads to rebuild only the affected vector tiles (see
+tile_invalidation.py).
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sync_state')
+DEFAULT_TILE_CHANGES_FILE = os.path.join(DEFAULT_STATE_DIR, 'tile_changes.jsonl')
+
+
+def record_fingerprint(record):
+    """Stable content hash of a record (key order and float formatting independent of dict order)"""
+    payload = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def edited_since_where(edit_field, watermark_ms):
+    """ArcGIS where clause selecting features edited after a watermark (epoch milliseconds, UTC)"""
+    stamp = datetime.fromtimestamp(watermark_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{edit_field} > timestamp '{stamp}'"
+
+
+def geometry_bounds(geometry):
+    """[min_lon, min_lat, max_lon, max_lat] of a GeoJSON geometry, or None if it has no coordinates"""
+    if not geometry:
+        return None
+    xs = []
+    ys = []
+    pending = [geometry.get('coordinates') or []]
+    while pending:
+        item = pending.pop()
+        if item and isinstance(item[0], (int, float)):
+            xs.append(item[0])
+            ys.append(item[1])
+        else:
+            pending.extend(item)
+    if not xs:
+        return None
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+class TileChangeLog:
+    """
+    Appends the parcels a sync run changed to the tile change log (JSON lines)
+
+    One line per committed batch, so an interrupted run still leaves a record
+    of everything it wrote. Lines hold bounding boxes where the sync knows the
+    geometry, otherwise APNs plus the columns written; build_tiles.py --update
+    looks those parcels up and skips column changes that are not in the tiles.
+
+    Args:
+        path: Change log file (created on the first record)
+        source: Name of the script writing, kept on every line
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.count = 0
+
+    def record(self, bounds=(), apns=(), fields=None):
+        """
+        Append one change entry
+
+        Args:
+            bounds: [min_lon, min_lat, max_lon, max_lat] boxes of changed (or moved-from) areas
+            apns: APNs of changed parcels whose location the sync does not know
+            fields: Columns written for those APNs (None: any column may have changed)
+        """
+        bounds = [box for box in bounds if box is not None]
+        apns = [apn for apn in apns if apn]
+        if not bounds and not apns:
+            return
+        entry = {'time': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'source': self.source}
+        if bounds:
+            entry['bounds'] = bounds
+        if apns:
+            entry['apns'] = apns
+            entry['fields'] = fields
+        line = json.dumps(entry, separators=(',', ':'))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+        self.count += len(bounds) + len(apns)
+
+
+class SyncState:
+    """
+    Watermark and per-APN fingerprints for one sync target, stored as JSON
+
+    Args:
+        path: State file location
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.hashes = {}
+        self.bounds = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load a state file, or start empty if it does not exist yet"""
+        state = cls(path)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            state.watermark = data.get('watermark')
+            state.hashes = data.get('hashes', {})
+            state.bounds = data.get('bounds', {})
+        return state
+
+    def save(self):
+        """Write the state file atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        data = {'watermark': self.watermark, 'hashes': self.hashes}
+        if self.bounds:
+            data['bounds'] = self.bounds
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def changed(self, records, key='apn'):
+        """Return only the records whose fingerprint differs from the last successful sync"""
+        return [r for r in records if self.hashes.get(r[key]) != record_fingerprint(r)]
+
+    def mark_synced(self, records, key='apn'):
+        """Remember the fingerprints of records that were written successfully"""
+        for record in records:
+            self.hashes[record[key]] = record_fingerprint(record)
+
+    def swap_bounds(self, bounds):
+        """
+        Remember the bounding box of each key, returning the boxes they replace
+
+        Args:
+            bounds: Dict key -> [min_lon, min_lat, max_lon, max_lat]
+
+        Returns:
+            List of previous boxes that differ from the new ones (where parcels moved from)
+        """
+        previous = []
+        for key, box in bounds.items():
+            if box is None:
+                continue
+            old = self.bounds.get(key)
+            if old is not None and old != box:
+                previous.append(old)
+            self.bounds[key] = box
+        return previous
+
+    def advance_watermark(self, edit_dates):
+        """Move the watermark to the newest edit date seen (epoch milliseconds)"""
+        dates = [d for d in edit_dates if isinstance(d, (int, float))]
+        if dates:
+            self.watermark = max([self.watermark or 0] + dates)
+
+
+def add_delta_arguments(parser, default_state_file):
+    """Add the delta sync options to a script's argparse parser"""
+    parser.add_argument('--delta', action='store_true',
+                        help='Only fetch features edited since the last sync and only write rows that changed')
+    parser.add_argument('--state-file', default=os.path.join(DEFAULT_STATE_DIR, default_state_file),
+                        help='Delta sync state file (watermark + per-APN hashes)')
+
+
+def add_tile_change_arguments(parser):
+    """Add the tile change log options to a script's argparse parser"""
+    parser.add_argument('--tile-changes', action='store_true',
+                        help='Log the parcels this run changes, for build_tiles.py --update')
+    parser.add_argument('--tile-changes-file', default=DEFAULT_TILE_CHANGES_FILE,
+                        help='Tile change log (JSON lines, appended to)')
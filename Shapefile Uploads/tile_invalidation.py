@@ -0,0 +1,243 @@
+"""
+Incremental vector tile updates from the tile change log
+A weekly sync touches a few hundred parcels, so rebuilding the whole tile
+pyramid for it is mostly wasted work. The sync scripts log what they changed
+(sync_state.TileChangeLog); this module turns those entries into the z/x/y
+tiles they affect at every zoom of an existing archive, re-encodes only those
+tiles with the archive's own build options and patches them in
+(pmtiles_archive.patch_archive).
+
+Entries with APNs instead of boxes (LIR merges write attributes, not
+geometry) are looked up in the snapshot or the parcels table, and skipped
+when none of the columns they wrote are in the tiles. A tile is affected when
+a changed box touches it including the tile buffer, the same test the full
+build uses to assign parcels to tiles, so a patched tile is encoded from
+exactly the parcels a full rebuild would give it. Low-zoom tiles cover most
+of the county and are re-encoded in full whenever anything in them changes;
+the saving is in the many high-zoom tiles.
+
+Typical use:
+    changes = ChangeBatch.take(DEFAULT_TILE_CHANGES_FILE)
+    update_tiles('parcels.pmtiles', changes.entries, snapshot='parcels.geojson')
+    changes.done()
+"""
+
+import json
+import os
+
+import numpy as np
+import shapely
+from tqdm import tqdm
+
+from metrics import recorder
+from pmtiles_archive import PMTilesReader, patch_archive, zxy_to_tile_id
+from reproject import WGS84_EPSG, transform_coords
+from vector_tiles import (DEFAULT_TILE_WORKERS, MERCATOR_HALF, WEB_MERCATOR_EPSG, assign_tiles, encode_tiles,
+                          load_database, load_snapshot, tile_size, tile_tasks)
+
+
+class ChangeBatch:
+    """
+    Tile change log entries taken for one update
+
+    take() moves the log aside before reading it, so syncs running meanwhile
+    start a new log; entries taken by an update that then fails stay in the
+    pending file and are read again by the next take().
+
+    Args:
+        path: Tile change log
+        entries: Parsed log entries
+    """
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+
+    @property
+    def pending_path(self):
+        return f"{self.path}.pending"
+
+    @classmethod
+    def take(cls, path):
+        """Move the change log into its pending file and read every entry there"""
+        pending_path = f"{path}.pending"
+        if os.path.exists(path):
+            taken_path = f"{path}.taken"
+            os.replace(path, taken_path)
+            with open(taken_path, 'r', encoding='utf-8') as src, open(pending_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(taken_path)
+
+        entries = []
+        if os.path.exists(pending_path):
+            with open(pending_path, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        return cls(path, entries)
+
+    def done(self):
+        """Drop the taken entries once the archive has been patched"""
+        if os.path.exists(self.pending_path):
+            os.remove(self.pending_path)
+
+
+def changed_areas(entries, attributes):
+    """
+    Split log entries into bounding boxes and APNs still to be located
+
+    Args:
+        entries: Tile change log entries
+        attributes: Columns in the tiles; APN entries that wrote none of them are skipped
+
+    Returns:
+        (list of [min_lon, min_lat, max_lon, max_lat], set of APNs)
+    """
+    boxes = []
+    apns = set()
+    tiled = set(attributes) | {'id', 'geom'}
+    for entry in entries:
+        boxes.extend(entry.get('bounds', ()))
+        fields = entry.get('fields')
+        if fields is None or tiled.intersection(fields):
+            apns.update(entry.get('apns', ()))
+    return boxes, apns
+
+
+def snapshot_bounds(features, apns):
+    """Web Mercator boxes of the snapshot parcels with the given APNs"""
+    if not apns:
+        return np.empty((0, 4))
+    if 'apn' not in features.properties:
+        raise ValueError("The tiles have no apn attribute, so changes logged by APN cannot be located; "
+                         "rebuild the archive in full")
+    selected = np.isin(features.properties['apn'], list(apns))
+    return shapely.bounds(features.geoms[selected])
+
+
+def database_bounds(apns, database_url=None, table='parcels'):
+    """[min_lon, min_lat, max_lon, max_lat] of the parcels with the given APNs, read from the database"""
+    if not apns:
+        return []
+    try:
+        from psycopg import sql
+    except ImportError:
+        raise ImportError('Reading parcels from the database needs psycopg 3: pip install "psycopg[binary]"')
+
+    from pg_copy import connect
+
+    query = sql.SQL(
+        "SELECT ST_XMin(geom), ST_YMin(geom), ST_XMax(geom), ST_YMax(geom) FROM {table} "
+        "WHERE geom IS NOT NULL AND apn = ANY(%s)"
+    ).format(table=sql.Identifier(table))
+    with connect(database_url) as conn, conn.cursor() as cursor:
+        cursor.execute(query, (list(apns),))
+        return [list(row) for row in cursor.fetchall()]
+
+
+def to_mercator(boxes):
+    """(n, 4) Web Mercator array from [min_lon, min_lat, max_lon, max_lat] boxes"""
+    if not len(boxes):
+        return np.empty((0, 4))
+    boxes = np.asarray(boxes, dtype=float)
+    corners = np.concatenate((boxes[:, :2], boxes[:, 2:]))
+    (mercator,) = transform_coords(corners, WGS84_EPSG, (WEB_MERCATOR_EPSG,))
+    return np.column_stack((mercator[:len(boxes)], mercator[len(boxes):]))
+
+
+def affected_tiles(bounds, zooms, buffer, extent):
+    """
+    Tiles whose buffered area touches any of the boxes
+
+    Args:
+        bounds: (n, 4) Web Mercator boxes of changed areas
+
+    Returns:
+        Dict zoom -> list of (x, y), and the set of their tile IDs
+    """
+    by_zoom = {}
+    tile_ids = set()
+    for z in zooms:
+        tiles = [(x, y) for x, y, _ in assign_tiles(bounds, z, buffer, extent)]
+        by_zoom[z] = tiles
+        tile_ids.update(zxy_to_tile_id(z, x, y) for x, y in tiles)
+    return by_zoom, tile_ids
+
+
+def tile_envelopes(tiles, z, buffer, extent):
+    """[min_lon, min_lat, max_lon, max_lat] of zoom-z tiles grown by the tile buffer"""
+    size = tile_size(z)
+    margin = size * buffer / extent
+    corners = []
+    for x, y in tiles:
+        minx = -MERCATOR_HALF + x * size
+        maxy = MERCATOR_HALF - y * size
+        corners.append((minx - margin, maxy - size - margin))
+        corners.append((minx + size + margin, maxy + margin))
+    (lonlat,) = transform_coords(np.asarray(corners, dtype=float), WEB_MERCATOR_EPSG, (WGS84_EPSG,))
+    return np.column_stack((lonlat[0::2], lonlat[1::2])).tolist()
+
+
+def update_tiles(archive, entries, snapshot=None, snapshot_layer=None, database_url=None,
+                 workers=DEFAULT_TILE_WORKERS):
+    """
+    Re-encode the tiles touched by logged changes and patch them into an archive
+
+    The zoom range and encoding options (layer, attributes, buffer, simplify,
+    min area) come from the archive's own metadata, so patched tiles match the
+    ones around them. From the database, only parcels inside the affected
+    lowest-zoom tiles are read; those tiles contain every affected tile above
+    them.
+
+    Args:
+        archive: .pmtiles archive written by build_tiles.py
+        entries: Tile change log entries (ChangeBatch.take)
+        snapshot: Parcel file holding the current parcels; reads the parcels table when None
+        snapshot_layer: Layer to read from a multi-layer snapshot
+        database_url: Postgres connection string (default: SUPABASE_DB_URL from .env)
+        workers: Processes encoding tiles
+
+    Returns:
+        The PMTilesWriter that rewrote the archive (for its summary), or None if no tile was affected
+    """
+    with PMTilesReader(archive) as reader:
+        options = reader.metadata.get('tile_options')
+        zooms = range(reader.header['min_zoom'], reader.header['max_zoom'] + 1)
+    if not options:
+        raise ValueError(f"{archive} has no tile_options metadata (not built by build_tiles.py); "
+                         "rebuild it in full")
+    buffer = options['buffer']
+    extent = options['extent']
+
+    boxes, apns = changed_areas(entries, options['attributes'])
+    features = None
+    if snapshot:
+        features = load_snapshot(snapshot, options['attributes'], snapshot_layer)
+        bounds = np.concatenate((to_mercator(boxes), snapshot_bounds(features, apns)))
+    else:
+        bounds = to_mercator(boxes + database_bounds(apns, database_url))
+    print(f"  {len(boxes)} changed area(s), {len(apns)} parcel(s) logged by APN")
+
+    by_zoom, affected = affected_tiles(bounds, zooms, buffer, extent)
+    if not affected:
+        return None
+    print(f"  {len(affected)} tile(s) affected: "
+          + ', '.join(f"z{z} {len(tiles)}" for z, tiles in by_zoom.items() if tiles))
+
+    if features is None:
+        envelopes = tile_envelopes(by_zoom[zooms[0]], zooms[0], buffer, extent)
+        where = ' OR '.join(['geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)'] * len(envelopes))
+        features = load_database(options['attributes'], database_url, where=where,
+                                 params=[value for envelope in envelopes for value in envelope])
+        print(f"  {len(features)} parcels read around the changes")
+
+    # Affected tiles that come out empty (every parcel moved away) are removed
+    tiles = dict.fromkeys(affected)
+    tasks = tile_tasks(features, zooms, buffer, extent, only=affected)
+    with tqdm(total=len(tasks), desc="Encoding tiles") as pbar, recorder.time('encode') as timer:
+        for tile_id, data in encode_tiles(features, tasks, options, workers):
+            tiles[tile_id] = data
+            if data is not None:
+                timer.add(items=1, nbytes=len(data))
+            pbar.update(1)
+
+    with recorder.time('patch'):
+        return patch_archive(archive, tiles, features.bounds if len(features) else None)
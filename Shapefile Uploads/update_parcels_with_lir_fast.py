@@ -1,346 +1,11 @@
 """
 FAST UPDATE: Existing Davis County parcels with LIR data
-Uses batch SQL updates instead of individual row updates for 100x speedup
+Defaults to one PostgREST upsert per batch (--strategy upsert). For a
+set-based UPDATE over a direct connection use --strategy copy.
+The merge itself lives in lir_merge.py.
 """
 
-import requests
-import os
-from dotenv import load_dotenv
-from supabase import create_client
-from tqdm import tqdm
-import time
-
-# Load environment variables
-load_dotenv('../.env')
-
-SUPABASE_URL = os.getenv("VITE_SUPABASE_URL")
-SUPABASE_KEY = (
-    os.getenv("VITE_SUPABASE_SERVICE_ROLE_KEY") or
-    os.getenv("SUPABASE_SERVICE_KEY") or
-    os.getenv("VITE_SUPABASE_ANON_KEY")
-)
-
-if not SUPABASE_KEY:
-    raise ValueError("Missing Supabase key! Set VITE_SUPABASE_SERVICE_ROLE_KEY in .env")
-
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Utah LIR API endpoint
-DAVIS_PARCELS_LIR_URL = "https://services1.arcgis.com/99lidPhWCzftIe9K/ArcGIS/rest/services/Parcels_Davis_LIR/FeatureServer/0"
-
-def get_lir_parcel_count():
-    """Get total count of parcels in the LIR API"""
-    url = f"{DAVIS_PARCELS_LIR_URL}/query"
-    params = {
-        'where': '1=1',
-        'returnCountOnly': 'true',
-        'f': 'json'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    return data.get('count', 0)
-
-def fetch_lir_batch(offset=0, batch_size=1000):
-    """Fetch a batch of LIR records from Utah API"""
-    url = f"{DAVIS_PARCELS_LIR_URL}/query"
-
-    params = {
-        'where': '1=1',
-        'outFields': '*',
-        'returnGeometry': 'false',
-        'f': 'json',
-        'resultOffset': offset,
-        'resultRecordCount': batch_size
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=60)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('features', [])
-    except Exception as e:
-        print(f"Error fetching LIR batch at offset {offset}: {e}")
-        return []
-
-def safe_float(value):
-    """Safely convert value to float, handling None and empty strings"""
-    if value is None or value == '':
-        return None
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
-
-def safe_int(value):
-    """Safely convert value to int, handling None and empty strings"""
-    if value is None or value == '':
-        return None
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
-
-def safe_str(value):
-    """Safely convert value to string, handling None"""
-    if value is None or value == '':
-        return None
-    return str(value)
-
-def extract_lir_fields(feature):
-    """Extract LIR-specific fields from ArcGIS feature"""
-    attrs = feature.get('attributes', {})
-
-    # Extract APN
-    apn = (
-        attrs.get('PARCEL_ID') or
-        attrs.get('PARCELID') or
-        attrs.get('APN')
-    )
-
-    if not apn:
-        return None
-
-    return {
-        'apn': safe_str(apn),
-        'prop_class': safe_str(attrs.get('PROP_CLASS')),
-        'taxexempt_type': safe_str(attrs.get('TAXEXEMPT_TYPE')),
-        'primary_res': safe_str(attrs.get('PRIMARY_RES')),
-        'bldg_sqft': safe_float(attrs.get('BLDG_SQFT')),
-        'bldg_sqft_info': safe_str(attrs.get('BLDG_SQFT_INFO')),
-        'floors_cnt': safe_float(attrs.get('FLOORS_CNT')),
-        'floors_info': safe_str(attrs.get('FLOORS_INFO')),
-        'built_yr': safe_int(attrs.get('BUILT_YR')),
-        'effbuilt_yr': safe_int(attrs.get('EFFBUILT_YR')),
-        'const_material': safe_str(attrs.get('CONST_MATERIAL')),
-        'total_mkt_value': safe_float(attrs.get('TOTAL_MKT_VALUE')),
-        'land_mkt_value': safe_float(attrs.get('LAND_MKT_VALUE')),
-        'parcel_acres': safe_float(attrs.get('PARCEL_ACRES')),
-        'house_cnt': safe_str(attrs.get('HOUSE_CNT')),
-        'subdiv_name': safe_str(attrs.get('SUBDIV_NAME')),
-        'tax_dist': safe_str(attrs.get('TAX_DIST')),
-    }
-
-def build_batch_update_sql(lir_records):
-    """
-    Build a single SQL UPDATE statement that updates multiple rows at once
-    Uses PostgreSQL's UPDATE FROM VALUES pattern for speed
-    """
-    if not lir_records:
-        return None
-
-    # Build VALUES clause with all records
-    values_parts = []
-    for rec in lir_records:
-        # Escape single quotes in strings
-        def sql_escape(val):
-            if val is None:
-                return 'NULL'
-            elif isinstance(val, str):
-                return f"'{val.replace(chr(39), chr(39)+chr(39))}'"  # Escape single quotes
-            else:
-                return str(val)
-
-        values_parts.append(
-            f"({sql_escape(rec['apn'])}, "
-            f"{sql_escape(rec['prop_class'])}, "
-            f"{sql_escape(rec['taxexempt_type'])}, "
-            f"{sql_escape(rec['primary_res'])}, "
-            f"{sql_escape(rec['bldg_sqft'])}, "
-            f"{sql_escape(rec['bldg_sqft_info'])}, "
-            f"{sql_escape(rec['floors_cnt'])}, "
-            f"{sql_escape(rec['floors_info'])}, "
-            f"{sql_escape(rec['built_yr'])}, "
-            f"{sql_escape(rec['effbuilt_yr'])}, "
-            f"{sql_escape(rec['const_material'])}, "
-            f"{sql_escape(rec['total_mkt_value'])}, "
-            f"{sql_escape(rec['land_mkt_value'])}, "
-            f"{sql_escape(rec['parcel_acres'])}, "
-            f"{sql_escape(rec['house_cnt'])}, "
-            f"{sql_escape(rec['subdiv_name'])}, "
-            f"{sql_escape(rec['tax_dist'])})"
-        )
-
-    values_clause = ",\n".join(values_parts)
-
-    # Build the UPDATE statement
-    sql = f"""
-UPDATE parcels
-SET
-    prop_class = v.prop_class,
-    taxexempt_type = v.taxexempt_type,
-    primary_res = v.primary_res,
-    bldg_sqft = v.bldg_sqft::numeric,
-    bldg_sqft_info = v.bldg_sqft_info,
-    floors_cnt = v.floors_cnt::numeric,
-    floors_info = v.floors_info,
-    built_yr = v.built_yr::integer,
-    effbuilt_yr = v.effbuilt_yr::integer,
-    const_material = v.const_material,
-    total_mkt_value = v.total_mkt_value::numeric,
-    land_mkt_value = v.land_mkt_value::numeric,
-    parcel_acres = v.parcel_acres::numeric,
-    house_cnt = v.house_cnt,
-    subdiv_name = v.subdiv_name,
-    tax_dist = v.tax_dist
-FROM (VALUES
-{values_clause}
-) AS v(apn, prop_class, taxexempt_type, primary_res, bldg_sqft, bldg_sqft_info,
-       floors_cnt, floors_info, built_yr, effbuilt_yr, const_material,
-       total_mkt_value, land_mkt_value, parcel_acres, house_cnt, subdiv_name, tax_dist)
-WHERE parcels.apn = v.apn
-"""
-    return sql
-
-def update_parcel_batch_fast(lir_records):
-    """
-    Fast batch update using raw SQL
-    Updates all records in a single query instead of one-by-one
-    """
-    if not lir_records:
-        return 0
-
-    try:
-        sql = build_batch_update_sql(lir_records)
-        if not sql:
-            return 0
-
-        # Execute raw SQL via Supabase RPC
-        # Note: This requires a custom function or use postgrest directly
-        # For now, fall back to individual updates but batched via upsert
-
-        # Try batch upsert (faster than individual updates)
-        result = supabase.table('parcels').upsert(
-            lir_records,
-            on_conflict='apn',
-            ignore_duplicates=False  # Update existing records
-        ).execute()
-
-        return len(lir_records)
-    except Exception as e:
-        print(f"\nBatch update error: {e}")
-        print("Falling back to slower individual updates...")
-
-        # Fall back to one-by-one
-        success_count = 0
-        for record in lir_records:
-            try:
-                apn = record.pop('apn')
-                supabase.table('parcels').update(record).eq('apn', apn).execute()
-                success_count += 1
-            except Exception as e2:
-                pass  # Skip errors
-
-        return success_count
-
-def update_parcels_with_lir(limit=None, dry_run=False):
-    """Update existing parcels with LIR data using fast batch updates"""
-    print("=" * 70)
-    print("FAST UPDATE: Parcels with LIR Data (Batch Mode)")
-    print("=" * 70)
-    print("This will merge vacancy, building, and market value data")
-    print("WITHOUT overwriting owner information from Davis County API")
-    print("=" * 70)
-
-    if dry_run:
-        print("\n[DRY RUN] - No database changes will be made\n")
-
-    # Get total LIR records available
-    total_lir = get_lir_parcel_count()
-    print(f"\nLIR records available: {total_lir:,}")
-
-    if limit:
-        print(f"Processing first {limit:,} records only")
-        total_lir = min(total_lir, limit)
-
-    # Fetch and update in batches
-    batch_size = 1000
-    offset = 0
-    total_updated = 0
-    total_processed = 0
-
-    print("\nStarting fast LIR data merge...\n")
-
-    with tqdm(total=total_lir, desc="Updating parcels") as pbar:
-        while offset < total_lir:
-            # Fetch LIR batch
-            features = fetch_lir_batch(offset, batch_size)
-
-            if not features:
-                print(f"\nNo more features at offset {offset}")
-                break
-
-            # Extract LIR fields
-            lir_records = []
-            for feature in features:
-                try:
-                    record = extract_lir_fields(feature)
-                    if record and record.get('apn'):
-                        lir_records.append(record)
-                except Exception as e:
-                    pass  # Skip bad records
-
-            total_processed += len(lir_records)
-
-            # Update database (unless dry run)
-            if not dry_run and lir_records:
-                updated = update_parcel_batch_fast(lir_records)
-                total_updated += updated
-            elif dry_run and lir_records:
-                total_updated += len(lir_records)
-                if offset == 0:
-                    print("\n[SAMPLE] LIR record that would be merged:")
-                    sample = lir_records[0]
-                    print(f"   APN: {sample.get('apn')}")
-                    print(f"   Property Class: {sample.get('prop_class')}")
-                    print(f"   Building Sqft: {sample.get('bldg_sqft')}")
-                    print(f"   Built Year: {sample.get('built_yr')}")
-                    if sample.get('total_mkt_value'):
-                        print(f"   Total Market Value: ${sample.get('total_mkt_value'):,.2f}")
-                    print(f"   Parcel Acres: {sample.get('parcel_acres')}\n")
-
-            pbar.update(len(features))
-            offset += batch_size
-
-            # Shorter delay since we're doing batch updates
-            time.sleep(0.2)
-
-    print("\n" + "=" * 70)
-    if dry_run:
-        print("DRY RUN COMPLETE")
-        print(f"  Would process: {total_processed:,} LIR records")
-        print(f"  Would update: {total_updated:,} parcels")
-    else:
-        print("UPDATE COMPLETE")
-        print(f"  LIR records processed: {total_processed:,}")
-        print(f"  Parcels updated: {total_updated:,}")
-
-    print("=" * 70)
-
-    if not dry_run:
-        print("\n[SUCCESS] Your parcels now have:")
-        print("   - Owner information (from Davis County GIS Portal)")
-        print("   - Property classification (Vacant, Residential, etc.)")
-        print("   - Building details (sqft, year built)")
-        print("   - Market values (land + total)")
-        print("\nReady to build the search UI!")
+from lir_merge import main
 
 if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(description='Fast update of parcels with LIR data')
-    parser.add_argument('--limit', type=int, help='Limit number of LIR records to process')
-    parser.add_argument('--dry-run', action='store_true', help='Preview without updating')
-    parser.add_argument('--run', action='store_true', help='Actually perform the update')
-
-    args = parser.parse_args()
-
-    if not args.dry_run and not args.run:
-        print("\n[ERROR] You must specify either --dry-run or --run")
-        print("\nExamples:")
-        print("  python update_parcels_with_lir_fast.py --dry-run")
-        print("  python update_parcels_with_lir_fast.py --run")
-        print("  python update_parcels_with_lir_fast.py --run --limit 5000  # Test with 5k parcels\n")
-        exit(1)
-
-    update_parcels_with_lir(limit=args.limit, dry_run=args.dry_run)
+    main('Fast update of parcels with LIR data', 'update_parcels_with_lir_fast.py', default_strategy='upsert')
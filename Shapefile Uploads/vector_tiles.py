@@ -0,0 +1,381 @@
+"""
+Parcel vector tile pyramid, built in Python
+Reads parcel polygons from a local snapshot (the parcels.geojson export, a
+GeoPackage, a shapefile, anything geopandas reads) or straight from the
+parcels table, and writes MVT tiles for a range of zooms into one PMTiles
+archive (mvt.py, pmtiles_archive.py).
+
+For every tile, the parcels touching it are clipped to the tile plus a small
+buffer, simplified to the tile's resolution and quantized to the tile extent;
+parcels that shrink below a few tile units at low zooms drop out. Tiles are
+encoded across a process pool. Parcel geometries go to each worker once, as
+WKB, when the pool starts, so a task is only z/x/y and the indices of the
+parcels it covers.
+
+Typical use:
+    features = load_snapshot('parcels.geojson', DEFAULT_TILE_ATTRIBUTES)
+    writer = build_tiles(features, 'parcels.pmtiles', min_zoom=10, max_zoom=15)
+    print(writer.summary())
+"""
+
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from tqdm import tqdm
+
+from metrics import recorder
+from mvt import DEFAULT_EXTENT, LayerEncoder, encode_tile
+from pmtiles_archive import PMTilesWriter, zxy_to_tile_id
+from reproject import WGS84_EPSG, source_crs, transform_coords
+
+WEB_MERCATOR_EPSG = 3857
+MERCATOR_HALF = 20037508.342789244  # Half the width of the Web Mercator world, in meters
+
+DEFAULT_LAYER = 'parcels'
+# The attributes parcels_tile() (migration 009) puts in its tiles
+DEFAULT_TILE_ATTRIBUTES = ('id', 'apn', 'address', 'city', 'county', 'owner_name', 'size_acres', 'property_url')
+DEFAULT_MIN_ZOOM = 6
+DEFAULT_MAX_ZOOM = 15
+DEFAULT_BUFFER = 64  # Tile units clipped in around each tile, so edges join without seams
+DEFAULT_SIMPLIFY = 1.0  # Douglas-Peucker tolerance in tile units, below the max zoom
+DEFAULT_MIN_AREA = 4  # Square tile units; smaller polygons are dropped from a tile
+DEFAULT_TILE_WORKERS = os.cpu_count() or 1
+TILES_PER_TASK = 8  # Tiles sent to a worker at a time
+
+# Per-process state for build_tile(), set by _init_worker
+_worker = {}
+
+
+class TileFeatures:
+    """
+    Parcel polygons in Web Mercator with the attributes that go into tiles
+
+    Args:
+        geoms: NumPy object array of shapely geometries in EPSG:3857
+        ids: Integer array of feature IDs
+        properties: Dict attribute name -> NumPy object array of values
+        bounds: (min_lon, min_lat, max_lon, max_lat) of all the parcels
+        fields: Dict attribute name -> 'Number' or 'String', for the archive metadata
+    """
+
+    def __init__(self, geoms, ids, properties, bounds, fields):
+        self.geoms = geoms
+        self.ids = ids
+        self.properties = properties
+        self.bounds = bounds
+        self.fields = fields
+
+    def __len__(self):
+        return len(self.geoms)
+
+
+def features_from_frame(gdf, attributes):
+    """
+    TileFeatures from a GeoDataFrame of parcels in any CRS
+
+    Rows without geometry are skipped; attributes the frame lacks are left out
+    with a warning. Feature IDs come from the id column, else the row number.
+    """
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    missing = [name for name in attributes if name not in gdf.columns]
+    if missing:
+        print(f"Warning: no {', '.join(missing)} column(s), leaving them out of the tiles")
+
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    coords = shapely.get_coordinates(geoms)
+    mercator, lonlat = transform_coords(coords, source_crs(gdf), (WEB_MERCATOR_EPSG, WGS84_EPSG))
+    geoms = shapely.set_coordinates(geoms.copy(), mercator)
+
+    if 'id' in gdf.columns:
+        ids = pd.to_numeric(gdf['id'], errors='coerce').fillna(0).astype(np.int64).to_numpy()
+    else:
+        ids = np.arange(1, len(gdf) + 1, dtype=np.int64)
+
+    properties = {}
+    fields = {}
+    for name in attributes:
+        if name in missing:
+            continue
+        column = gdf[name]
+        numeric = pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column)
+        fields[name] = 'Number' if numeric else 'String'
+        properties[name] = column.astype(object).where(column.notna(), None).to_numpy(dtype=object)
+
+    bounds = (float(lonlat[:, 0].min()), float(lonlat[:, 1].min()),
+              float(lonlat[:, 0].max()), float(lonlat[:, 1].max())) if len(lonlat) else (0.0, 0.0, 0.0, 0.0)
+    return TileFeatures(geoms, ids, properties, bounds, fields)
+
+
+def load_snapshot(path, attributes, layer=None):
+    """Read parcels from a local file (GeoJSON, GeoPackage, shapefile, ...) for tiling"""
+    with recorder.time('read') as timer:
+        gdf = gpd.read_file(path, layer=layer)
+        timer.add(items=len(gdf))
+    return features_from_frame(gdf, attributes)
+
+
+def load_database(attributes, database_url=None, table='parcels', where=None, params=None):
+    """
+    Read parcels for tiling over a direct Postgres connection (see pg_copy.connect)
+
+    Geometry is fetched as WKB through a server-side cursor, so the rows come
+    over in large batches without an OFFSET scan or any GeoJSON text.
+
+    Args:
+        attributes: Column names to put in the tiles (id is always read, for feature IDs)
+        database_url: Postgres connection string (default: SUPABASE_DB_URL from .env)
+        table: Table to read
+        where: Optional SQL condition (with %s placeholders for params)
+        params: Values for the where placeholders
+    """
+    try:
+        from psycopg import sql
+    except ImportError:
+        raise ImportError('Reading parcels from the database needs psycopg 3: pip install "psycopg[binary]"')
+
+    from pg_copy import connect
+
+    columns = ['id'] + [name for name in attributes if name != 'id']
+    query = sql.SQL(
+        "SELECT {columns}, ST_AsBinary(geom) FROM {table} WHERE geom IS NOT NULL{where} ORDER BY id"
+    ).format(
+        columns=sql.SQL(', ').join(sql.Identifier(name) for name in columns),
+        table=sql.Identifier(table),
+        where=sql.SQL(f" AND ({where})") if where else sql.SQL(''),
+    )
+
+    with recorder.time('read') as timer:
+        with connect(database_url) as conn, conn.cursor(name='parcel_tiles') as cursor:
+            cursor.itersize = 20000
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        timer.add(items=len(rows))
+
+    frame = pd.DataFrame([row[:-1] for row in rows], columns=columns)
+    for name in columns:
+        # numeric columns (size_acres) arrive as Decimal
+        values = frame[name].dropna()
+        if len(values) and isinstance(values.iloc[0], Decimal):
+            frame[name] = frame[name].astype(float)
+    geoms = shapely.from_wkb([bytes(row[-1]) for row in rows])
+    return features_from_frame(gpd.GeoDataFrame(frame, geometry=geoms, crs=WGS84_EPSG), attributes)
+
+
+def tile_size(z):
+    """Width of a zoom-z tile in Web Mercator meters"""
+    return 2 * MERCATOR_HALF / (1 << z)
+
+
+def tile_span(bounds, z, margin=0.0):
+    """
+    Tile columns and rows covered by Web Mercator bounding boxes at zoom z
+
+    Args:
+        bounds: (n, 4) array of minx, miny, maxx, maxy
+        margin: Meters added around each box
+
+    Returns:
+        (x0, y0, x1, y1) int64 arrays, inclusive and clamped to the zoom level
+    """
+    size = tile_size(z)
+    last = (1 << z) - 1
+
+    def cell(values):
+        return np.clip(np.floor(values / size), 0, last).astype(np.int64)
+
+    return (cell(bounds[:, 0] - margin + MERCATOR_HALF), cell(MERCATOR_HALF - bounds[:, 3] - margin),
+            cell(bounds[:, 2] + margin + MERCATOR_HALF), cell(MERCATOR_HALF - bounds[:, 1] + margin))
+
+
+def assign_tiles(bounds, z, buffer=DEFAULT_BUFFER, extent=DEFAULT_EXTENT):
+    """
+    Group features by the zoom-z tiles they touch (including the tile buffer)
+
+    Returns:
+        List of (x, y, int64 array of feature indices, ascending)
+    """
+    if len(bounds) == 0:
+        return []
+    x0, y0, x1, y1 = tile_span(bounds, z, tile_size(z) * buffer / extent)
+    heights = y1 - y0 + 1
+    counts = (x1 - x0 + 1) * heights
+    feature = np.repeat(np.arange(len(bounds)), counts)
+    step = np.arange(len(feature)) - np.repeat(np.cumsum(counts) - counts, counts)
+    keys = (x0[feature] + step // heights[feature]) << 32 | (y0[feature] + step % heights[feature])
+
+    order = np.argsort(keys, kind='stable')
+    keys, feature = keys[order], feature[order]
+    unique, starts = np.unique(keys, return_index=True)
+    return [(int(key >> 32), int(key & 0xffffffff), indices)
+            for key, indices in zip(unique.tolist(), np.split(feature, starts[1:]))]
+
+
+def _init_worker(wkb, ids, properties, options):
+    _worker['geoms'] = shapely.from_wkb(wkb)
+    _worker['ids'] = ids
+    _worker['properties'] = properties
+    _worker['options'] = options
+
+
+def build_tile(task):
+    """
+    Encode one tile from the features set up by _init_worker
+
+    Args:
+        task: (tile_id, z, x, y, feature indices)
+
+    Returns:
+        (tile_id, gzip-compressed MVT bytes, or None if every feature dropped out)
+    """
+    tile_id, z, x, y, indices = task
+    options = _worker['options']
+    extent = options['extent']
+    size = tile_size(z)
+    minx = -MERCATOR_HALF + x * size
+    maxy = MERCATOR_HALF - y * size
+    margin = size * options['buffer'] / extent
+
+    geoms = shapely.clip_by_rect(_worker['geoms'][indices], minx - margin, maxy - size - margin,
+                                 minx + size + margin, maxy + margin)
+    if options['simplify'] and z < options['max_zoom']:
+        geoms = shapely.simplify(geoms, size * options['simplify'] / extent, preserve_topology=False)
+
+    # Clipping can leave collections with slivers of line or point along the edges
+    parts, owner = shapely.get_parts(geoms, return_index=True)
+    nested = np.isin(shapely.get_type_id(parts), (6, 7))
+    if nested.any():
+        parts, inner = shapely.get_parts(parts, return_index=True)
+        owner = owner[inner]
+    polygons = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    parts, owner = parts[polygons], owner[polygons]
+    if len(parts) == 0:
+        return tile_id, None
+
+    _, coords, (ring_offsets, polygon_offsets) = shapely.to_ragged_array(parts)
+    scale = extent / size
+    coords = np.column_stack((np.rint((coords[:, 0] - minx) * scale), np.rint((maxy - coords[:, 1]) * scale)))
+    owners, feature_offsets = np.unique(owner, return_index=True)
+    feature_offsets = np.append(feature_offsets, len(parts))
+    selected = indices[owners]
+
+    layer = LayerEncoder(options['layer'], extent)
+    layer.add_polygons(coords.astype(np.int64), ring_offsets, polygon_offsets, feature_offsets,
+                       ids=_worker['ids'][selected],
+                       properties={name: values[selected] for name, values in _worker['properties'].items()},
+                       min_area=options['min_area'])
+    tile = encode_tile([layer])
+    if not tile:
+        return tile_id, None
+    return tile_id, gzip.compress(tile, compresslevel=6, mtime=0)
+
+
+def tile_tasks(features, zooms, buffer=DEFAULT_BUFFER, extent=DEFAULT_EXTENT, only=None):
+    """
+    build_tile() tasks for the given zoom levels, in tile ID order
+
+    Args:
+        only: Optional set of tile IDs; other tiles are skipped
+    """
+    bounds = shapely.bounds(features.geoms)
+    tasks = []
+    for z in zooms:
+        for x, y, indices in assign_tiles(bounds, z, buffer, extent):
+            tile_id = zxy_to_tile_id(z, x, y)
+            if only is None or tile_id in only:
+                tasks.append((tile_id, z, x, y, indices))
+    tasks.sort(key=lambda task: task[0])
+    return tasks
+
+
+def encode_tiles(features, tasks, options, workers=DEFAULT_TILE_WORKERS):
+    """
+    Run build_tile() over tasks, across a process pool when workers > 1
+
+    Yields:
+        (tile_id, tile bytes or None), in task order
+    """
+    initargs = (shapely.to_wkb(features.geoms), features.ids, features.properties, options)
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(*initargs)
+        yield from map(build_tile, tasks)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+        yield from pool.map(build_tile, tasks, chunksize=TILES_PER_TASK)
+
+
+def tile_metadata(features, layer, min_zoom, max_zoom, options):
+    """PMTiles JSON metadata: the vector_layers list viewers read, plus the build options"""
+    return {
+        'name': layer,
+        'format': 'pbf',
+        'type': 'overlay',
+        'generator': 'build_tiles.py',
+        'vector_layers': [{'id': layer, 'fields': features.fields, 'minzoom': min_zoom, 'maxzoom': max_zoom}],
+        'tile_options': options,
+    }
+
+
+def build_tiles(features, output, layer=DEFAULT_LAYER, min_zoom=DEFAULT_MIN_ZOOM, max_zoom=DEFAULT_MAX_ZOOM,
+                workers=DEFAULT_TILE_WORKERS, extent=DEFAULT_EXTENT, buffer=DEFAULT_BUFFER,
+                simplify=DEFAULT_SIMPLIFY, min_area=DEFAULT_MIN_AREA):
+    """
+    Encode every tile from min_zoom to max_zoom into a new PMTiles archive
+
+    Args:
+        features: TileFeatures (load_snapshot / load_database)
+        output: .pmtiles path, replaced once the archive is complete
+
+    Returns:
+        The finished PMTilesWriter (for its summary)
+    """
+    options = {'layer': layer, 'extent': extent, 'buffer': buffer, 'simplify': simplify,
+               'min_area': min_area, 'max_zoom': max_zoom, 'attributes': list(features.properties)}
+    tasks = tile_tasks(features, range(min_zoom, max_zoom + 1), buffer, extent)
+
+    writer = PMTilesWriter(output)
+    try:
+        with tqdm(total=len(tasks), desc="Encoding tiles") as pbar, recorder.time('encode') as timer:
+            for tile_id, data in encode_tiles(features, tasks, options, workers):
+                if data is not None:
+                    writer.add(tile_id, data)
+                    timer.add(items=1, nbytes=len(data))
+                pbar.update(1)
+        writer.finish(tile_metadata(features, layer, min_zoom, max_zoom, options),
+                      min_zoom, max_zoom, features.bounds)
+    except BaseException:
+        writer.close()
+        raise
+    return writer
+
+
+def parse_attributes(value):
+    """Comma-separated attribute list from the command line"""
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def add_tile_arguments(parser):
+    """Add the tile pyramid options to a script's argparse parser"""
+    parser.add_argument('--layer', default=DEFAULT_LAYER, help=f'Vector tile layer name (default: {DEFAULT_LAYER})')
+    parser.add_argument('--attributes', type=parse_attributes, default=list(DEFAULT_TILE_ATTRIBUTES),
+                        help=f'Comma-separated parcel attributes to put in the tiles '
+                             f'(default: {",".join(DEFAULT_TILE_ATTRIBUTES)})')
+    parser.add_argument('--min-zoom', type=int, default=DEFAULT_MIN_ZOOM,
+                        help=f'Lowest zoom level to build (default: {DEFAULT_MIN_ZOOM})')
+    parser.add_argument('--max-zoom', type=int, default=DEFAULT_MAX_ZOOM,
+                        help=f'Highest zoom level to build; viewers overzoom past it (default: {DEFAULT_MAX_ZOOM})')
+    parser.add_argument('--tile-workers', type=int, default=DEFAULT_TILE_WORKERS,
+                        help=f'Processes encoding tiles (default: {DEFAULT_TILE_WORKERS}, the number of CPUs)')
+    parser.add_argument('--buffer', type=int, default=DEFAULT_BUFFER,
+                        help=f'Tile units of geometry kept around each tile edge (default: {DEFAULT_BUFFER})')
+    parser.add_argument('--simplify', type=float, default=DEFAULT_SIMPLIFY,
+                        help=f'Simplification tolerance in tile units below the max zoom, 0 to keep every '
+                             f'vertex (default: {DEFAULT_SIMPLIFY})')
+    parser.add_argument('--min-area', type=float, default=DEFAULT_MIN_AREA,
+                        help=f'Drop polygons smaller than this many square tile units (default: {DEFAULT_MIN_AREA})')
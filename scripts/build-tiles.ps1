@@ -1,47 +1,35 @@
 Param(
-  [string]$GeoJSON = "./parcels.geojson",
-  [string]$Mbtiles = "./parcels.mbtiles",
-  [string]$OutDir = "./tiles",
+  [string]$Source = "./parcels.geojson",
+  [string]$Output = "./parcels.pmtiles",
   [int]$MinZoom = 6,
   [int]$MaxZoom = 15,
-  [string]$Layer = "parcels"
+  [string]$Layer = "parcels",
+  [string]$Attributes = "",
+  [string]$Python = "python"
 )
 
-function Require-Cmd($name) {
-  $cmd = Get-Command $name -ErrorAction SilentlyContinue
-  if (-not $cmd) { Write-Error "'$name' not found in PATH. Install tippecanoe (and mapbox/tippecanoe's tile-join)."; exit 1 }
-}
-
-Write-Host "Building vector tiles from" $GeoJSON
-
-if (-not (Test-Path $GeoJSON)) { Write-Error "GeoJSON not found: $GeoJSON"; exit 1 }
+# Builds the parcel vector tiles into a single PMTiles archive with the Python
+# tile builder ("Shapefile Uploads/build_tiles.py"); pass -Source db to read the
+# parcels table over SUPABASE_DB_URL.
 
-Require-Cmd tippecanoe
-Require-Cmd tile-join
+if (-not (Get-Command $Python -ErrorAction SilentlyContinue)) { Write-Error "'$Python' not found in PATH."; exit 1 }
 
-Write-Host "Step 1/2: tippecanoe ->" $Mbtiles
-tippecanoe `
-  -o $Mbtiles `
-  --layer=$Layer `
-  --drop-densest-as-needed `
-  --extend-zooms-if-still-dropping `
-  --no-tile-compression `
-  --generate-ids `
-  --read-parallel `
-  --force `
-  --minimum-zoom=$MinZoom `
-  --maximum-zoom=$MaxZoom `
-  $GeoJSON
+$builder = Join-Path $PSScriptRoot "..\Shapefile Uploads\build_tiles.py"
+$builderArgs = @("--output", $Output, "--layer", $Layer, "--min-zoom", $MinZoom, "--max-zoom", $MaxZoom)
+if ($Attributes) { $builderArgs += @("--attributes", $Attributes) }
 
-if ($LASTEXITCODE -ne 0) { Write-Error "tippecanoe failed"; exit 1 }
-
-Write-Host "Step 2/2: tile-join ->" $OutDir
-if (Test-Path $OutDir) { Remove-Item -Recurse -Force $OutDir }
-tile-join -e $OutDir $Mbtiles
-if ($LASTEXITCODE -ne 0) { Write-Error "tile-join failed"; exit 1 }
+if ($Source -eq "db") {
+  Write-Host "Building vector tiles from the parcels table"
+} else {
+  Write-Host "Building vector tiles from" $Source
+  if (-not (Test-Path $Source)) { Write-Error "Snapshot not found: $Source (run 'npm run export-geojson', or pass -Source db)"; exit 1 }
+  $builderArgs = @($Source) + $builderArgs
+}
 
-Write-Host "\nSuccess! Tiles written to" (Resolve-Path $OutDir)
-Write-Host "Upload this folder to your object storage (S3/R2/GCS/Supabase Storage) behind a CDN."
-Write-Host "Ensure headers: Content-Type: application/x-protobuf, Content-Encoding: gzip (if gzipped)."
-Write-Host "Then set VITE_PARCELS_PMTILES_URL to https://cdn.example.com/tiles/{z}/{x}/{y}.pbf in .env and restart vite."
+& $Python $builder @builderArgs
+if ($LASTEXITCODE -ne 0) { Write-Error "build_tiles.py failed"; exit 1 }
 
+Write-Host "\nSuccess! Tiles written to" (Resolve-Path $Output)
+Write-Host "Upload this one file to your object storage (S3/R2/GCS/Supabase Storage) and serve it as"
+Write-Host "z/x/y tiles with 'pmtiles serve' or a PMTiles CDN worker (see TILES.md)."
+Write-Host "Then set VITE_PARCELS_TILES_URL to https://cdn.example.com/parcels/{z}/{x}/{y}.mvt in .env and restart vite."
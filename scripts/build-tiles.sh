@@ -1,43 +1,40 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
-GEOJSON=${1:-./parcels.geojson}
-MBTILES=${2:-./parcels.mbtiles}
-OUTDIR=${3:-./tiles}
+# Builds the parcel vector tiles into a single PMTiles archive with the Python
+# tile builder ("Shapefile Uploads/build_tiles.py"); pass "db" instead of a
+# snapshot file to read the parcels table over SUPABASE_DB_URL.
+
+SOURCE=${1:-./parcels.geojson}
+OUTPUT=${2:-./parcels.pmtiles}
 MINZ=${MINZ:-6}
 MAXZ=${MAXZ:-15}
 LAYER=${LAYER:-parcels}
+ATTRIBUTES=${ATTRIBUTES:-}
+PYTHON=${PYTHON:-python3}
 
-echo "Building vector tiles from $GEOJSON"
-if [ ! -f "$GEOJSON" ]; then
-  echo "GeoJSON not found: $GEOJSON" >&2
-  exit 1
+BUILDER="$(dirname "$0")/../Shapefile Uploads/build_tiles.py"
+ARGS=(--output "$OUTPUT" --layer "$LAYER" --min-zoom "$MINZ" --max-zoom "$MAXZ")
+if [ -n "$ATTRIBUTES" ]; then
+  ARGS+=(--attributes "$ATTRIBUTES")
 fi
 
-command -v tippecanoe >/dev/null 2>&1 || { echo "tippecanoe not found in PATH" >&2; exit 1; }
-command -v tile-join >/dev/null 2>&1 || { echo "tile-join not found in PATH" >&2; exit 1; }
-
-echo "Step 1/2: tippecanoe -> $MBTILES"
-tippecanoe \
-  -o "$MBTILES" \
-  --layer="$LAYER" \
-  --drop-densest-as-needed \
-  --extend-zooms-if-still-dropping \
-  --no-tile-compression \
-  --generate-ids \
-  --read-parallel \
-  --force \
-  --minimum-zoom="$MINZ" \
-  --maximum-zoom="$MAXZ" \
-  "$GEOJSON"
+if [ "$SOURCE" = "db" ]; then
+  echo "Building vector tiles from the parcels table"
+else
+  echo "Building vector tiles from $SOURCE"
+  if [ ! -f "$SOURCE" ]; then
+    echo "Snapshot not found: $SOURCE (run 'npm run export-geojson', or pass 'db')" >&2
+    exit 1
+  fi
+  ARGS=("$SOURCE" "${ARGS[@]}")
+fi
 
-echo "Step 2/2: tile-join -> $OUTDIR"
-rm -rf "$OUTDIR"
-tile-join -e "$OUTDIR" "$MBTILES"
+command -v "$PYTHON" >/dev/null 2>&1 || { echo "$PYTHON not found in PATH" >&2; exit 1; }
+"$PYTHON" "$BUILDER" "${ARGS[@]}"
 
 echo
-echo "Success! Tiles written to $(realpath "$OUTDIR" 2>/dev/null || echo "$OUTDIR")"
-echo "Upload this folder to your object storage (S3/R2/GCS/Supabase Storage) behind a CDN."
-echo "Ensure headers: Content-Type: application/x-protobuf, Content-Encoding: gzip (if gzipped)."
-echo "Then set VITE_PARCELS_PMTILES_URL=https://cdn.example.com/tiles/{z}/{x}/{y}.pbf in .env and restart vite."
-
+echo "Success! Tiles written to $(realpath "$OUTPUT" 2>/dev/null || echo "$OUTPUT")"
+echo "Upload this one file to your object storage (S3/R2/GCS/Supabase Storage) and serve it as"
+echo "z/x/y tiles with 'pmtiles serve' or a PMTiles CDN worker (see TILES.md)."
+echo "Then set VITE_PARCELS_TILES_URL=https://cdn.example.com/parcels/{z}/{x}/{y}.mvt in .env and restart vite."
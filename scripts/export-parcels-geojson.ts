@@ -106,17 +106,11 @@ $$;
   console.log(`📦 File size: ${fileSizeMB} MB`);
 
   console.log('\n📋 Next steps:');
-  console.log('1. Install tippecanoe (if not already installed)');
-  console.log('   • macOS: brew install tippecanoe');
-  console.log('   • Windows: Use WSL or Docker');
+  console.log('1. Build the vector tiles into parcels.pmtiles:');
+  console.log('   npm run build-tiles   (Windows: npm run build-tiles:win)');
   console.log('');
-  console.log('2. Generate vector tiles:');
-  console.log('   tippecanoe -o parcels.mbtiles -zg -Z6 -z15 --drop-densest-as-needed parcels.geojson');
-  console.log('');
-  console.log('3. Extract tiles to directory:');
-  console.log('   tile-join -e ./tiles parcels.mbtiles');
-  console.log('');
-  console.log('4. Upload ./tiles folder to Supabase Storage or Cloudflare R2');
+  console.log('2. Upload parcels.pmtiles and serve it as z/x/y tiles (see TILES.md):');
+  console.log('   npm run upload-tiles');
 }
 
 exportParcelsToGeoJSON();
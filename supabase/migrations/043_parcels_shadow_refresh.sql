@@ -0,0 +1,294 @@
+-- Zero-downtime full refresh of the parcels table
+-- Instead of TRUNCATE + re-import (which leaves parcels_tile and search_parcels
+-- serving an empty or partial table for the whole import), a refresh loads
+-- into a shadow table and swaps it in at the end:
+--
+--   1. begin_parcels_refresh()      - empty parcels_shadow with parcels' columns, keys,
+--                                     grants and RLS policies (keys are needed for upserts)
+--   2. load rows into parcels_shadow through the REST API as usual; simplified
+--                                     geometries are filled in by a trigger on insert
+--   3. build_parcels_shadow_index() - builds one of parcels' secondary indexes on the
+--                                     shadow per call (returns NULL when all are built)
+--   4. swap_parcels_shadow()        - renames both tables and their indexes in one
+--                                     transaction, recreates the functions that use the
+--                                     parcels row type (parcels_in_bounds returns SETOF
+--                                     parcels) against the new table, and drops the old one
+--
+-- Readers keep seeing the complete old table until the swap commits. Rows written
+-- to parcels by other jobs while a refresh is loading are not carried over.
+
+-- Index/constraint name with a suffix, kept within the 63 character identifier limit
+CREATE OR REPLACE FUNCTION public.parcels_refresh_name(name text, suffix text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT left(name, 63 - length(suffix)) || suffix;
+$$;
+
+-- Same simplification as update_simplified_geometries(), applied per row while loading
+CREATE OR REPLACE FUNCTION public.set_parcel_geom_simplified()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.geom_simplified := ST_Multi(ST_SimplifyPreserveTopology(NEW.geom, 0.0001));
+  RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.begin_parcels_refresh()
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  c record;
+  g record;
+  p record;
+BEGIN
+  DROP TABLE IF EXISTS public.parcels_shadow;
+
+  -- Columns, defaults (id keeps drawing from the parcels id sequence), NOT NULL and CHECK constraints
+  CREATE TABLE public.parcels_shadow (
+    LIKE public.parcels INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS
+  );
+
+  -- Primary key and unique constraints up front: upserts on apn need them
+  FOR c IN
+    SELECT conname, pg_get_constraintdef(oid) AS def
+    FROM pg_constraint
+    WHERE conrelid = 'public.parcels'::regclass AND contype IN ('p', 'u')
+  LOOP
+    EXECUTE format('ALTER TABLE public.parcels_shadow ADD CONSTRAINT %I %s',
+                   parcels_refresh_name(c.conname, '_shadow'), c.def);
+  END LOOP;
+
+  -- Grants, row level security and policies, so the swapped-in table serves the same clients
+  FOR g IN
+    SELECT a.privilege_type,
+           CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+    FROM pg_class t, aclexplode(t.relacl) a
+    WHERE t.oid = 'public.parcels'::regclass AND a.grantee <> t.relowner
+  LOOP
+    EXECUTE format('GRANT %s ON public.parcels_shadow TO %s', g.privilege_type, g.grantee);
+  END LOOP;
+
+  IF (SELECT relrowsecurity FROM pg_class WHERE oid = 'public.parcels'::regclass) THEN
+    ALTER TABLE public.parcels_shadow ENABLE ROW LEVEL SECURITY;
+  END IF;
+
+  FOR p IN SELECT * FROM pg_policies WHERE schemaname = 'public' AND tablename = 'parcels'
+  LOOP
+    EXECUTE format('CREATE POLICY %I ON public.parcels_shadow AS %s FOR %s TO %s%s%s',
+                   p.policyname, p.permissive, p.cmd, array_to_string(p.roles, ', '),
+                   coalesce(' USING (' || p.qual || ')', ''),
+                   coalesce(' WITH CHECK (' || p.with_check || ')', ''));
+  END LOOP;
+
+  IF obj_description('public.parcels'::regclass, 'pg_class') IS NOT NULL THEN
+    EXECUTE format('COMMENT ON TABLE public.parcels_shadow IS %L', obj_description('public.parcels'::regclass, 'pg_class'));
+  END IF;
+
+  CREATE TRIGGER parcels_shadow_geom_simplified
+    BEFORE INSERT OR UPDATE OF geom ON public.parcels_shadow
+    FOR EACH ROW
+    EXECUTE FUNCTION public.set_parcel_geom_simplified();
+
+  -- Let PostgREST see the new table
+  NOTIFY pgrst, 'reload schema';
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.build_parcels_shadow_index()
+RETURNS text
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  i record;
+  shadow_name text;
+  stmt text;
+BEGIN
+  IF to_regclass('public.parcels_shadow') IS NULL THEN
+    RAISE EXCEPTION 'parcels_shadow does not exist, run begin_parcels_refresh() first';
+  END IF;
+
+  -- Secondary indexes of parcels (constraint indexes already exist on the shadow)
+  FOR i IN
+    SELECT ci.relname, pg_get_indexdef(x.indexrelid) AS def
+    FROM pg_index x
+    JOIN pg_class ci ON ci.oid = x.indexrelid
+    WHERE x.indrelid = 'public.parcels'::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = x.indexrelid AND k.conrelid = x.indrelid)
+    ORDER BY ci.relname
+  LOOP
+    shadow_name := parcels_refresh_name(i.relname, '_shadow');
+    CONTINUE WHEN to_regclass(format('public.%I', shadow_name)) IS NOT NULL;
+
+    stmt := regexp_replace(i.def, '^CREATE (UNIQUE )?INDEX \S+ ON public\.parcels ',
+                           'CREATE \1INDEX ' || quote_ident(shadow_name) || ' ON public.parcels_shadow ');
+    IF stmt = i.def THEN
+      RAISE EXCEPTION 'Unexpected index definition: %', i.def;
+    END IF;
+    EXECUTE stmt;
+    RETURN i.relname;
+  END LOOP;
+
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.swap_parcels_shadow(min_rows bigint DEFAULT 1)
+RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  shadow_rows bigint;
+  seq text;
+  i record;
+  t record;
+  f record;
+  fn_oids oid[];
+  fn_signatures text[];
+  fn_defs text[];
+  n int;
+BEGIN
+  IF to_regclass('public.parcels_shadow') IS NULL THEN
+    RAISE EXCEPTION 'parcels_shadow does not exist, run begin_parcels_refresh() first';
+  END IF;
+
+  -- Any indexes not built yet by build_parcels_shadow_index()
+  LOOP
+    EXIT WHEN public.build_parcels_shadow_index() IS NULL;
+  END LOOP;
+
+  SELECT count(*) INTO shadow_rows FROM public.parcels_shadow;
+  IF shadow_rows < min_rows THEN
+    RAISE EXCEPTION 'parcels_shadow has % rows, expected at least %; parcels left unchanged', shadow_rows, min_rows;
+  END IF;
+
+  -- Loading is done: drop the simplification trigger, copy the live table's triggers
+  DROP TRIGGER IF EXISTS parcels_shadow_geom_simplified ON public.parcels_shadow;
+  FOR t IN SELECT tgname, pg_get_triggerdef(oid) AS def FROM pg_trigger
+           WHERE tgrelid = 'public.parcels'::regclass AND NOT tgisinternal
+  LOOP
+    CONTINUE WHEN EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'public.parcels_shadow'::regclass AND tgname = t.tgname);
+    EXECUTE replace(t.def, ' ON public.parcels ', ' ON public.parcels_shadow ');
+  END LOOP;
+
+  ANALYZE public.parcels_shadow;
+
+  -- Fail instead of queueing every reader behind the swap if a long query holds parcels
+  PERFORM set_config('lock_timeout', '10s', true);
+  LOCK TABLE public.parcels IN ACCESS EXCLUSIVE MODE;
+
+  -- Functions taking or returning the parcels row type depend on the old table and would
+  -- block dropping it; keep their definitions (which name the type as parcels) to recreate
+  -- them on the new table after the rename
+  SELECT coalesce(array_agg(p.oid ORDER BY p.oid), '{}'),
+         coalesce(array_agg(p.oid::regprocedure::text ORDER BY p.oid), '{}'),
+         coalesce(array_agg(pg_get_functiondef(p.oid) ORDER BY p.oid), '{}')
+  INTO fn_oids, fn_signatures, fn_defs
+  FROM pg_proc p
+  WHERE p.oid IN (
+    SELECT d.objid FROM pg_depend d
+    WHERE d.classid = 'pg_proc'::regclass
+      AND d.refclassid = 'pg_type'::regclass
+      AND d.refobjid = (SELECT reltype FROM pg_class WHERE oid = 'public.parcels'::regclass)
+  );
+
+  -- The id sequence belongs to parcels.id; move it so dropping the old table keeps it
+  seq := pg_get_serial_sequence('public.parcels', 'id');
+  IF seq IS NOT NULL THEN
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY public.parcels_shadow.id', seq);
+  END IF;
+
+  -- Index names (and the constraints they back): live -> *_old, shadow -> live names
+  FOR i IN
+    SELECT ci.relname
+    FROM pg_index x
+    JOIN pg_class ci ON ci.oid = x.indexrelid
+    WHERE x.indrelid = 'public.parcels'::regclass
+  LOOP
+    EXECUTE format('ALTER INDEX public.%I RENAME TO %I', i.relname, parcels_refresh_name(i.relname, '_old'));
+    IF to_regclass(format('public.%I', parcels_refresh_name(i.relname, '_shadow'))) IS NOT NULL THEN
+      EXECUTE format('ALTER INDEX public.%I RENAME TO %I', parcels_refresh_name(i.relname, '_shadow'), i.relname);
+    END IF;
+  END LOOP;
+
+  ALTER TABLE public.parcels RENAME TO parcels_old;
+  ALTER TABLE public.parcels_shadow RENAME TO parcels;
+
+  -- Point the row type functions at the new table, keeping owner, grants and comment
+  FOR n IN 1 .. coalesce(array_length(fn_oids, 1), 0)
+  LOOP
+    SELECT p.proowner, p.proacl, obj_description(p.oid, 'pg_proc') AS description
+    INTO f
+    FROM pg_proc p WHERE p.oid = fn_oids[n];
+
+    EXECUTE format('DROP FUNCTION %s', fn_oids[n]::regprocedure);
+    EXECUTE fn_defs[n];
+    EXECUTE format('ALTER FUNCTION %s OWNER TO %I', fn_signatures[n], pg_get_userbyid(f.proowner));
+
+    IF f.proacl IS NOT NULL THEN
+      EXECUTE format('REVOKE ALL ON FUNCTION %s FROM PUBLIC', fn_signatures[n]);
+      FOR t IN
+        SELECT a.privilege_type,
+               CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+        FROM aclexplode(f.proacl) a
+        WHERE a.grantee <> f.proowner
+      LOOP
+        EXECUTE format('GRANT %s ON FUNCTION %s TO %s', t.privilege_type, fn_signatures[n], t.grantee);
+      END LOOP;
+    END IF;
+
+    IF f.description IS NOT NULL THEN
+      EXECUTE format('COMMENT ON FUNCTION %s IS %L', fn_signatures[n], f.description);
+    END IF;
+  END LOOP;
+
+  -- No CASCADE: anything else still depending on the old table (a view) fails the swap
+  DROP TABLE public.parcels_old;
+
+  NOTIFY pgrst, 'reload schema';
+  RETURN shadow_rows;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.abort_parcels_refresh()
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  DROP TABLE IF EXISTS public.parcels_shadow;
+  NOTIFY pgrst, 'reload schema';
+END;
+$$;
+
+-- Refreshes replace the whole table: import jobs (service role) only
+REVOKE EXECUTE ON FUNCTION public.begin_parcels_refresh() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.build_parcels_shadow_index() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.swap_parcels_shadow(bigint) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.abort_parcels_refresh() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.begin_parcels_refresh() TO service_role;
+GRANT EXECUTE ON FUNCTION public.build_parcels_shadow_index() TO service_role;
+GRANT EXECUTE ON FUNCTION public.swap_parcels_shadow(bigint) TO service_role;
+GRANT EXECUTE ON FUNCTION public.abort_parcels_refresh() TO service_role;
+
+COMMENT ON FUNCTION public.begin_parcels_refresh IS 'Starts a zero-downtime refresh: creates an empty parcels_shadow to load into.';
+COMMENT ON FUNCTION public.build_parcels_shadow_index IS 'Builds the next missing secondary index on parcels_shadow; returns its name, or NULL when all are built.';
+COMMENT ON FUNCTION public.swap_parcels_shadow IS 'Atomically replaces parcels with the loaded parcels_shadow (refuses if it has fewer than min_rows rows).';
+COMMENT ON FUNCTION public.abort_parcels_refresh IS 'Drops parcels_shadow, abandoning a refresh.';
+
+-- Example (what sync_parcels_from_utah_api.py --refresh does through the REST API):
+-- SELECT begin_parcels_refresh();
+-- ... upsert rows into parcels_shadow ...
+-- SELECT build_parcels_shadow_index();  -- repeat until it returns NULL
+-- SELECT swap_parcels_shadow(100000);
@@ -0,0 +1,68 @@
+-- Batch upsert of parcel records with hex-EWKB geometry
+-- The upload scripts can send geometry as hex-encoded extended WKB
+-- ('0106000020E6100000...', see Shapefile Uploads/geometry_encoding.py) instead
+-- of EWKT or GeoJSON text. PostGIS decodes it straight into the geometry with
+-- no decimal parsing, and one call writes a whole batch instead of one REST
+-- insert per parcel.
+--
+-- Only the columns present in the first record are written, so each script
+-- sends its own column set. Duplicate APNs within a batch are collapsed (the
+-- plain REST upsert rejects a batch that touches the same row twice).
+
+CREATE OR REPLACE FUNCTION public.upsert_parcels(
+  parcel_data jsonb
+)
+RETURNS TABLE (
+  upserted_count integer
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  cols text[];
+  upsert_count integer;
+BEGIN
+  IF parcel_data IS NULL OR jsonb_array_length(parcel_data) = 0 THEN
+    RETURN QUERY SELECT 0;
+    RETURN;
+  END IF;
+
+  -- parcels columns named in the first record (id is always generated)
+  SELECT array_agg(a.attname::text ORDER BY a.attnum) INTO cols
+  FROM pg_attribute a
+  WHERE a.attrelid = 'public.parcels'::regclass
+    AND a.attnum > 0
+    AND NOT a.attisdropped
+    AND a.attname <> 'id'
+    AND parcel_data->0 ? a.attname;
+
+  IF cols IS NULL OR NOT 'apn' = ANY(cols) THEN
+    RAISE EXCEPTION 'upsert_parcels: records need an apn field';
+  END IF;
+
+  -- jsonb_populate_recordset casts each value with the column's input function:
+  -- geometry_in reads hex-EWKB (as well as EWKT and GeoJSON)
+  EXECUTE format(
+    'INSERT INTO public.parcels (%1$s)
+     SELECT DISTINCT ON (r.apn) %2$s
+     FROM jsonb_populate_recordset(NULL::public.parcels, $1) r
+     WHERE r.apn IS NOT NULL
+     ORDER BY r.apn
+     ON CONFLICT (apn) DO UPDATE SET %3$s',
+    (SELECT string_agg(quote_ident(c), ', ') FROM unnest(cols) c),
+    (SELECT string_agg('r.' || quote_ident(c), ', ') FROM unnest(cols) c),
+    (SELECT coalesce(string_agg(format('%1$I = EXCLUDED.%1$I', c), ', '), 'apn = EXCLUDED.apn')
+     FROM unnest(cols) c WHERE c <> 'apn')
+  ) USING parcel_data;
+
+  GET DIAGNOSTICS upsert_count = ROW_COUNT;
+
+  RETURN QUERY SELECT upsert_count;
+END;
+$$;
+
+COMMENT ON FUNCTION public.upsert_parcels IS 'Batch upsert of parcel records (JSONB array) on apn; geometry may be hex-EWKB, EWKT or GeoJSON.';
+
+-- Example usage:
+-- SELECT * FROM upsert_parcels('[
+--   {"apn": "010420001", "city": "Layton", "geom": "0106000020E610000001000000010300000001000000040000009A99999999F95BC00000000000804440295C8FC2F5F85BC00000000000804440295C8FC2F5F85BC0E17A14AE478144409A99999999F95BC00000000000804440"}
+-- ]'::jsonb);